@@ -0,0 +1,229 @@
+import os
+import random
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_control import ThreadGate
+from telemetry import get_telemetry
+
+# Point API_BASE_URL at a local stub (see mock_api.py) to test without hitting api.2b2t.dev
+API_BASE_URL = os.environ.get('API_BASE_URL', 'https://api.2b2t.dev').rstrip('/')
+
+# Shared request policy for the threaded and asyncio clients
+REQUEST_TIMEOUT = 60
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5  # Seconds, doubled on every retry
+RETRY_BACKOFF_MAX = 30
+RETRY_JITTER = 0.5  # Up to this many seconds added at random to each backoff, so retries don't arrive in step
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+NO_DATA_STATUSES = (404,)  # The API has nothing on the player; stored as such, not as a failure
+DEFAULT_POOL_SIZE = 32
+
+_session = None
+_session_lock = Lock()
+_pool_size = DEFAULT_POOL_SIZE
+_rate_controller = None
+_thread_gate = None
+_response_cache = None
+_circuit_breaker = None
+
+# A request that failed for good: retries used up on connection errors,
+# timeouts or 429/5xx, an unexpected status, or a body that isn't JSON. Callers
+# keep what they already have stored rather than writing an empty row over it.
+class FetchFailed(Exception):
+    pass
+
+def all_stats_url():
+    return f"{API_BASE_URL}/stats?username=all"
+
+def event_url(event, username):
+    return f"{API_BASE_URL}/stats?{event}={username}"
+
+def seen_url(username):
+    return f"{API_BASE_URL}/seen?username={username}"
+
+def configure_session(pool_size=DEFAULT_POOL_SIZE):
+    # Size the per-host pool to the worker count so no thread has to open a
+    # throwaway connection because every pooled one is checked out. Under rate
+    # control urllib3 leaves 429/5xx alone: http_get() retries them itself, one
+    # gated attempt at a time, so the controller sees every throttled answer
+    # and its Retry-After instead of only the last of a chain.
+    global _session, _pool_size
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        backoff_max=RETRY_BACKOFF_MAX,
+        backoff_jitter=RETRY_JITTER,
+        status_forcelist=() if _rate_controller else RETRY_STATUSES,
+        allowed_methods=['GET'],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = session
+        _pool_size = pool_size
+    return session
+
+def get_session():
+    with _session_lock:
+        session = _session
+    return session or configure_session()
+
+def configure_rate_control(controller):
+    # Every http_get() and asyncio crawl waits on this controller from now on
+    global _rate_controller, _thread_gate
+    _rate_controller = controller
+    _thread_gate = ThreadGate(controller) if controller else None
+    if _session is not None:
+        configure_session(_pool_size)  # Who retries 429/5xx just changed
+    telemetry = get_telemetry()
+    if telemetry and controller:
+        gate = _thread_gate
+        telemetry.add_gauge('requests_in_flight', lambda: gate.in_flight, client='threads')
+        telemetry.add_gauge('concurrency_limit', lambda: controller.current_limit)
+
+def get_rate_controller():
+    return _rate_controller
+
+def configure_circuit_breaker(breaker):
+    # http_get() and the asyncio fetch_json() hold every request while it is open
+    global _circuit_breaker
+    _circuit_breaker = breaker
+    telemetry = get_telemetry()
+    if telemetry and breaker:
+        telemetry.add_gauge('circuit_breaker_open', lambda: int(breaker.is_open))
+
+def get_circuit_breaker():
+    return _circuit_breaker
+
+def configure_response_cache(cache):
+    # http_get() and the asyncio fetch_json() consult this cache from now on
+    global _response_cache
+    _response_cache = cache
+
+def get_response_cache():
+    return _response_cache
+
+def cached_response(url, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'application/json'
+    response._content = body
+    return response
+
+def _gated_get(url, headers=None, priority=False):
+    # One HTTP attempt, holding a gate slot and recorded as such
+    gate = _thread_gate
+    breaker = _circuit_breaker
+    telemetry = get_telemetry()
+    if breaker:
+        breaker.wait()
+    if gate:
+        gate.acquire(priority)
+    started = time.monotonic()
+    try:
+        response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        if gate:
+            gate.release(time.monotonic() - started)
+        if breaker:
+            breaker.record(None)
+        if telemetry:
+            telemetry.record_request(url, time.monotonic() - started, None)
+        raise
+    latency = time.monotonic() - started
+    if gate:
+        gate.release(latency, response.status_code, response.headers.get('Retry-After'))
+    if breaker:
+        breaker.record(response.status_code)
+    if telemetry:
+        size = response.headers.get('Content-Length')
+        telemetry.record_request(url, latency, response.status_code, int(size) if size else len(response.content))
+    return response
+
+def http_get(url, priority=False, revalidate=False):
+    cache = _response_cache
+    cached = cache.lookup(url, revalidate) if cache else None
+    if cached and cached.fresh:
+        telemetry = get_telemetry()
+        if telemetry:
+            telemetry.record_cached(url)
+        return cached_response(url, cached.body)
+
+    # Under rate control each retry of a 429/5xx is an attempt of its own, with
+    # the same backoff as the asyncio client; otherwise urllib3 retried already
+    headers = cached.revalidation_headers() if cached else None
+    attempts = RETRY_TOTAL + 1 if _thread_gate else 1
+    for attempt in range(attempts):
+        if attempt:
+            backoff = min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+            time.sleep(backoff + random.uniform(0, RETRY_JITTER))
+        response = _gated_get(url, headers, priority)
+        if response.status_code not in RETRY_STATUSES:
+            break
+    if cache:
+        if response.status_code == 304 and cached:
+            cache.renew(cached)
+            return cached_response(url, cached.body)
+        if response.status_code == 200:
+            cache.store(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response
+
+def get_json(url, priority=False, revalidate=False):
+    # The decoded body of a 200, or None when the API confirms it has nothing.
+    # Raises FetchFailed otherwise. `priority` lets the request past ordinary
+    # ones waiting on the rate gate; `revalidate` asks the API even when the
+    # response cache holds a fresh copy, for data known to have changed.
+    try:
+        response = http_get(url, priority, revalidate)
+    except requests.RequestException as e:
+        raise FetchFailed(f"{url}: {e}") from e
+    if response.status_code in NO_DATA_STATUSES:
+        return None
+    if response.status_code != 200:
+        raise FetchFailed(f"{url}: HTTP {response.status_code}")
+    try:
+        return response.json()
+    except ValueError as e:
+        raise FetchFailed(f"{url}: {e}") from e
+
+def connection_stats():
+    stats = {'requests': 0, 'connections': 0}
+    session = _session
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+    return stats
+
+def report_connection_stats(stats):
+    requests_made = stats['requests']
+    reused = max(requests_made - stats['connections'], 0)
+    reuse_rate = reused / requests_made * 100 if requests_made else 0
+    print(f"HTTP: {requests_made} requests over {stats['connections']} connections "
+          f"({reused} reused, {reuse_rate:.1f}% reuse)")
+    if _rate_controller:
+        print(_rate_controller.summary())
+    if _circuit_breaker and _circuit_breaker.trips:
+        print(_circuit_breaker.summary())
+    if _response_cache:
+        print(_response_cache.summary())
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+from api import (REQUEST_TIMEOUT, RETRY_TOTAL, RETRY_BACKOFF, RETRY_BACKOFF_MAX, RETRY_JITTER, RETRY_STATUSES,
+                 NO_DATA_STATUSES, FetchFailed, get_circuit_breaker, get_rate_controller, get_response_cache)
+from db_writer import WriterFailed
+from rate_control import AdaptiveController, AsyncGate
+from telemetry import get_telemetry
+
+DEFAULT_MAX_IN_FLIGHT = 64  # Total requests allowed in flight against the API
+KEEPALIVE_TIMEOUT = 30
+
+async def fetch_json(session, limiter, url, priority=False, revalidate=False):
+    # The decoded body of a 200, or None when the API confirms it has nothing;
+    # raises FetchFailed once the retries are used up, like api.get_json()
+    cache = get_response_cache()
+    breaker = get_circuit_breaker()
+    telemetry = get_telemetry()
+    cached = cache.lookup(url, revalidate) if cache else None
+    if cached and cached.fresh:
+        if telemetry:
+            telemetry.record_cached(url)
+        return json.loads(cached.body)
+    headers = cached.revalidation_headers() if cached else None
+
+    failure = None
+    for attempt in range(RETRY_TOTAL + 1):
+        if attempt:
+            backoff = min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+            await asyncio.sleep(backoff + random.uniform(0, RETRY_JITTER))
+        probe = await breaker.wait_async() if breaker else False
+        answered = False
+        try:
+            await limiter.acquire(priority)
+            started = time.monotonic()
+            status = retry_after = None
+            size = 0
+            try:
+                async with session.get(url, headers=headers) as response:
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+                    size = response.content_length or 0
+                    if status == 304 and cached:
+                        cache.renew(cached)
+                        return json.loads(cached.body)
+                    if status == 200:
+                        body = await response.read()
+                        size = size or len(body)
+                        try:
+                            data = json.loads(body)
+                        except ValueError as e:
+                            # The API answered; asking again would get the same body
+                            raise FetchFailed(f"{url}: {e}") from e
+                        if cache:
+                            cache.store(url, body, response.headers.get('ETag'),
+                                        response.headers.get('Last-Modified'))
+                        return data
+                    if status in NO_DATA_STATUSES:
+                        return None
+                    failure = f"HTTP {status}"
+                    if status not in RETRY_STATUSES:
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failure = str(e) or type(e).__name__
+                answered = True  # No answer at all is the breaker's idea of a failure
+            finally:
+                # Only a request cancelled before any status came back goes unrecorded
+                answered = answered or status is not None
+                latency = time.monotonic() - started
+                if breaker and answered:
+                    breaker.record(status)
+                if telemetry:
+                    telemetry.record_request(url, latency, status, size)
+                await limiter.release(latency, status, retry_after)
+        finally:
+            if probe and not answered:
+                breaker.end_probe()
+    raise FetchFailed(f"{url}: {failure}")
+
+def connection_tracer(stats):
+    async def on_request_start(session, context, params):
+        stats['requests'] += 1
+
+    async def on_connection_create_end(session, context, params):
+        stats['connections'] += 1
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return trace
+
+async def crawl(usernames, handle_user, max_in_flight=DEFAULT_MAX_IN_FLIGHT, on_result=None, stop=None):
+    # The request budget caps both the connection pool and the number of users
+    # being worked on; every request also passes through the shared limiter,
+    # which the configured rate controller may hold below that budget. Setting
+    # `stop` (a threading.Event) lets workers finish their user and then exit.
+    stats = {'requests': 0, 'connections': 0}
+    controller = get_rate_controller() or AdaptiveController(max_in_flight, adaptive=False)
+    limiter = AsyncGate(controller)
+    telemetry = get_telemetry()
+    if telemetry:
+        telemetry.add_gauge('requests_in_flight', lambda: limiter.in_flight, client='asyncio')
+        telemetry.add_gauge('concurrency_limit', lambda: controller.current_limit)
+    connector = aiohttp.TCPConnector(limit=max_in_flight, limit_per_host=max_in_flight,
+                                     keepalive_timeout=KEEPALIVE_TIMEOUT)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={'Accept-Encoding': 'gzip'},
+                                     trace_configs=[connection_tracer(stats)]) as session:
+        pending = iter(usernames)
+
+        async def worker():
+            for username in pending:
+                if stop is not None and stop.is_set():
+                    break
+                try:
+                    result = await handle_user(session, limiter, username)
+                except WriterFailed:
+                    raise  # Nothing more can be saved; ends the crawl
+                except Exception as e:
+                    print(f"Error updating user data for {username}: {e}")
+                    result = None
+                if on_result:
+                    on_result(result)
+                if telemetry:
+                    telemetry.count('users_completed_total')
+
+        await asyncio.gather(*(worker() for _ in range(max_in_flight)))
+
+    return stats
+
+def run_crawl(usernames, handle_user, max_in_flight=DEFAULT_MAX_IN_FLIGHT, on_result=None, stop=None):
+    return asyncio.run(crawl(usernames, handle_user, max_in_flight, on_result, stop))
@@ -0,0 +1,98 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from history import HISTORY_SCHEMA, PLAYER_ID_INDEX, player_stats_as_of, run_at, stats_as_of, top_gainers
+from planner import COUNTERS
+
+# Times the stats history queries on a synthetic year of weekly feed updates:
+# --players players, --active-share of them moving each week. Also prints how
+# big the history is next to keeping a full copy of the counters every run:
+#   python bench_history.py --players 200000 --runs 52 --active-share 0.05
+
+WEEK = 7 * 86400
+
+def build(scratch, players, runs, active_share, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(os.path.join(scratch, 'players.db'))
+    conn.execute('CREATE TABLE players (username TEXT PRIMARY KEY, id INTEGER, kills INTEGER, deaths INTEGER, '
+                 'joins INTEGER, leaves INTEGER)')
+    conn.execute('ATTACH DATABASE ? AS history', (os.path.join(scratch, 'stats_history.db'),))
+    for statement in HISTORY_SCHEMA:
+        conn.execute(statement)
+    counters = {i: [rng.randrange(100) for _ in COUNTERS] for i in range(1, players + 1)}
+    start = int(time.time()) - runs * WEEK
+    conn.execute('INSERT INTO history.stats_runs VALUES (1, ?, ?)', (start, players))
+    conn.executemany('INSERT INTO history.stats_deltas VALUES (1, ?, ?, ?, ?, ?)',
+                     ((i, *values) for i, values in counters.items()))
+    for run in range(2, runs + 2):
+        moved = rng.sample(range(1, players + 1), int(players * active_share))
+        deltas = []
+        for i in sorted(moved):
+            delta = [rng.randrange(20), rng.randrange(10), rng.randrange(1, 5), rng.randrange(1, 5)]
+            counters[i] = [value + change for value, change in zip(counters[i], delta)]
+            deltas.append((run, i, *delta))
+        conn.execute('INSERT INTO history.stats_runs VALUES (?, ?, ?)', (run, start + (run - 1) * WEEK, len(deltas)))
+        conn.executemany('INSERT INTO history.stats_deltas VALUES (?, ?, ?, ?, ?, ?)', deltas)
+    conn.executemany('INSERT INTO players VALUES (?, ?, ?, ?, ?, ?)',
+                     ((f'player{i:08d}', i, *values) for i, values in counters.items()))
+    conn.execute(PLAYER_ID_INDEX)
+    conn.commit()
+    conn.close()
+    return start
+
+def full_snapshot_size(scratch, players, runs):
+    # One (run, player id, counters) row per player per run, for comparison
+    conn = sqlite3.connect(os.path.join(scratch, 'snapshots.db'))
+    conn.execute('CREATE TABLE snapshots (run INTEGER, player_id INTEGER, kills INTEGER, deaths INTEGER, '
+                 'joins INTEGER, leaves INTEGER, PRIMARY KEY (run, player_id)) WITHOUT ROWID')
+    conn.execute('''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+    INSERT INTO snapshots SELECT 1, i, i % 100, i % 100, i % 100, i % 100 FROM n
+    ''', (players,))
+    conn.commit()
+    conn.close()
+    return os.path.getsize(os.path.join(scratch, 'snapshots.db')) * (runs + 1)
+
+def timed(label, fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"  {label:<40} {elapsed * 1000:>9.2f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stats history queries")
+    parser.add_argument('--players', type=int, default=200000)
+    parser.add_argument('--runs', type=int, default=52)
+    parser.add_argument('--active-share', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        start = build(scratch, args.players, args.runs, args.active_share)
+        history_mb = os.path.getsize(os.path.join(scratch, 'stats_history.db')) / 1e6
+        snapshots_mb = full_snapshot_size(scratch, args.players, args.runs) / 1e6
+        print(f"{args.players} players, {args.runs} weekly runs, {args.active_share:.0%} moving each week")
+        print(f"  history {history_mb:.1f} MB, full snapshots every run would be ~{snapshots_mb:.1f} MB")
+
+        conn = sqlite3.connect(os.path.join(scratch, 'players.db'))
+        conn.execute('ATTACH DATABASE ? AS history', (os.path.join(scratch, 'stats_history.db'),))
+        middle = start + (args.runs // 2) * WEEK
+        usernames = [f'player{random.randrange(1, args.players + 1):08d}' for _ in range(1000)]
+        names = iter(usernames * 2)
+        timed('one player as of mid-year', lambda: player_stats_as_of(conn, next(names), middle), repeat=1000)
+        timed('run lookup', lambda: run_at(conn, middle), repeat=1000)
+        for label, when in (('early', start + WEEK * 2), ('mid-year', middle), ('late', start + (args.runs - 2) * WEEK)):
+            timed(f'all players as of {label}', lambda: sum(1 for _ in stats_as_of(conn, when)))
+        now = start + args.runs * WEEK
+        timed('top 10 gainers, last week', lambda: top_gainers(conn, now - WEEK, now))
+        timed('top 10 gainers, last 4 weeks', lambda: top_gainers(conn, now - 4 * WEEK, now))
+        timed('top 10 gainers, whole year', lambda: top_gainers(conn, start, now))
+        conn.close()
+
+if __name__ == "__main__":
+    main()
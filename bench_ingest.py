@@ -0,0 +1,117 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from ingest import DEFAULT_INGEST_BATCH_SIZE, PLAYER_COLUMNS, apply_players
+from refresh import due_on_change_sql, ensure_refresh_columns
+
+# Times applying the bulk stats feed to an existing players.db three ways:
+# a SELECT per player followed by an UPDATE or INSERT (how update_players.py
+# started out), one executemany upsert that rewrites every row, and the staged
+# diff in ingest.py. The feed is generated in memory so only SQLite is timed:
+#   python bench_ingest.py --sizes 200000,1000000 --changed-share 0.05 --new-share 0.01
+
+UPSERT_SQL = f'''
+INSERT INTO players ({', '.join(PLAYER_COLUMNS)})
+VALUES ({', '.join('?' * len(PLAYER_COLUMNS))})
+ON CONFLICT(username) DO UPDATE SET
+{', '.join(f'{column} = excluded.{column}' for column in PLAYER_COLUMNS[1:])},
+{due_on_change_sql('excluded')}
+'''
+
+UPDATE_SQL = f'''
+UPDATE players SET {', '.join(f'{column} = ?' for column in PLAYER_COLUMNS[1:])} WHERE username = ?
+'''
+
+INSERT_SQL = f'''
+INSERT INTO players ({', '.join(PLAYER_COLUMNS)}) VALUES ({', '.join('?' * len(PLAYER_COLUMNS))})
+'''
+
+def build_players(path, count):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE players (
+        username TEXT PRIMARY KEY, id INTEGER, uuid TEXT, kills INTEGER, deaths INTEGER,
+        joins INTEGER, leaves INTEGER, adminlevel INTEGER, lastseen TEXT, lastupdated TEXT
+    )
+    ''')
+    conn.execute('''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+    INSERT INTO players (username, id, uuid, kills, deaths, joins, leaves, adminlevel)
+    SELECT printf('player%08d', i), i, printf('%032x', i * 2654435761), i % 977, i % 613, i % 1409, i % 1409, 0
+    FROM n
+    ''', (count,))
+    conn.commit()
+    ensure_refresh_columns(conn)
+    conn.close()
+
+def make_feed(count, changed_share, new_share, seed=0):
+    # The stored players with `changed_share` of them having moved counters,
+    # plus `new_share` more that are not stored yet, in a shuffled order
+    rng = random.Random(seed)
+    feed = []
+    for i in range(1, count + int(count * new_share) + 1):
+        kills = i % 977 + (1 if rng.random() < changed_share else 0)
+        feed.append({'username': f'player{i:08d}', 'id': i, 'uuid': f'{i * 2654435761:032x}', 'kills': kills,
+                     'deaths': i % 613, 'joins': i % 1409, 'leaves': i % 1409, 'adminlevel': 0})
+    rng.shuffle(feed)
+    return feed
+
+def per_row(conn, feed):
+    cursor = conn.cursor()
+    for player in feed:
+        row = tuple(player[column] for column in PLAYER_COLUMNS)
+        if cursor.execute('SELECT * FROM players WHERE username = ?', (row[0],)).fetchone():
+            cursor.execute(UPDATE_SQL, (*row[1:], row[0]))
+        else:
+            cursor.execute(INSERT_SQL, row)
+    conn.commit()
+
+def upsert(conn, feed):
+    rows = [tuple(player[column] for column in PLAYER_COLUMNS) for player in feed]
+    for start in range(0, len(rows), DEFAULT_INGEST_BATCH_SIZE):
+        conn.executemany(UPSERT_SQL, rows[start:start + DEFAULT_INGEST_BATCH_SIZE])
+        conn.commit()
+
+def staged(conn, feed):
+    stats = apply_players(conn, iter(feed), DEFAULT_INGEST_BATCH_SIZE, history_path=None)
+    return f"{stats['inserted']} new, {stats['changed']} changed, {stats['unchanged']} unchanged"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark applying the bulk stats feed to players.db")
+    parser.add_argument('--sizes', default='200000,1000000', help='Comma-separated player counts')
+    parser.add_argument('--changed-share', type=float, default=0.05,
+                        help="Share of stored players whose counters moved (default: 0.05)")
+    parser.add_argument('--new-share', type=float, default=0.01,
+                        help="New players in the feed, as a share of the stored ones (default: 0.01)")
+    args = parser.parse_args()
+
+    for size in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as scratch:
+            template = os.path.join(scratch, 'template.db')
+            build_players(template, size)
+            feed = make_feed(size, args.changed_share, args.new_share)
+            print(f"{size} stored players, feed of {len(feed)} "
+                  f"({args.changed_share:.0%} changed, {args.new_share:.0%} new):")
+            timings = {}
+            for label, apply in (('select per row', per_row), ('upsert every row', upsert), ('staged diff', staged)):
+                path = os.path.join(scratch, 'players.db')
+                shutil.copy(template, path)
+                conn = sqlite3.connect(path)
+                conn.execute('PRAGMA journal_mode=WAL')
+                started = time.perf_counter()
+                detail = apply(conn, feed)
+                timings[label] = time.perf_counter() - started
+                size_mb = os.path.getsize(path + '-wal') / 1e6
+                conn.close()
+                print(f"  {label:<18} {timings[label]:>7.2f}s   WAL written {size_mb:>7.1f} MB"
+                      + (f"   {detail}" if detail else ''))
+            print(f"  staged diff vs select per row: {timings['select per row'] / timings['staged diff']:.1f}x, "
+                  f"vs upsert: {timings['upsert every row'] / timings['staged diff']:.1f}x\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from message_search import ensure_message_index, match_expression, search_messages
+from storage import EVENT_KINDS, LEGACY_EVENT_DB_PATHS, connect_legacy
+
+# Times message searches across the four event databases: the LIKE '%...%'
+# scan over every file that was the only option before, against the FTS5
+# indexes in message_search.py. Also reports the indexes' size on disk and
+# what the triggers cost on insert:
+#   python bench_message_search.py --players 200000 --queries 200
+
+WEAPONS = ['an End Crystal', 'a Diamond Sword', 'a Netherite Axe', 'a Bow', 'a Trident', 'TNT',
+           'a Respawn Anchor', 'a Crossbow']
+DEATHS = ['{victim} was slain by {killer} using {weapon}', '{victim} was blown up by {killer} using {weapon}',
+          '{victim} was shot by {killer} using {weapon}', '{victim} fell from a high place',
+          '{victim} burned to death', '{victim} drowned whilst trying to escape {killer}']
+
+LIKE_SQL = '''
+SELECT ? AS event, username, date, time, message FROM {event}.{event}
+WHERE message LIKE ?
+'''
+
+# Every hit in no particular order, the same result set as the LIKE scan
+MATCH_SQL = '''
+SELECT ? AS event, e.username, e.date, e.time, e.message
+FROM {event}.{event}_fts JOIN {event}.{event} e ON e.rowid = {event}_fts.rowid
+WHERE {event}_fts MATCH ?
+'''
+
+def generate_messages(count, seed):
+    rng = random.Random(seed)
+    names = [f"{rng.choice(('xX_', '', 'The', 'not_'))}player{i}{rng.choice(('', '_', 'MC', '2007'))}"
+             for i in range(count)]
+    rows = []
+    for i, victim in enumerate(names):
+        killer = names[min(int(rng.paretovariate(1.1)) - 1, count - 1)]
+        message = rng.choice(DEATHS).format(victim=victim, killer=killer, weapon=rng.choice(WEAPONS))
+        rows.append((victim, '2024-01-01', f'{i % 24:02d}:00:00', message))
+    return names, rows
+
+def build(directory, rows, indexed):
+    paths = {event: os.path.join(directory, path) for event, path in LEGACY_EVENT_DB_PATHS.items()}
+    started = time.perf_counter()
+    for event, path in paths.items():
+        conn = sqlite3.connect(path)
+        conn.execute(f'CREATE TABLE {event} (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+        if indexed:
+            ensure_message_index(conn, 'main', event)
+        conn.executemany(f'INSERT OR REPLACE INTO {event} VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+    elapsed = time.perf_counter() - started
+    return paths, elapsed, sum(os.path.getsize(path) for path in paths.values())
+
+def like_all(conn, text):
+    sql = ' UNION ALL '.join(LIKE_SQL.format(event=event) for event in EVENT_KINDS)
+    params = []
+    for event in EVENT_KINDS:
+        params += [event, f'%{text}%']
+    return conn.execute(sql, params).fetchall()
+
+def match_all(conn, text):
+    sql = ' UNION ALL '.join(MATCH_SQL.format(event=event) for event in EVENT_KINDS)
+    params = []
+    for event in EVENT_KINDS:
+        params += [event, match_expression(text)]
+    return conn.execute(sql, params).fetchall()
+
+def time_searches(search, conn, queries):
+    latencies = []
+    hits = 0
+    for text in queries:
+        started = time.perf_counter()
+        hits += len(search(conn, text))
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return sum(latencies) / len(latencies), hits / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FTS5 message search against LIKE scans")
+    parser.add_argument('--players', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=100, help='Searches per query kind')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    names, rows = generate_messages(args.players, args.seed)
+    rng = random.Random(args.seed)
+    kinds = {
+        'any player': [rng.choice(names) for _ in range(args.queries)],
+        'top killer': [names[0]] * args.queries,
+        'end crystal': ['end crystal'] * args.queries,
+    }
+
+    with tempfile.TemporaryDirectory() as plain, tempfile.TemporaryDirectory() as indexed:
+        print(f"Inserting {args.players} messages into each of the four event databases...")
+        _, plain_seconds, plain_bytes = build(plain, rows, False)
+        paths, indexed_seconds, indexed_bytes = build(indexed, rows, True)
+        total = args.players * len(EVENT_KINDS)
+        print(f"  without index  {plain_seconds:>7.2f}s  {total / plain_seconds:>10,.0f} rows/s  "
+              f"{plain_bytes / 2 ** 20:>7.1f} MB")
+        print(f"  with triggers  {indexed_seconds:>7.2f}s  {total / indexed_seconds:>10,.0f} rows/s  "
+              f"{indexed_bytes / 2 ** 20:>7.1f} MB (+{indexed_bytes / plain_bytes - 1:.0%})")
+
+        conn = connect_legacy(':memory:', paths)
+        ranked = lambda conn, text: search_messages(conn, text, limit=args.limit)
+        print(f"Mean time per search: every hit by LIKE and by MATCH, and the best {args.limit} by rank:")
+        for kind, queries in kinds.items():
+            like_mean, hits = time_searches(like_all, conn, queries)
+            match_mean, _ = time_searches(match_all, conn, queries)
+            ranked_mean, _ = time_searches(ranked, conn, queries)
+            print(f"  {kind:<12} {hits:>9,.0f} hits   LIKE {like_mean * 1000:>8.2f} ms   "
+                  f"MATCH {match_mean * 1000:>8.2f} ms ({like_mean / match_mean:>5.1f}x)   "
+                  f"ranked {ranked_mean * 1000:>7.2f} ms")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
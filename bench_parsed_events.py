@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from bench_message_search import generate_messages
+from parsed_events import PARSED_DB_PATH, backfill_parsed_events, connect, update_parsed_events
+from storage import EVENT_KINDS, LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH
+
+# Times parsed_events.py on synthetic databases: the backfill at several
+# worker counts, the pass update_all.py makes after a crawl with nothing and
+# with --changed events new, and two analyses (one player's victims, the top
+# killers with an end crystal) answered by re-parsing every message with a
+# regex and by a query on the parsed table:
+#   python bench_parsed_events.py --players 200000 --workers 0,1,2,4
+
+VICTIMS_SQL = '''
+SELECT victim FROM parsed.parsed_events WHERE killer_id = (SELECT id FROM players WHERE username = ?)
+'''
+
+WEAPON_KILLS_SQL = '''
+SELECT killer, COUNT(*) AS kills FROM parsed.parsed_events
+WHERE weapon = 'an End Crystal' AND killer_id IS NOT NULL
+GROUP BY killer_id ORDER BY kills DESC LIMIT 10
+'''
+
+def build(directory, players, seed):
+    names, rows = generate_messages(players, seed)
+    conn = sqlite3.connect(os.path.join(directory, LEGACY_MAIN_DB_PATH))
+    conn.execute('CREATE TABLE players (username TEXT PRIMARY KEY, id INTEGER)')
+    conn.executemany('INSERT INTO players VALUES (?, ?)', [(name, i + 1) for i, name in enumerate(names)])
+    conn.commit()
+    conn.close()
+    paths = {event: os.path.join(directory, path) for event, path in LEGACY_EVENT_DB_PATHS.items()}
+    for event, path in paths.items():
+        conn = sqlite3.connect(path)
+        conn.execute(f'CREATE TABLE {event} (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+        conn.executemany(f'INSERT INTO {event} VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+    return names, paths
+
+def change_events(paths, names, count, seed):
+    rng = random.Random(seed)
+    for event, path in paths.items():
+        conn = sqlite3.connect(path)
+        conn.executemany(f"UPDATE {event} SET date = '2025-01-01', message = ? WHERE username = ?",
+                         [(f'{name} was slain by {rng.choice(names)} using an End Crystal', name)
+                          for name in rng.sample(names, count)])
+        conn.commit()
+        conn.close()
+
+# The analyses as they had to be done before: read and re-parse every message
+
+def regex_victims(paths, killer):
+    pattern = re.compile(r'(\w+) (?:was slain by|was blown up by|was shot by|drowned whilst trying to escape) '
+                         r'(\w+)(?: using .*)?')
+    victims = []
+    for event, path in paths.items():
+        conn = sqlite3.connect(path)
+        for (message,) in conn.execute(f'SELECT message FROM {event}'):
+            match = pattern.fullmatch(message)
+            if match and match.group(2) == killer:
+                victims.append(match.group(1))
+        conn.close()
+    return victims
+
+def regex_weapon_kills(paths):
+    pattern = re.compile(r'\w+ was (?:slain|blown up|shot) by (\w+) using an End Crystal')
+    kills = Counter()
+    for event, path in paths.items():
+        conn = sqlite3.connect(path)
+        for (message,) in conn.execute(f'SELECT message FROM {event}'):
+            match = pattern.fullmatch(message)
+            if match:
+                kills[match.group(1)] += 1
+        conn.close()
+    return kills.most_common(10)
+
+def compare(label, by_regex, by_query):
+    answers, seconds = [], []
+    for answer in (by_regex, by_query):
+        started = time.perf_counter()
+        answers.append(answer())
+        seconds.append(time.perf_counter() - started)
+    same = 'same' if answers[0] == answers[1] else 'DIFFERENT'
+    print(f"  {label:<24} re-parsing {seconds[0] * 1000:>7.0f} ms   parsed table {seconds[1] * 1000:>7.1f} ms"
+          f"   ({same} answer)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing event messages into parsed_events.db")
+    parser.add_argument('--players', type=int, default=200000)
+    parser.add_argument('--workers', default='0,1,2', help='Comma-separated backfill worker counts')
+    parser.add_argument('--changed', type=int, default=1000, help='Events per table changed before an update')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Generating {args.players} players and their events...")
+        names, paths = build(directory, args.players, args.seed)
+        main_path = os.path.join(directory, LEGACY_MAIN_DB_PATH)
+        parsed_path = os.path.join(directory, PARSED_DB_PATH)
+        total = args.players * len(EVENT_KINDS)
+
+        print(f"Backfill of {total} events:")
+        for workers in map(int, args.workers.split(',')):
+            stats = backfill_parsed_events(main_path, paths, parsed_path, workers=workers)
+            label = f"{workers} workers" if workers else 'in process'
+            print(f"  {label:<12} {stats['seconds']:>7.2f}s  {stats['parsed'] / stats['seconds']:>10,.0f} events/s"
+                  f"   {stats['unmatched']} unmatched")
+
+        stats = update_parsed_events(main_path, paths, parsed_path)
+        print(f"Update with nothing changed:      {stats['seconds']:>7.2f}s")
+        change_events(paths, names, args.changed, args.seed)
+        stats = update_parsed_events(main_path, paths, parsed_path)
+        print(f"Update with {stats['parsed']} events changed: {stats['seconds']:>7.2f}s")
+
+        conn = connect(main_path, paths, parsed_path)
+        killer = random.Random(args.seed).choice(names[:100])
+        print("Analysis:")
+        compare(f"victims of {killer}", lambda: sorted(regex_victims(paths, killer)),
+                lambda: sorted(row[0] for row in conn.execute(VICTIMS_SQL, (killer,))))
+        # Ties at the cut-off can come out in either order, so the counts are compared
+        compare("top end crystal killers", lambda: [kills for _, kills in regex_weapon_kills(paths)],
+                lambda: [kills for _, kills in conn.execute(WEAPON_KILLS_SQL)])
+        conn.close()
+
+if __name__ == "__main__":
+    main()
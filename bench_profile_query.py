@@ -0,0 +1,113 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from mock_api import EVENTS, generate_players, event_record
+from storage import (LEGACY_MAIN_DB_PATH, LEGACY_EVENT_DB_PATHS, connect_legacy,
+                     legacy_profile, unified_profile, migrate)
+
+# Times the "player profile" lookup (player row plus their four events) on the
+# five-file layout and on the unified one. Without --legacy-dir it builds
+# synthetic legacy files from mock_api's players first, e.g.
+#   python bench_profile_query.py --players 200000 --queries 20000
+
+def build_legacy(directory, count, seed):
+    players = generate_players(count, seed)
+    conn = sqlite3.connect(os.path.join(directory, LEGACY_MAIN_DB_PATH))
+    conn.execute('''
+    CREATE TABLE players (
+        username TEXT PRIMARY KEY, id INTEGER, uuid TEXT, kills INTEGER, deaths INTEGER,
+        joins INTEGER, leaves INTEGER, adminlevel INTEGER, lastseen TEXT, lastupdated TEXT
+    )
+    ''')
+    conn.executemany('INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(p['username'], p['id'], p['uuid'], p['kills'], p['deaths'], p['joins'],
+                       p['leaves'], p['adminlevel'], p['seen'], '2024-01-01T00:00:00')
+                      for p in players.values()])
+    conn.commit()
+    conn.close()
+
+    for event in EVENTS:
+        conn = sqlite3.connect(os.path.join(directory, LEGACY_EVENT_DB_PATHS[event]))
+        conn.execute(f'CREATE TABLE {event} (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+        rows = []
+        for player in players.values():
+            if player['seen']:
+                record = event_record(player, event) or {}
+                rows.append((player['username'], record.get('date'), record.get('time'), record.get('message')))
+        conn.executemany(f'INSERT INTO {event} VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+    return list(players)
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def time_queries(label, connect, profile, usernames, reconnect):
+    # reconnect=True opens a connection per lookup, like a CGI script or a cold worker
+    latencies = []
+    conn = None if reconnect else connect()
+    started = time.perf_counter()
+    for username in usernames:
+        query_started = time.perf_counter()
+        if reconnect:
+            conn = connect()
+        profile(conn, username)
+        if reconnect:
+            conn.close()
+        latencies.append(time.perf_counter() - query_started)
+    elapsed = time.perf_counter() - started
+    if not reconnect:
+        conn.close()
+
+    latencies.sort()
+    print(f"  {label:<28} {len(usernames) / elapsed:>9.0f} q/s   "
+          f"p50 {percentile(latencies, 0.5) * 1e6:>7.0f}us   p99 {percentile(latencies, 0.99) * 1e6:>7.0f}us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the player profile query before and after migration")
+    parser.add_argument('--legacy-dir', default=None,
+                        help='Directory holding existing legacy databases (default: generate synthetic ones)')
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.legacy_dir or scratch
+        if args.legacy_dir:
+            conn = sqlite3.connect(os.path.join(directory, LEGACY_MAIN_DB_PATH))
+            usernames = [row[0] for row in conn.execute('SELECT username FROM players')]
+            conn.close()
+        else:
+            print(f"Generating legacy databases for {args.players} players...")
+            usernames = build_legacy(directory, args.players, args.seed)
+
+        main_path = os.path.join(directory, LEGACY_MAIN_DB_PATH)
+        event_paths = {event: os.path.join(directory, path) for event, path in LEGACY_EVENT_DB_PATHS.items()}
+        unified_path = os.path.join(scratch, 'unified.db')
+
+        started = time.perf_counter()
+        migrate(unified_path, main_path, event_paths)
+        print(f"Migrated in {time.perf_counter() - started:.2f}s")
+
+        rng = random.Random(args.seed)
+        sample = [rng.choice(usernames) for _ in range(args.queries)]
+        connect_before = lambda: connect_legacy(main_path, event_paths)
+        connect_after = lambda: sqlite3.connect(unified_path)
+
+        print(f"Player profile lookups ({args.queries} random players):")
+        time_queries("five files, warm connection", connect_before, legacy_profile, sample, False)
+        time_queries("unified, warm connection", connect_after, unified_profile, sample, False)
+        time_queries("five files, per lookup", connect_before, legacy_profile, sample, True)
+        time_queries("unified, per lookup", connect_after, unified_profile, sample, True)
+
+        for label, paths in (("five files", [main_path, *event_paths.values()]), ("unified", [unified_path])):
+            size = sum(os.path.getsize(path) for path in paths)
+            print(f"  {label:<28} {size / 1e6:>9.1f} MB on disk in {len(paths)} file(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Barrier, Thread
+
+from bench_profile_query import build_legacy, percentile
+from storage import LEGACY_MAIN_DB_PATH
+from timestamps import migrate_epochs
+
+# Load test for query_server.py: starts it in its own process on synthetic
+# databases (or --dir), then runs --concurrency client threads with keep-alive
+# connections against it for --seconds at each level, and reports queries/s
+# and latency with the result cache on and off. Profile lookups follow a
+# skewed popularity, and a share of requests are leaderboards and recent
+# activity. --write-interval commits to players.db while it runs, so the cache
+# keeps being invalidated like it would next to a crawl:
+#   python bench_query_service.py --players 200000 --concurrency 1,4,16,64 --seconds 5
+
+PROFILE_SHARE = 0.9
+LEADERBOARD_SHARE = 0.05  # The rest is recent activity
+HOT_SKEW = 1.2  # Pareto shape for profile popularity; lower is more skewed
+
+def start_service(directory, cache_entries, pool_size):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_server.py'),
+               '--dir', directory, '--port', '0', '--cache-entries', str(cache_entries),
+               '--pool-size', str(pool_size)]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    port = int(line.rsplit(':', 1)[1])
+    return proc, port
+
+def pick_request(rng, usernames):
+    roll = rng.random()
+    if roll < PROFILE_SHARE:
+        rank = min(int(rng.paretovariate(HOT_SKEW)) - 1, len(usernames) - 1)
+        return f'/player?username={usernames[rank]}'
+    if roll < PROFILE_SHARE + LEADERBOARD_SHARE:
+        return f"/leaderboard?counter={rng.choice(('kills', 'deaths', 'joins', 'leaves'))}&limit=10"
+    return '/recent?limit=20'
+
+def client(port, usernames, seed, deadline, barrier, latencies, errors):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    barrier.wait()
+    while time.perf_counter() < deadline[0]:
+        started = time.perf_counter()
+        conn.request('GET', pick_request(rng, usernames))
+        response = conn.getresponse()
+        response.read()
+        if response.status >= 500:
+            errors.append(response.status)
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+def run_level(port, usernames, concurrency, seconds):
+    latencies, errors = [], []
+    deadline = [0.0]
+    barrier = Barrier(concurrency + 1)
+    threads = [Thread(target=client, args=(port, usernames, i, deadline, barrier, latencies, errors))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + seconds
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return len(latencies) / seconds, percentile(latencies, 0.5), percentile(latencies, 0.99), len(errors)
+
+def writer(path, interval, stop):
+    # Bumps a random player's kills every `interval` seconds, like a crawl committing
+    import sqlite3
+    conn = sqlite3.connect(path)
+    rng = random.Random(1)
+    count = conn.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+    while not stop:
+        conn.execute('UPDATE players SET kills = kills + 1 WHERE rowid = ?', (rng.randrange(1, count + 1),))
+        conn.commit()
+        time.sleep(interval)
+    conn.close()
+
+def fetch_stats(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', '/stats')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the read-only query service")
+    parser.add_argument('--dir', help='Directory with existing databases (default: generate synthetic ones)')
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--concurrency', default='1,4,16,64', help='Comma-separated client thread counts')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Seconds per concurrency level')
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--cache-entries', type=int, default=10000)
+    parser.add_argument('--write-interval', type=float, default=0,
+                        help='Commit to players.db every this many seconds while testing (default: never)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.dir or scratch
+        main_path = os.path.join(directory, LEGACY_MAIN_DB_PATH)
+        if args.dir:
+            import sqlite3
+            conn = sqlite3.connect(main_path)
+            usernames = [row[0] for row in conn.execute('SELECT username FROM players')]
+            conn.close()
+        else:
+            print(f"Generating databases for {args.players} players...")
+            usernames = build_legacy(directory, args.players, args.seed)
+            migrate_epochs(main_path)
+        random.Random(args.seed).shuffle(usernames)
+
+        stop = []
+        if args.write_interval:
+            Thread(target=writer, args=(main_path, args.write_interval, stop), daemon=True).start()
+
+        for label, cache_entries in (('cache on', args.cache_entries), ('cache off', 0)):
+            proc, port = start_service(directory, cache_entries, args.pool_size)
+            print(f"{label} ({args.pool_size} connections, {cache_entries} cached results):")
+            for concurrency in map(int, args.concurrency.split(',')):
+                rate, p50, p99, errors = run_level(port, usernames, concurrency, args.seconds)
+                print(f"  {concurrency:>4} clients {rate:>9.0f} q/s   p50 {p50 * 1000:>7.2f} ms   "
+                      f"p99 {p99 * 1000:>7.2f} ms" + (f"   {errors} errors" if errors else ''))
+            stats = fetch_stats(port)
+            lookups = stats['hits'] + stats['misses']
+            if lookups:
+                print(f"  cache hit rate {stats['hits'] / lookups:.0%}, {stats['invalidations']} invalidations")
+            proc.terminate()
+            proc.wait()
+        stop.append(True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import time
+from threading import Event, Thread
+
+from api import FetchFailed, configure_rate_control
+from async_crawl import fetch_json, run_crawl
+from mock_api import start_server
+from rate_control import AdaptiveController
+
+# Replays a scripted API slowdown against the asyncio crawler and prints how
+# the rate controller's in-flight limit and throughput follow it, e.g.
+#   python bench_rate_control.py --latency-script "0:0.02,10:0.3,20:0.02" --capacity 40
+
+def sample(controller, stop, interval, rows):
+    started = time.monotonic()
+    last_responses = 0
+    while not stop.wait(interval):
+        responses = controller.responses
+        rows.append((time.monotonic() - started, controller.current_limit,
+                     (responses - last_responses) / interval, controller.throttled))
+        last_responses = responses
+
+def run(args, adaptive):
+    server = start_server(args.players, latency=args.latency, latency_script=args.latency_script,
+                          capacity=args.capacity, retry_after=args.retry_after)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    controller = AdaptiveController(args.max_in_flight, rate=args.rate, adaptive=adaptive)
+    configure_rate_control(controller)
+
+    async def handle_user(session, limiter, username):
+        try:
+            return await fetch_json(session, limiter, f"{base_url}/seen?username={username}")
+        except FetchFailed:
+            return None
+
+    rows = []
+    stop = Event()
+    sampler = Thread(target=sample, args=(controller, stop, args.interval, rows))
+    sampler.start()
+    started = time.monotonic()
+    run_crawl((f"player{i}" for i in range(args.players)), handle_user, args.max_in_flight)
+    elapsed = time.monotonic() - started
+    stop.set()
+    sampler.join()
+    server.shutdown()
+    configure_rate_control(None)
+    return controller, elapsed, rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate controller harness against mock_api.py")
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--max-in-flight', type=int, default=128)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--latency-script', default='0:0.02,10:0.3,20:0.02')
+    parser.add_argument('--capacity', type=int, default=48)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=None)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--mode', choices=('fixed', 'adaptive', 'both'), default='both')
+    args = parser.parse_args()
+
+    modes = {'fixed': (False,), 'adaptive': (True,), 'both': (False, True)}[args.mode]
+    for adaptive in modes:
+        controller, elapsed, rows = run(args, adaptive)
+        print(f"\n{'adaptive' if adaptive else 'fixed'}: {args.players} users in {elapsed:.1f}s")
+        print(f"{'t(s)':>6} {'limit':>6} {'req/s':>8} {'429s':>6}")
+        for at, limit, rate, throttled in rows:
+            print(f"{at:6.1f} {limit:6d} {rate:8.1f} {throttled:6d}")
+        print(controller.summary())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from planner import ensure_crawl_state, stream_planned_users
+from refresh import DUE_KEY, ensure_refresh_columns, weekly_refreshes
+from scheduler import count_usernames
+from timestamps import LASTUPDATED_EPOCH_SQL
+
+# Times update_all.py's choice of players due for a refresh on a synthetic
+# players.db, with the old flat datetime(lastupdated) filter and with the
+# indexed next_due_epoch range, including the one-off migration between the
+# two, and compares how many refreshes a week each schedules:
+#   python bench_refresh_selection.py --sizes 500000,5000000 --stale-share 0.15
+
+DAYS_BETWEEN_UPDATES = 7
+
+def build_players(path, count, stale_share):
+    # Fresh players were crawled within the last week, stale ones 8-30 days ago;
+    # one in ten stale players has never been crawled at all. Last seen is spread
+    # over ten years, most of it long ago, like a server's whole player history.
+    now = datetime.now()
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE players (
+        username TEXT PRIMARY KEY, id INTEGER, uuid TEXT, kills INTEGER, deaths INTEGER,
+        joins INTEGER, leaves INTEGER, adminlevel INTEGER, lastseen TEXT, lastupdated TEXT
+    )
+    ''')
+    conn.execute('''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+    INSERT INTO players
+    SELECT printf('player%08d', i), i, NULL, i % 977, i % 613, i % 1409, i % 1409, 0,
+           strftime('%Y-%m-%d %H:%M:%S', ?, -((i * 104729) % 3650) * ((i * 104729) % 3650) / 3650 || ' days'),
+           CASE
+               WHEN (i * 7919) % 10000 >= ? * 10000 THEN strftime('%Y-%m-%dT%H:%M:%f', ?, -(i % 7) || ' days')
+               WHEN i % 10 = 0 THEN NULL
+               ELSE strftime('%Y-%m-%dT%H:%M:%f', ?, -(8 + i % 23) || ' days')
+           END
+    FROM n
+    ''', (count, now.isoformat(), stale_share, now.isoformat(), now.isoformat()))
+    conn.commit()
+    conn.close()
+    ensure_crawl_state(path)
+
+def time_selection(label, path, where, params, key):
+    started = time.perf_counter()
+    total = count_usernames(path, 'players p', where, params)
+    counted = time.perf_counter()
+    users = stream_planned_users(path, where, params, key=key)
+    first = next(users, None)
+    first_page = time.perf_counter()
+    streamed = (first is not None) + sum(1 for _ in users)
+    finished = time.perf_counter()
+    assert streamed == total, (streamed, total)
+    print(f"  {label:<24} {total:>9} users   count {counted - started:>7.3f}s   "
+          f"first user {first_page - counted:>7.3f}s   all users {finished - counted:>7.3f}s")
+    return finished - started
+
+def time_materialized(path, threshold):
+    # The original selection: one query, every username loaded into a list
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    usernames = [row[0] for row in conn.execute(
+        'SELECT username FROM players WHERE lastupdated IS NULL OR datetime(lastupdated) < ?', (threshold,))]
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"  {'text, one list':<24} {len(usernames):>9} users   {'':>36}all users {elapsed:>7.3f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark selecting the players due for a refresh")
+    parser.add_argument('--sizes', default='500000,5000000', help='Comma-separated player counts')
+    parser.add_argument('--stale-share', type=float, default=0.15,
+                        help='Share of players last crawled more than a week ago (default: 0.15)')
+    args = parser.parse_args()
+
+    threshold = (datetime.now() - timedelta(days=DAYS_BETWEEN_UPDATES)).isoformat()
+    for size in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, 'players.db')
+            print(f"{size} players, {args.stale_share:.0%} due for a refresh:")
+            started = time.perf_counter()
+            build_players(path, size, args.stale_share)
+            print(f"  built in {time.perf_counter() - started:.1f}s")
+
+            time_materialized(path, threshold)
+            before = time_selection('text, keyset by name', path,
+                                    '(p.lastupdated IS NULL OR datetime(p.lastupdated) < ?)', (threshold,),
+                                    'p.username')
+
+            started = time.perf_counter()
+            conn = sqlite3.connect(path)
+            ensure_refresh_columns(conn)
+            print(f"  {'migration':<24} {time.perf_counter() - started:>7.2f}s")
+            players, tiered = weekly_refreshes(conn)
+            conn.close()
+
+            after = time_selection('tiers, index range', path,
+                                   f"p.next_due_epoch < {LASTUPDATED_EPOCH_SQL.format('?')}",
+                                   (datetime.now().isoformat(),), DUE_KEY)
+            print(f"  count plus full stream: {before:.2f}s -> {after:.2f}s ({before / after:.1f}x)")
+            print(f"  refreshes a week: {players} on a flat {DAYS_BETWEEN_UPDATES}-day cycle, "
+                  f"{tiered:.0f} with the tier table ({players / tiered:.1f}x fewer) before stat changes\n")
+
+if __name__ == "__main__":
+    main()
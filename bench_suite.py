@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from mock_api import generate_players, start_server
+
+# End-to-end throughput of update_all.py and the per-table scripts against a
+# local mock_api.py, so runs can be compared across commits without touching
+# api.2b2t.dev. Each target runs in its own process (for a clean peak RSS) on a
+# fresh copy of a synthetic database, and the results are written as JSON:
+#   python bench_suite.py --players 20000 --latency 0.01 --output before.json
+#   python bench_suite.py --players 20000 --latency 0.01 --output after.json --compare before.json
+
+TARGETS = {
+    'update_players': ('update_players', 'update_database'),
+    'update_all': ('update_all', 'update_all_data'),
+    'update_lastseen': ('update_lastseen', 'update_lastseen_data'),
+    'update_lastkill': ('update_lastkill', 'update_lastkill_data'),
+    'update_lastdeath': ('update_lastdeath', 'update_lastdeath_db'),
+    'update_firstkill': ('update_firstkill', 'update_firstkill_db'),
+    'update_firstdeath': ('update_firstdeath', 'update_firstdeath_db'),
+}
+CRAWL_MODES = ('sync', 'async')
+RESULT_PREFIX = 'BENCH_RESULT '
+COMPARED_METRICS = ('users_per_s', 'requests_per_s', 'latency_p50_ms', 'latency_p99_ms', 'user_p50_ms',
+                    'peak_rss_mb')
+
+def build_fixture(directory, count, seed):
+    # What the scripts expect to find before a crawl: the players table, and the
+    # lastdeath/firstkill/firstdeath tables with every user still to be checked
+    players = generate_players(count, seed)
+    conn = sqlite3.connect(os.path.join(directory, 'players.db'))
+    conn.execute('''
+    CREATE TABLE players (
+        username TEXT PRIMARY KEY, id INTEGER, uuid TEXT, kills INTEGER, deaths INTEGER,
+        joins INTEGER, leaves INTEGER, adminlevel INTEGER, lastseen TEXT, lastupdated TEXT
+    )
+    ''')
+    conn.executemany('INSERT INTO players (username, id, uuid, kills, deaths, joins, leaves, adminlevel) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(p['username'], p['id'], p['uuid'], p['kills'], p['deaths'], p['joins'],
+                       p['leaves'], p['adminlevel']) for p in players.values()])
+    conn.commit()
+    conn.close()
+
+    for table in ('lastdeath', 'firstkill', 'firstdeath'):
+        conn = sqlite3.connect(os.path.join(directory, f'{table}.db'))
+        conn.execute(f'CREATE TABLE {table} (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+        conn.executemany(f'INSERT INTO {table} (username) VALUES (?)', [(name,) for name in players])
+        conn.commit()
+        conn.close()
+
+def percentile_ms(samples, fraction):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+def run_child(args):
+    # Runs one target in this process and prints its numbers on a RESULT_PREFIX line
+    from requests.adapters import HTTPAdapter
+
+    import async_crawl
+    from api import all_stats_url, configure_rate_control
+    from http_cache import cache_key
+    from rate_control import AdaptiveController
+
+    samples = []
+
+    # Time every HTTP attempt at the transport of both clients, as (url, start, end)
+    original_send = HTTPAdapter.send
+
+    def timed_send(self, request, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original_send(self, request, **kwargs)
+        finally:
+            samples.append((request.url, started, time.perf_counter()))
+
+    HTTPAdapter.send = timed_send
+
+    original_tracer = async_crawl.connection_tracer
+
+    def timed_tracer(stats):
+        trace = original_tracer(stats)
+
+        async def on_request_start(session, context, params):
+            context.bench_started = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            samples.append((str(params.url), context.bench_started, time.perf_counter()))
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        return trace
+
+    async_crawl.connection_tracer = timed_tracer
+
+    # Pin the worker count so runs on different machines stay comparable
+    configure_rate_control(AdaptiveController(args.workers, adaptive=False))
+
+    module_name, function_name = TARGETS[args.child]
+    target = getattr(__import__(module_name), function_name)
+    started = time.perf_counter()
+    if args.child == 'update_players':
+        target(all_stats_url(), 'players.db')
+    else:
+        target(use_async=args.mode == 'async', max_in_flight=args.max_in_flight)
+    elapsed = time.perf_counter() - started
+
+    keys = [(cache_key(url), start, end) for url, start, end in samples]
+    latencies = sorted(end - start for key, start, end in keys if key)
+    # A user's latency runs from their first request going out to their last one answering
+    spans = {}
+    for key, start, end in keys:
+        if key:
+            first, last = spans.get(key[1], (start, end))
+            spans[key[1]] = (min(first, start), max(last, end))
+    user_latencies = sorted(last - first for first, last in spans.values())
+    if args.child == 'update_players':
+        conn = sqlite3.connect('players.db')
+        users = conn.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+        conn.close()
+    else:
+        users = len(spans)
+
+    print(RESULT_PREFIX + json.dumps({
+        'users': users,
+        'elapsed': elapsed,
+        'latency_p50_ms': percentile_ms(latencies, 0.5),
+        'latency_p99_ms': percentile_ms(latencies, 0.99),
+        'user_p50_ms': percentile_ms(user_latencies, 0.5),
+    }), flush=True)
+
+def run_target(args, server, fixture, target, mode):
+    workdir = tempfile.mkdtemp(prefix=f'bench-{target}-')
+    shutil.copytree(fixture, workdir, dirs_exist_ok=True)
+    env = dict(os.environ, API_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}",
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, os.path.abspath(__file__), '--child', target, '--mode', mode,
+               '--workers', str(args.workers), '--max-in-flight', str(args.max_in_flight)]
+
+    with server.lock:
+        server.requests = 0
+    proc = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    output = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    requests_made = server.requests
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {'target': target, 'mode': mode, 'returncode': proc.returncode,
+              'requests': requests_made, 'peak_rss_mb': usage.ru_maxrss / 1024}
+    lines = [line for line in output.splitlines() if line.startswith(RESULT_PREFIX)]
+    if proc.returncode or not lines:
+        print(f"{target} ({mode}) failed with exit code {proc.returncode}:")
+        print('\n'.join(output.replace('\r', '\n').splitlines()[-20:]))
+        return result
+
+    result.update(json.loads(lines[-1][len(RESULT_PREFIX):]))
+    elapsed = result['elapsed']
+    result['users_per_s'] = result['users'] / elapsed if elapsed else None
+    result['requests_per_s'] = requests_made / elapsed if elapsed else None
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def format_metric(value):
+    return '-' if value is None else f"{value:.1f}"
+
+def print_results(results, baseline=None):
+    previous = {(r['target'], r['mode']): r for r in (baseline or {}).get('results', [])}
+    print(f"\n{'target':<18} {'mode':<6} {'users':>7} {'users/s':>9} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'user ms':>8} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['target']:<18} {r['mode']:<6} {r.get('users', 0):>7} "
+              + ' '.join(f"{format_metric(r.get(m)):>{9 if m.endswith('_s') else 8}}" for m in COMPARED_METRICS))
+        before = previous.get((r['target'], r['mode']))
+        if before:
+            changes = []
+            for metric in COMPARED_METRICS:
+                old, new = before.get(metric), r.get(metric)
+                changes.append(f"{(new / old - 1) * 100:+.0f}%" if old and new is not None else '-')
+            print(f"{'':<18} {'vs':<6} {'':>7} " + ' '.join(
+                f"{change:>{9 if m.endswith('_s') else 8}}" for m, change in zip(COMPARED_METRICS, changes)))
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmarks against mock_api.py")
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds of mock API latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests the mock fails with a 500')
+    parser.add_argument('--capacity', type=int, default=0, help='Concurrent requests before the mock answers 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help=f"Comma-separated subset of: {', '.join(TARGETS)}")
+    parser.add_argument('--modes', default=','.join(CRAWL_MODES), help='Comma-separated subset of: sync, async')
+    parser.add_argument('--workers', type=int, default=16, help='Worker threads for the sync crawls')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Requests in flight for the async crawls')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Earlier results file to print changes against')
+    parser.add_argument('--child', choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', choices=CRAWL_MODES, default='sync', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    server = start_server(args.players, latency=args.latency, seed=args.seed,
+                          capacity=args.capacity, error_rate=args.error_rate)
+    fixture = tempfile.mkdtemp(prefix='bench-fixture-')
+    build_fixture(fixture, args.players, args.seed)
+
+    results = []
+    for target in args.targets.split(','):
+        # The bulk stats pull has no per-user crawl, so it only runs once
+        for mode in (['sync'] if target == 'update_players' else args.modes.split(',')):
+            print(f"Running {target} ({mode})...", flush=True)
+            results.append(run_target(args, server, fixture, target, mode))
+    server.shutdown()
+    shutil.rmtree(fixture, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': {key: getattr(args, key) for key in ('players', 'latency', 'error_rate', 'capacity', 'seed',
+                                                       'workers', 'max_in_flight')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
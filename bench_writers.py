@@ -0,0 +1,55 @@
+import argparse
+import os
+import tempfile
+import time
+
+from db_writer import BatchWriter, WriterPool
+from update_all import EVENT_DB_PATHS, EVENT_INSERT_SQL, EVENT_TABLE_SCHEMA
+
+# Times writing the same event rows to the four event databases through one
+# BatchWriter with all four attached (how update_all.py used to do it) and
+# through a WriterPool with a writer per database:
+#   python bench_writers.py --rows 200000 --synchronous FULL
+
+def event_rows(count):
+    for i in range(count):
+        event = list(EVENT_DB_PATHS)[i % len(EVENT_DB_PATHS)]
+        yield event, (f'player{i // len(EVENT_DB_PATHS):08d}', '2024-01-01', '12:00:00',
+                      f'player{i:08d} was slain by player{i + 1:08d} using an End Crystal')
+
+def single_writer(directory, rows, batch_size, synchronous):
+    paths = {event: os.path.join(directory, path) for event, path in EVENT_DB_PATHS.items()}
+    writer = BatchWriter(':memory:', batch_size, synchronous=synchronous, attach=paths,
+                         setup=[EVENT_TABLE_SCHEMA.format(db=event) for event in paths], name='events').start()
+    for event, params in event_rows(rows):
+        writer.put(EVENT_INSERT_SQL[event], params)
+    writer.close()
+    return f"{writer.commits} commits"
+
+def writer_pool(directory, rows, batch_size, synchronous):
+    pool = WriterPool({event: BatchWriter(':memory:', batch_size, synchronous=synchronous,
+                                          attach={event: os.path.join(directory, path)},
+                                          setup=[EVENT_TABLE_SCHEMA.format(db=event)], name=event)
+                       for event, path in EVENT_DB_PATHS.items()}).start()
+    for event, params in event_rows(rows):
+        pool[event].put(EVENT_INSERT_SQL[event], params)
+    pool.close()
+    return pool.summary()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one attached event writer against a writer pool")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--synchronous', default='FULL')
+    args = parser.parse_args()
+
+    print(f"{args.rows} event rows, batches of {args.batch_size}, synchronous={args.synchronous}")
+    for label, write in (('one writer, four attached', single_writer), ('writer pool', writer_pool)):
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            detail = write(directory, args.rows, args.batch_size, args.synchronous)
+            elapsed = time.perf_counter() - started
+            print(f"  {label:<26} {elapsed:>7.2f}s  {args.rows / elapsed:>10,.0f} rows/s   {detail}")
+
+if __name__ == "__main__":
+    main()
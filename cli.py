@@ -0,0 +1,63 @@
+import argparse
+import atexit
+
+from api import configure_circuit_breaker, configure_rate_control, configure_response_cache
+from async_crawl import DEFAULT_MAX_IN_FLIGHT
+from db_writer import DEFAULT_BATCH_SIZE, DEFAULT_SYNCHRONOUS, SYNCHRONOUS_MODES
+from http_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_CACHE_MAX_MB
+from profiling import CrawlProfiler, DEFAULT_PROFILE_DIR
+from rate_control import AdaptiveController, CircuitBreaker, BREAKER_THRESHOLD, BREAKER_COOLDOWN
+from telemetry import Telemetry, configure_telemetry, DEFAULT_METRICS_INTERVAL
+
+def build_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Crawl with asyncio instead of the thread pool')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f'Requests in flight for --async, and the ceiling for --adaptive/--rate (default: {DEFAULT_MAX_IN_FLIGHT})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Rows per SQLite commit (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--synchronous', choices=SYNCHRONOUS_MODES, default=DEFAULT_SYNCHRONOUS,
+                        type=str.upper, help=f'SQLite synchronous setting for writers (default: {DEFAULT_SYNCHRONOUS})')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adjust requests in flight (up to --max-in-flight) from API latency and errors')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Ceiling on requests per second (token bucket)')
+    parser.add_argument('--breaker-threshold', type=int, default=BREAKER_THRESHOLD,
+                        help=f'Failed requests in a row that pause the crawl until the API answers again; '
+                             f'0 turns the circuit breaker off (default: {BREAKER_THRESHOLD})')
+    parser.add_argument('--breaker-cooldown', type=float, default=BREAKER_COOLDOWN,
+                        help=f'Seconds the crawl pauses before probing the API, doubled while it keeps '
+                             f'failing (default: {BREAKER_COOLDOWN:g})')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Only crawl the users whose requests failed on earlier runs (the dead_letters table)')
+    parser.add_argument('--cache', action='store_true',
+                        help='Serve recent per-player responses from an on-disk cache and revalidate older ones')
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH,
+                        help=f'Response cache file for --cache (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help=f'Size cap for --cache; oldest responses are evicted past it (default: {DEFAULT_CACHE_MAX_MB})')
+    parser.add_argument('--metrics-dir', default=None,
+                        help='Write crawl telemetry to metrics.json and metrics.prom in this directory')
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_METRICS_INTERVAL,
+                        help=f'Seconds between --metrics-dir snapshots (default: {DEFAULT_METRICS_INTERVAL:g})')
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, default=None, metavar='DIR',
+                        help=f'Profile CPU per thread and stage; writes .pstats files and summary.txt to DIR '
+                             f'(default: {DEFAULT_PROFILE_DIR})')
+    return parser
+
+def configure_from_args(args):
+    # Applies the process-wide HTTP options; call before starting a crawl
+    if args.profile:
+        atexit.register(CrawlProfiler(args.profile).start().finish)
+    if args.metrics_dir:
+        telemetry = Telemetry()
+        configure_telemetry(telemetry)
+        telemetry.start_exporter(args.metrics_dir, args.metrics_interval)
+        atexit.register(telemetry.stop_exporter, args.metrics_dir)
+    if args.adaptive or args.rate:
+        configure_rate_control(AdaptiveController(args.max_in_flight, rate=args.rate, adaptive=args.adaptive))
+    if args.breaker_threshold > 0:
+        configure_circuit_breaker(CircuitBreaker(args.breaker_threshold, args.breaker_cooldown))
+    if args.cache:
+        configure_response_cache(ResponseCache(args.cache_path, max_bytes=args.cache_max_mb * 1024 * 1024))
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sqlite3
+
+from message_search import ensure_message_index, rebuild_message_index
+from message_store import (compact_messages, encode_event_table, expand_event_table, file_size, is_encoded,
+                           read_rate)
+from storage import LEGACY_EVENT_DB_PATHS
+
+# Moves the four event databases to message_store.py's compact layout, or
+# back with --expand, and reports each file's size and how fast its messages
+# read before and after. Files already compact just get their newest rows
+# encoded, which update_all.py also does after every crawl:
+#   python compact_messages.py --dir .
+#   python compact_messages.py --dir . --expand
+
+def convert(path, event, expand):
+    conn = sqlite3.connect(path)
+    indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f'{event}_fts',)).fetchone()
+    detail = ''
+    if expand:
+        if is_encoded(conn, 'main', event):
+            expand_event_table(conn, 'main', event)
+    elif is_encoded(conn, 'main', event):
+        encoded, unmatched = compact_messages(conn, 'main', event)
+        detail = f"{encoded} new messages encoded, {unmatched} kept as written"
+    else:
+        encoded, unmatched = encode_event_table(conn, 'main', event)
+        detail = f"{encoded} messages encoded, {unmatched} kept as written"
+    if indexed:
+        ensure_message_index(conn, 'main', event)
+    conn.execute('VACUUM')
+    # VACUUM may renumber a plain table's rowids, which the search index points at
+    if indexed and not is_encoded(conn, 'main', event):
+        rebuild_message_index(conn, 'main', event)
+    conn.close()
+    return detail
+
+def main():
+    parser = argparse.ArgumentParser(description="Store event messages as template ids and parameters")
+    parser.add_argument('--dir', default='.', help='Directory holding the event databases')
+    parser.add_argument('--expand', action='store_true', help="Write every message out in full again")
+    parser.add_argument('--seconds', type=float, default=1.0, help="Seconds spent timing reads of each file")
+    args = parser.parse_args()
+
+    for event, name in LEGACY_EVENT_DB_PATHS.items():
+        path = os.path.join(args.dir, name)
+        if not os.path.exists(path):
+            print(f"{name}: not found, skipped")
+            continue
+        size, rate = file_size(path), read_rate(path, event, args.seconds)
+        detail = convert(path, event, args.expand)
+        new_size, new_rate = file_size(path), read_rate(path, event, args.seconds)
+        print(f"{name:<14} {size / 2 ** 20:>8.1f} MB -> {new_size / 2 ** 20:>8.1f} MB ({new_size / size - 1:+.0%})   "
+              f"reads {rate:>10,.0f} -> {new_rate:>10,.0f} messages/s   {detail}")
+
+if __name__ == "__main__":
+    main()
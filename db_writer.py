@@ -0,0 +1,221 @@
+import queue
+import sqlite3
+import time
+from queue import Queue
+from threading import Thread
+
+from telemetry import get_telemetry
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 2.0  # Seconds a row may sit in the buffer before it is committed
+DEFAULT_SYNCHRONOUS = 'NORMAL'  # Safe with WAL: a crash can lose the last batch, never corrupt the file
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+PENDING_BATCHES = 4  # Queued rows allowed, in batches, before put() blocks the producer
+PUT_POLL_INTERVAL = 0.5  # Seconds a blocked put() waits before checking the writer is still alive
+
+# The writer thread died (a SQLite error it could not write around, say), so
+# nothing put from then on would ever be committed
+class WriterFailed(Exception):
+    pass
+
+# Owns one SQLite connection on its own thread and group-commits queued rows.
+# Rows are queued as (sql, params) and written with executemany in a single
+# transaction once batch_size rows are buffered or flush_interval seconds have
+# passed, so the fsync of a commit-per-row loop is paid once per batch.
+# Databases in `attach` are attached under their key and share the transaction.
+# The queue is bounded, so producers block instead of piling up rows when
+# SQLite falls behind. If the thread dies, put() and close() raise
+# WriterFailed instead of waiting on a queue no one reads any more.
+class BatchWriter:
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 synchronous=DEFAULT_SYNCHRONOUS, attach=None, setup=(), on_flush=None, max_pending=None,
+                 name=None):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+        self.db_path = db_path
+        self.name = name or db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous.upper()
+        self.attach = attach or {}
+        self.setup = setup
+        self.on_flush = on_flush
+        self.queue = Queue(maxsize=max_pending or batch_size * PENDING_BATCHES)
+        self.rows_written = 0
+        self.commits = 0
+        self.write_seconds = 0.0
+        self.error = None
+        self._thread = Thread(target=self._run, name=f"BatchWriter({self.name})")
+
+    def start(self):
+        telemetry = get_telemetry()
+        if telemetry:
+            telemetry.add_gauge('writer_queue_depth', self.queue.qsize, writer=self.name)
+        self._thread.start()
+        return self
+
+    def put(self, sql, params):
+        self._put((sql, params))
+
+    def _put(self, item):
+        while True:
+            self.check()
+            try:
+                self.queue.put(item, timeout=PUT_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def check(self):
+        if self.error is not None:
+            raise WriterFailed(f"BatchWriter({self.name}) stopped: {self.error}") from self.error
+
+    def close(self):
+        self.stop()
+        self.join()
+        self.check()
+
+    def stop(self):
+        # Queues the sentinel; rows put before it are still written. A dead
+        # writer has nothing left to stop.
+        if self.error is None:
+            try:
+                self._put(None)
+            except WriterFailed:
+                pass
+
+    def join(self):
+        self._thread.join()
+        telemetry = get_telemetry()
+        if telemetry:
+            telemetry.remove_gauge('writer_queue_depth', writer=self.name)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        for name, path in self.attach.items():
+            conn.execute('ATTACH DATABASE ? AS ' + name, (path,))
+        for schema in ['main', *self.attach]:
+            conn.execute(f'PRAGMA {schema}.journal_mode=WAL')
+            conn.execute(f'PRAGMA {schema}.synchronous={self.synchronous}')
+        for statement in self.setup:
+            conn.execute(statement)
+        return conn
+
+    def _flush(self, conn, batch):
+        # Consecutive rows sharing a statement go out as one executemany; order is preserved
+        runs = []
+        for sql, params in batch:
+            if runs and runs[-1][0] == sql:
+                runs[-1][1].append(params)
+            else:
+                runs.append((sql, [params]))
+
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN')
+            for sql, rows in runs:
+                conn.executemany(sql, rows)
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            print(f"Error in BatchWriter({self.db_path}), retrying batch row by row: {e}")
+            conn.execute('ROLLBACK')
+            conn.execute('BEGIN')
+            for sql, params in batch:
+                try:
+                    conn.execute(sql, params)
+                except sqlite3.Error as row_error:
+                    print(f"Error in BatchWriter({self.db_path}): {row_error}")
+            conn.execute('COMMIT')
+
+        elapsed = time.perf_counter() - started
+        self.rows_written += len(batch)
+        self.commits += 1
+        self.write_seconds += elapsed
+        telemetry = get_telemetry()
+        if telemetry:
+            telemetry.record_commit(self.name, len(batch), elapsed)
+        if self.on_flush:
+            self.on_flush(len(batch))
+
+    def _run(self):
+        try:
+            self._write_until_stopped()
+        except BaseException as e:
+            print(f"Error in BatchWriter({self.db_path}), no more rows will be written: {e}")
+            self.error = e
+
+    def _write_until_stopped(self):
+        conn = self._connect()
+        batch = []
+        deadline = None
+        done = False
+
+        while not done:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            if batch and (done or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(conn, batch)
+                batch = []
+                deadline = None
+
+        conn.close()
+
+# One BatchWriter per database, each with its own queue, thread and
+# connection, so databases that never share a transaction are written side by
+# side instead of queueing behind each other on one consumer. Writers are
+# looked up by key (pool['lastkill']). close() queues every writer's sentinel
+# before waiting on any, so they all flush their last batch at once.
+class WriterPool:
+    def __init__(self, writers):
+        self.writers = dict(writers)
+        self.started = None
+        self.elapsed = None
+
+    def __getitem__(self, key):
+        return self.writers[key]
+
+    def start(self):
+        for writer in self.writers.values():
+            writer.start()
+        self.started = time.monotonic()
+        return self
+
+    def close(self):
+        # Every writer is stopped and joined before a failed one's error is raised
+        for writer in self.writers.values():
+            writer.stop()
+        for writer in self.writers.values():
+            writer.join()
+        self.elapsed = time.monotonic() - self.started
+        for writer in self.writers.values():
+            writer.check()
+
+    @property
+    def rows_written(self):
+        return sum(writer.rows_written for writer in self.writers.values())
+
+    @property
+    def commits(self):
+        return sum(writer.commits for writer in self.writers.values())
+
+    def summary(self):
+        # Rows, commits and time spent committing per writer; rows/s is over
+        # that busy time, so it is what each database could take, not what the
+        # crawl fed it
+        lines = [f"Wrote {self.rows_written} rows in {self.commits} commits across {len(self.writers)} writers:"]
+        for key, writer in self.writers.items():
+            rate = writer.rows_written / writer.write_seconds if writer.write_seconds else 0
+            busy = writer.write_seconds / self.elapsed if self.elapsed else 0
+            lines.append(f"  {key:<10} {writer.rows_written:>9} rows {writer.commits:>6} commits "
+                         f"{writer.write_seconds:>7.2f}s writing ({rate:,.0f} rows/s, busy {busy:.0%})")
+        return '\n'.join(lines)
@@ -0,0 +1,82 @@
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+
+DEAD_LETTER_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dead_letters (
+    username TEXT,
+    endpoint TEXT,
+    error TEXT,
+    failures INTEGER NOT NULL DEFAULT 1,
+    first_failed TEXT,
+    last_failed TEXT,
+    PRIMARY KEY (username, endpoint)
+) WITHOUT ROWID
+'''
+
+RECORD_SQL = '''
+INSERT INTO dead_letters (username, endpoint, error, first_failed, last_failed)
+VALUES (?1, ?2, ?3, ?4, ?4)
+ON CONFLICT(username, endpoint) DO UPDATE SET
+error = excluded.error,
+failures = dead_letters.failures + 1,
+last_failed = excluded.last_failed
+'''
+
+RESOLVE_SQL = 'DELETE FROM dead_letters WHERE username = ? AND endpoint = ?'
+
+# The (user, endpoint) pairs whose request failed for good, kept in a
+# dead_letters table next to the data they should have updated. A failed fetch
+# writes nothing else, so whatever was stored before stays; a row with no data
+# only ever means the API said there was none. Rows are queued on the caller's
+# BatchWriter and deleted again once the same pair succeeds, and
+# --retry-failed crawls just the users that have one.
+class DeadLetters:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        conn.execute(DEAD_LETTER_SCHEMA)
+        conn.commit()
+        # Only pairs that failed before need a DELETE when they succeed
+        self.stored = {}
+        for username, endpoint in conn.execute('SELECT username, endpoint FROM dead_letters'):
+            self.stored.setdefault(username, set()).add(endpoint)
+        conn.close()
+        self.failed = Counter()
+        self.resolved = 0
+        self._lock = Lock()
+
+    def record(self, writer, username, endpoint, error):
+        writer.put(RECORD_SQL, (username, endpoint, str(error), datetime.now().isoformat()))
+        with self._lock:
+            self.failed[endpoint] += 1
+
+    def resolve(self, writer, username, endpoint):
+        if endpoint in self.stored.get(username, ()):
+            writer.put(RESOLVE_SQL, (username, endpoint))
+            with self._lock:
+                self.resolved += 1
+
+    def with_failed_endpoints(self, users):
+        # Adds each planner.PlannedUser's failed endpoints back to its plan; the
+        # crawl state can't tell they are missing, since it was not written either
+        for user in users:
+            failed = self.stored.get(user.username)
+            yield user._replace(endpoints=user.endpoints | failed) if failed else user
+
+    def retry_filter(self, alias, endpoints):
+        # SQL condition picking the users with a failed request to one of `endpoints`
+        placeholders = ', '.join('?' * len(endpoints))
+        return (f'''EXISTS (SELECT 1 FROM dead_letters d WHERE d.username = {alias}.username
+                AND d.endpoint IN ({placeholders}))''', tuple(endpoints))
+
+    def summary(self):
+        failed = sum(self.failed.values())
+        by_endpoint = ', '.join(f"{endpoint} {count}" for endpoint, count in sorted(self.failed.items()))
+        text = f"Failed requests: {failed}" + (f" ({by_endpoint})" if failed else "")
+        if self.resolved:
+            text += f", {self.resolved} earlier failures fetched this time"
+        if failed:
+            text += f"; kept in {self.db_path}'s dead_letters table, re-run with --retry-failed"
+        return text
@@ -0,0 +1,104 @@
+import re
+
+# The kill and death messages the API returns, as templates over the victim,
+# the killer and the weapon. A template's id is its position in this list and
+# is stored in parsed_events.db, so new templates go at the end and old ones
+# are never removed or reordered. The cause says what happened in a word.
+# Killers can be mobs with spaces in their names ("Wither Skeleton"), so a
+# template with a weapon goes before the same one without, which would
+# otherwise take "Wither Skeleton using Bow" for the killer.
+TEMPLATES = [
+    ('slain', '{victim} was slain by {killer} using {weapon}'),
+    ('slain', '{victim} was slain by {killer}'),
+    ('shot', '{victim} was shot by {killer} using {weapon}'),
+    ('shot', '{victim} was shot by {killer}'),
+    ('explosion', '{victim} was blown up by {killer} using {weapon}'),
+    ('explosion', '{victim} was blown up by {killer}'),
+    ('magic', '{victim} was killed by {killer} using magic'),
+    ('magic', '{victim} was killed by {killer} using {weapon}'),
+    ('fireball', '{victim} was fireballed by {killer} using {weapon}'),
+    ('fireball', '{victim} was fireballed by {killer}'),
+    ('pummeled', '{victim} was pummeled by {killer} using {weapon}'),
+    ('pummeled', '{victim} was pummeled by {killer}'),
+    ('thorns', '{victim} was killed trying to hurt {killer}'),
+    ('fall', '{victim} was doomed to fall by {killer} using {weapon}'),
+    ('fall', '{victim} was doomed to fall by {killer}'),
+    ('fall', '{victim} hit the ground too hard whilst trying to escape {killer}'),
+    ('drowned', '{victim} drowned whilst trying to escape {killer}'),
+    ('fire', '{victim} walked into fire whilst fighting {killer}'),
+    ('fire', '{victim} was burnt to a crisp whilst fighting {killer}'),
+    ('lava', '{victim} tried to swim in lava to escape {killer}'),
+    ('magic', '{victim} was killed by magic'),
+    ('fall', '{victim} fell from a high place'),
+    ('fall', '{victim} hit the ground too hard'),
+    ('fall', '{victim} fell out of the world'),
+    ('drowned', '{victim} drowned'),
+    ('fire', '{victim} burned to death'),
+    ('fire', '{victim} went up in flames'),
+    ('lava', '{victim} tried to swim in lava'),
+    ('suffocated', '{victim} suffocated in a wall'),
+    ('starved', '{victim} starved to death'),
+    ('cactus', '{victim} was pricked to death'),
+    ('wither', '{victim} withered away'),
+    ('anvil', '{victim} was squashed by a falling anvil'),
+    ('lightning', '{victim} was struck by lightning'),
+    ('cramming', '{victim} was squished too much'),
+    ('elytra', '{victim} experienced kinetic energy'),
+    ('magma', '{victim} discovered floor was lava'),
+    ('explosion', '{victim} blew up'),
+    ('died', '{victim} died'),
+    ('killed', '{killer} killed someone using {weapon}'),
+    ('killed', '{killer} killed someone'),
+]
+
+PARAMETERS = ('victim', 'killer', 'weapon')
+
+# What each parameter may match. A player name is one word and a killer may
+# be a mob's name; a weapon runs to the end of the message and is kept as
+# written, brackets around a renamed item included.
+PARAMETER_PATTERNS = {
+    'victim': r'(\w+)',
+    'killer': r'(\w+|[A-Z][\w ]*?)',
+    'weapon': r'(.+)',
+}
+
+def _compile(templates):
+    # One regex for every template, each alternative wrapped in its own named
+    # group so match.lastgroup says which template matched; the group numbers
+    # of each template's parameters are worked out here once
+    alternatives = []
+    groups = []
+    group = 0
+    for template_id, (_, template) in enumerate(templates):
+        group += 1
+        parts = re.split(r'\{(\w+)\}', template)
+        pattern = ''
+        positions = {}
+        for i, part in enumerate(parts):
+            if i % 2:
+                group += 1
+                positions[part] = group
+                pattern += PARAMETER_PATTERNS[part]
+            else:
+                pattern += re.escape(part)
+        alternatives.append(f'(?P<t{template_id}>{pattern})')
+        groups.append(tuple(positions.get(parameter) for parameter in PARAMETERS))
+    return re.compile('|'.join(alternatives)), groups
+
+# Tried in list order in one pass; a template that matches only the start of
+# a message fails at the end and the next one is tried
+TEMPLATE_REGEX, TEMPLATE_GROUPS = _compile(TEMPLATES)
+
+def parse_message(message):
+    # (template id, cause, victim, killer, weapon) for a message, None where a
+    # template has no such part; None if no template matches it
+    match = TEMPLATE_REGEX.fullmatch(message)
+    if match is None:
+        return None
+    template_id = int(match.lastgroup[1:])
+    return (template_id, TEMPLATES[template_id][0],
+            *(match.group(group) if group else None for group in TEMPLATE_GROUPS[template_id]))
+
+def format_message(template_id, victim=None, killer=None, weapon=None):
+    # The message a template produces; parse_message() reverses it
+    return TEMPLATES[template_id][1].format(victim=victim, killer=killer, weapon=weapon)
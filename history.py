@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import time
+
+from planner import COUNTERS
+
+HISTORY_DB_PATH = 'stats_history.db'
+
+# Every time the bulk stats feed is applied, the counters that moved are
+# appended here as per-player deltas, instead of a copy of every player: a run
+# costs a row per active player, and a player's counters at any run are the
+# sum of their deltas up to it. The first run records everyone's counters at
+# the time as one baseline delta, so the deltas always add up to players.db.
+# Rows are keyed by (run, player id), so a run is an append at the end of the
+# table and a window of runs is one range scan; the player index serves one
+# player's history without touching anyone else's.
+HISTORY_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS history.stats_runs (
+        run INTEGER PRIMARY KEY,
+        taken INTEGER NOT NULL,
+        players INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS history.stats_deltas (
+        run INTEGER NOT NULL,
+        player_id INTEGER NOT NULL,
+        {', '.join(f'{counter} INTEGER NOT NULL' for counter in COUNTERS)},
+        PRIMARY KEY (run, player_id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS history.stats_deltas_player ON stats_deltas (player_id, run)',
+]
+
+# Deltas are keyed by the API id, so names and current counters are looked up
+# in players.db by id
+PLAYER_ID_INDEX = 'CREATE INDEX IF NOT EXISTS main.players_id ON players (id)'
+
+# players.db is keyed by username, so a renamed player keeps a stale row under
+# the old name; the row added last for an id (the feed inserts the new name,
+# and updates leave rowids alone) is the one holding their current counters
+LATEST_ROW_SQL = '(SELECT MAX(rowid) FROM players WHERE id = {})'
+
+DELTA_COLUMNS = ', '.join(COUNTERS)
+ANY_DELTA = ' OR '.join(COUNTERS)
+
+BASELINE_SQL = f'''
+INSERT INTO history.stats_deltas (run, player_id, {DELTA_COLUMNS})
+SELECT * FROM (
+    SELECT ?, id, {', '.join(f'COALESCE({counter}, 0) AS {counter}' for counter in COUNTERS)}
+    FROM players p WHERE p.rowid = {LATEST_ROW_SQL.format('p.id')}
+) WHERE {ANY_DELTA}
+ON CONFLICT DO NOTHING
+'''
+
+# Run against the staged feed before it is applied, while players still has
+# the previous values. The previous values are found by id, so a rename is
+# only the counters that moved, not the new name's whole lifetime again; a
+# stored row from before the API sent ids is matched by name instead.
+DELTAS_SQL = f'''
+INSERT INTO history.stats_deltas (run, player_id, {DELTA_COLUMNS})
+SELECT * FROM (
+    SELECT ?, s.id, {', '.join(f'COALESCE(s.{counter}, 0) - COALESCE(p.{counter}, 0) AS {counter}'
+                               for counter in COUNTERS)}
+    FROM temp.players_staging s LEFT JOIN players p ON p.rowid = COALESCE(
+        {LATEST_ROW_SQL.format('s.id')},
+        (SELECT rowid FROM players WHERE username = s.username AND id IS NULL))
+    WHERE s.id IS NOT NULL
+) WHERE {ANY_DELTA}
+ON CONFLICT DO NOTHING
+'''
+
+def attach_history(conn, path=HISTORY_DB_PATH):
+    conn.commit()
+    conn.execute('ATTACH DATABASE ? AS history', (path,))
+    for statement in HISTORY_SCHEMA + [PLAYER_ID_INDEX]:
+        conn.execute(statement)
+    conn.commit()
+
+def detach_history(conn):
+    conn.commit()
+    conn.execute('DETACH DATABASE history')
+
+def start_run(conn, taken=None):
+    # Opens a run (plus the baseline run if the history is empty); returns its number
+    taken = int(taken if taken is not None else time.time())
+    if conn.execute('SELECT 1 FROM history.stats_runs LIMIT 1').fetchone() is None:
+        baseline = conn.execute('INSERT INTO history.stats_runs (taken) VALUES (?)', (taken,)).lastrowid
+        rows = conn.execute(BASELINE_SQL, (baseline,)).rowcount
+        conn.execute('UPDATE history.stats_runs SET players = ? WHERE run = ?', (rows, baseline))
+    return conn.execute('INSERT INTO history.stats_runs (taken) VALUES (?)', (taken,)).lastrowid
+
+def record_deltas(conn, run):
+    # Appends the staged feed's changes to `run`; same transaction as applying it
+    rows = conn.execute(DELTAS_SQL, (run,)).rowcount
+    conn.execute('UPDATE history.stats_runs SET players = ? WHERE run = ?', (rows, run))
+    return rows
+
+def run_at(conn, when):
+    # The last run taken at or before `when` (epoch seconds), or 0 if none was
+    return conn.execute('SELECT COALESCE(MAX(run), 0) FROM history.stats_runs WHERE taken <= ?',
+                        (when,)).fetchone()[0]
+
+def connect(db_path='players.db', history_path=HISTORY_DB_PATH):
+    # players.db (for names and current counters) with the history attached, read only
+    if not os.path.exists(history_path):
+        raise FileNotFoundError(f"No stats history at {history_path}; it starts with the next feed update")
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    conn.execute('ATTACH DATABASE ? AS history', (f'file:{history_path}?mode=ro',))
+    return conn
+
+def player_stats_as_of(conn, username, when):
+    # {counter: value} for one player as of `when`, from their own deltas only
+    sums = ', '.join(f'COALESCE(SUM(d.{counter}), 0)' for counter in COUNTERS)
+    row = conn.execute(f'''
+    SELECT {sums} FROM history.stats_deltas d
+    WHERE d.player_id = (SELECT id FROM players WHERE username = ?) AND d.run <= ?
+    ''', (username, run_at(conn, when))).fetchone()
+    return dict(zip(COUNTERS, row))
+
+def stats_as_of(conn, when):
+    # Yields (username, *counters) for every player with any counts as of
+    # `when`, once per id under their latest name. Sums the deltas up to that
+    # run, or subtracts the ones after it from the current counters, whichever
+    # has fewer rows to read.
+    run = run_at(conn, when)
+    before, total = conn.execute('SELECT TOTAL(players) FILTER (WHERE run <= ?), TOTAL(players) '
+                                 'FROM history.stats_runs', (run,)).fetchone()
+    if before <= total - before:
+        window, values = 'run <= ?', ', '.join(f'COALESCE(d.{counter}, 0)' for counter in COUNTERS)
+    else:
+        window, values = 'run > ?', ', '.join(f'COALESCE(p.{counter}, 0) - COALESCE(d.{counter}, 0)'
+                                              for counter in COUNTERS)
+    rows = conn.execute(f'''
+    SELECT p.username, {values}
+    FROM players p LEFT JOIN (
+        SELECT player_id, {', '.join(f'SUM({counter}) AS {counter}' for counter in COUNTERS)}
+        FROM history.stats_deltas WHERE {window} GROUP BY player_id
+    ) d ON d.player_id = p.id
+    WHERE p.rowid = {LATEST_ROW_SQL.format('p.id')}
+    ''', (run,))
+    for row in rows:
+        if any(row[1:]):
+            yield row
+
+def top_gainers(conn, since, until, counter='kills', limit=10):
+    # [(username, gain)] for the players whose `counter` grew most between the
+    # runs in effect at `since` and at `until`; reads only the runs in between
+    if counter not in COUNTERS:
+        raise ValueError(f"counter must be one of {', '.join(COUNTERS)}")
+    first = conn.execute('SELECT MIN(run) FROM history.stats_runs').fetchone()[0] or 0
+    start = max(run_at(conn, since), first)
+    return conn.execute(f'''
+    SELECT p.username, g.gain FROM (
+        SELECT player_id, SUM({counter}) AS gain FROM history.stats_deltas
+        WHERE run > ? AND run <= ?
+        GROUP BY player_id ORDER BY gain DESC LIMIT ?
+    ) g LEFT JOIN players p ON p.rowid = {LATEST_ROW_SQL.format('g.player_id')}
+    ORDER BY g.gain DESC
+    ''', (start, run_at(conn, until), limit)).fetchall()
+
+def list_runs(conn):
+    return conn.execute('SELECT run, taken, players FROM history.stats_runs ORDER BY run').fetchall()
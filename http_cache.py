@@ -0,0 +1,161 @@
+import sqlite3
+import time
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_CACHE_PATH = 'http_cache.db'
+DEFAULT_CACHE_MAX_MB = 256
+EVICT_TO = 0.9  # Eviction frees space down to this share of the cap, not just one entry's worth
+EMPTY_BODIES = (b'', b'[]', b'{}', b'null')  # "Nothing yet" answers, which are not cached
+
+# Seconds a response is served without asking the API again. First kills and
+# deaths never change once they exist; /seen moves whenever the player is on.
+CACHE_TTLS = {
+    'seen': 60 * 60,
+    'lastkill': 6 * 60 * 60,
+    'lastdeath': 6 * 60 * 60,
+    'firstkill': 7 * 24 * 60 * 60,
+    'firstdeath': 7 * 24 * 60 * 60,
+}
+
+CACHE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS responses (
+        endpoint TEXT,
+        username TEXT,
+        body BLOB,
+        etag TEXT,
+        last_modified TEXT,
+        stored_at REAL,
+        size INTEGER,
+        PRIMARY KEY (endpoint, username)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)',
+]
+
+def cache_key(url):
+    # (endpoint, username) for the per-player endpoints, None for anything else
+    # (the bulk stats?username=all feed is streamed and never cached)
+    parsed = urlparse(url)
+    query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+    if parsed.path.endswith('/seen') and 'username' in query:
+        return 'seen', query['username']
+    if parsed.path.endswith('/stats') and len(query) == 1:
+        endpoint, username = next(iter(query.items()))
+        if endpoint in CACHE_TTLS:
+            return endpoint, username
+    return None
+
+class CachedResponse:
+    def __init__(self, key, body, etag, last_modified, fresh):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def revalidation_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+# A single-file SQLite store of 200 responses for the per-player endpoints,
+# shared by the threaded and asyncio clients. Entries inside their endpoint's
+# TTL are served without a request, unless the caller knows the data moved
+# (the planner saw the player's counters change) and asks to revalidate; older ones that carry an ETag or
+# Last-Modified are revalidated with a conditional GET, and a 304 renews them.
+# Once the stored bodies pass max_bytes the oldest entries are evicted. An
+# empty body is never stored: "no first kill yet" can stop being true at any
+# moment. The cache is disposable, so it runs with synchronous=OFF.
+class ResponseCache:
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, ttls=None):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttls = ttls or CACHE_TTLS
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        for statement in CACHE_SCHEMA:
+            self._conn.execute(statement)
+
+        # Expired entries with nothing to revalidate against are dead weight
+        self._conn.execute('DELETE FROM responses WHERE stored_at < ? AND etag IS NULL AND last_modified IS NULL',
+                           (time.time() - max(self.ttls.values()),))
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def lookup(self, url, revalidate=False):
+        # Returns a CachedResponse, or None when the URL is not cacheable or not
+        # stored; with revalidate a stored entry is never fresh, only usable for
+        # a conditional request
+        key = cache_key(url)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT body, etag, last_modified, stored_at FROM responses '
+                                     'WHERE endpoint = ? AND username = ?', key).fetchone()
+            fresh = row is not None and not revalidate and time.time() - row[3] < self.ttls[key[0]]
+            if fresh:
+                self.hits += 1
+            elif row is None or not (row[1] or row[2]):
+                self.misses += 1
+                return None
+        body, etag, last_modified, _ = row
+        return CachedResponse(key, body, etag, last_modified, fresh)
+
+    def store(self, url, body, etag=None, last_modified=None):
+        key = cache_key(url)
+        if key is None:
+            return
+        size = len(body)
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE endpoint = ? AND username = ?',
+                                     key).fetchone()
+            if body.strip() in EMPTY_BODIES:
+                # Whatever was stored before is out of date as well
+                if old:
+                    self._conn.execute('DELETE FROM responses WHERE endpoint = ? AND username = ?', key)
+                    self.total_bytes -= old[0]
+                return
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (*key, body, etag, last_modified, time.time(), size))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def renew(self, cached):
+        # The API answered 304: the stored body is current again
+        with self._lock:
+            self.revalidated += 1
+            self._conn.execute('UPDATE responses SET stored_at = ? WHERE endpoint = ? AND username = ?',
+                               (time.time(), *cached.key))
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        victims = []
+        for endpoint, username, size in self._conn.execute(
+                'SELECT endpoint, username, size FROM responses ORDER BY stored_at'):
+            if self.total_bytes <= target:
+                break
+            victims.append((endpoint, username))
+            self.total_bytes -= size
+        self._conn.execute('BEGIN')
+        self._conn.executemany('DELETE FROM responses WHERE endpoint = ? AND username = ?', victims)
+        self._conn.execute('COMMIT')
+        self.evicted += len(victims)
+
+    def summary(self):
+        return (f"Response cache ({self.db_path}): {self.hits} fresh hits, {self.revalidated} revalidated, "
+                f"{self.misses} misses, {self.evicted} evicted, {self.total_bytes / 1e6:.1f} MB stored")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
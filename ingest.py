@@ -0,0 +1,176 @@
+import codecs
+import json
+import time
+from itertools import islice
+
+import requests
+
+from api import all_stats_url, get_session, REQUEST_TIMEOUT
+from history import HISTORY_DB_PATH, attach_history, detach_history, record_deltas, start_run
+from refresh import due_on_change_sql
+from telemetry import get_telemetry
+
+DEFAULT_INGEST_BATCH_SIZE = 20000  # Players held in memory (and staged per executemany) at a time
+STAGING_CACHE_KB = 64 * 1024  # Page cache for the staging table, so it mostly builds in memory and spills past this
+CHUNK_SIZE = 64 * 1024
+
+PLAYER_COLUMNS = ('username', 'id', 'uuid', 'kills', 'deaths', 'joins', 'leaves', 'adminlevel')
+PLAYER_COLUMN_LIST = ', '.join(PLAYER_COLUMNS)
+
+# The feed is loaded into this temp table first and then applied to players
+# with two set-based statements, so a player whose values are all the same as
+# stored costs one staging row and one index probe, and is never rewritten.
+# Keyed by username, the staging rows are read back in players' index order.
+STAGING_SCHEMA = '''
+CREATE TEMP TABLE players_staging (
+    username TEXT PRIMARY KEY,
+    id INTEGER,
+    uuid TEXT,
+    kills INTEGER,
+    deaths INTEGER,
+    joins INTEGER,
+    leaves INTEGER,
+    adminlevel INTEGER
+) WITHOUT ROWID
+'''
+
+STAGE_SQL = f'''
+INSERT OR REPLACE INTO temp.players_staging ({PLAYER_COLUMN_LIST})
+VALUES ({', '.join('?' * len(PLAYER_COLUMNS))})
+'''
+
+APPLY_CHANGED_SQL = f'''
+UPDATE players SET
+{', '.join(f'{column} = s.{column}' for column in PLAYER_COLUMNS[1:])},
+{due_on_change_sql('s')}
+FROM temp.players_staging s
+WHERE s.username = players.username
+  AND ({' OR '.join(f'players.{column} IS NOT s.{column}' for column in PLAYER_COLUMNS[1:])})
+'''
+
+APPLY_NEW_SQL = f'''
+INSERT INTO players ({PLAYER_COLUMN_LIST})
+SELECT {PLAYER_COLUMN_LIST} FROM temp.players_staging s
+WHERE NOT EXISTS (SELECT 1 FROM players p WHERE p.username = s.username)
+'''
+
+def iter_json_array(chunks):
+    # Yields the elements of a top-level JSON array as soon as each one is complete,
+    # so only the current element and one chunk of text are ever held in memory.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    in_array = False
+
+    for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not in_array:
+                if buffer[pos] != '[':
+                    raise ValueError(f"Expected a JSON array, got {buffer[pos:pos + 20]!r}")
+                in_array = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Element continues in the next chunk
+            if end == len(buffer):
+                break  # A bare number might still be cut off; wait for the delimiter
+            yield item
+            pos = end
+
+    raise ValueError("JSON array ended unexpectedly")
+
+def stream_players(url=None):
+    url = url or all_stats_url()
+    telemetry = get_telemetry()
+    started = time.monotonic()
+    received = 0
+    with get_session().get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code != 200:
+            if telemetry:
+                telemetry.record_request(url, time.monotonic() - started, response.status_code)
+            raise requests.HTTPError(f"Failed to fetch data: HTTP {response.status_code}", response=response)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+
+        def chunks():
+            nonlocal received
+            for chunk in response.iter_content(CHUNK_SIZE):
+                received += len(chunk)
+                yield decoder.decode(chunk)
+
+        yield from iter_json_array(chunks())
+    # Covers the whole streamed download, parsing included
+    if telemetry:
+        telemetry.record_request(url, time.monotonic() - started, response.status_code, received)
+
+def ingest_players(conn, batch_size=DEFAULT_INGEST_BATCH_SIZE, url=None, history_path=HISTORY_DB_PATH):
+    return apply_players(conn, stream_players(url), batch_size, history_path)
+
+def apply_players(conn, players, batch_size=DEFAULT_INGEST_BATCH_SIZE, history_path=HISTORY_DB_PATH):
+    # Stages `players` (dicts as the feed sends them) in fixed-size batches, then
+    # inserts the new ones and updates only those whose values differ, in one
+    # transaction; players.db is not written to until the whole feed is in.
+    # The counters that moved are appended to the stats history at
+    # `history_path` (None skips it) in the same transaction. Time spent waiting
+    # on the network and parsing is tracked apart from time spent in SQLite.
+    cursor = conn.cursor()
+    telemetry = get_telemetry()
+    stats = {'players': 0, 'parse_seconds': 0.0, 'write_seconds': 0.0, 'apply_seconds': 0.0, 'history': None}
+    if history_path:
+        attach_history(conn, history_path)
+    cursor.execute(f'PRAGMA temp.cache_size = -{STAGING_CACHE_KB}')
+    cursor.execute('DROP TABLE IF EXISTS temp.players_staging')
+    cursor.execute(STAGING_SCHEMA)
+
+    while True:
+        started = time.perf_counter()
+        batch = [tuple(player[column] for column in PLAYER_COLUMNS) for player in islice(players, batch_size)]
+        stats['parse_seconds'] += time.perf_counter() - started
+        if not batch:
+            break
+
+        # Sorted batches land in neighbouring B-tree pages instead of all over the table
+        started = time.perf_counter()
+        batch.sort()
+        cursor.executemany(STAGE_SQL, batch)
+        stats['write_seconds'] += time.perf_counter() - started
+        stats['players'] += len(batch)
+
+    started = time.perf_counter()
+    if history_path:
+        run = start_run(conn)
+        stats['history'] = (run, record_deltas(conn, run))
+    stats['changed'] = cursor.execute(APPLY_CHANGED_SQL).rowcount
+    stats['inserted'] = cursor.execute(APPLY_NEW_SQL).rowcount
+    staged = cursor.execute('SELECT COUNT(*) FROM temp.players_staging').fetchone()[0]
+    stats['unchanged'] = staged - stats['changed'] - stats['inserted']
+    conn.commit()
+    cursor.execute('DROP TABLE temp.players_staging')
+    if history_path:
+        detach_history(conn)
+    elapsed = time.perf_counter() - started
+    stats['apply_seconds'] = elapsed
+    stats['write_seconds'] += elapsed
+    if telemetry:
+        telemetry.record_commit('ingest', stats['changed'] + stats['inserted'], elapsed)
+    return stats
+
+def report_ingest_stats(stats):
+    count = stats['players']
+    parse_rate = count / stats['parse_seconds'] if stats['parse_seconds'] else 0
+    write_rate = count / stats['write_seconds'] if stats['write_seconds'] else 0
+    print(f"Ingested {count} players: fetch+parse {stats['parse_seconds']:.2f}s ({parse_rate:.0f}/s), "
+          f"write {stats['write_seconds']:.2f}s ({write_rate:.0f}/s, {stats['apply_seconds']:.2f}s of it applying)")
+    print(f"Players: {stats['inserted']} new, {stats['changed']} changed, {stats['unchanged']} unchanged")
+    if stats['history']:
+        run, moved = stats['history']
+        print(f"Stats history: run {run}, counters moved for {moved} players")
@@ -0,0 +1,113 @@
+import sqlite3
+from datetime import datetime
+
+RUNS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS crawl_runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT,
+    threshold TEXT,
+    finished TEXT
+)
+'''
+
+JOURNAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {schema}.crawl_journal (
+    run_id INTEGER,
+    username TEXT,
+    endpoint TEXT,
+    PRIMARY KEY (run_id, username, endpoint)
+) WITHOUT ROWID
+'''
+
+JOURNAL_SQL = '''
+INSERT OR IGNORE INTO {schema}.crawl_journal (run_id, username, endpoint)
+VALUES (?, ?, ?)
+'''
+
+# Marks a user whose players.db row is written; the rest of the user is done by then
+USER_DONE_ENDPOINT = 'seen'
+
+# Records which endpoints of which users a run has committed. Every database
+# carries its own crawl_journal table, and a journal row is queued on the same
+# writer as the data it vouches for, so both land in the same transaction: after
+# a crash or kill the journal never claims a row that was not written. The run
+# itself (and the staleness threshold it picked its users with) lives in
+# players.db, so --resume can pick up the same set of users where it stopped.
+class CrawlJournal:
+    def __init__(self, main_db_path, event_db_paths):
+        self.main_db_path = main_db_path
+        self.event_db_paths = event_db_paths
+        self.run_id = None
+        self.threshold = None
+        self.partial = {}
+
+        conn = self._connect()
+        conn.execute(RUNS_SCHEMA)
+        for schema in ['main', *event_db_paths]:
+            conn.execute(JOURNAL_SCHEMA.format(schema=schema))
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.main_db_path, isolation_level=None)
+        for name, path in self.event_db_paths.items():
+            conn.execute('ATTACH DATABASE ? AS ' + name, (path,))
+        return conn
+
+    def start(self, threshold):
+        # Unfinished runs are abandoned; their journal rows are no use to a new one
+        conn = self._connect()
+        for (run_id,) in conn.execute('SELECT id FROM crawl_runs WHERE finished IS NULL').fetchall():
+            self._clear(conn, run_id)
+        conn.execute('DELETE FROM crawl_runs WHERE finished IS NULL')
+        self.run_id = conn.execute('INSERT INTO crawl_runs (started, threshold) VALUES (?, ?)',
+                                   (datetime.now().isoformat(), threshold)).lastrowid
+        conn.close()
+        self.threshold = threshold
+        return self.run_id
+
+    def resume(self):
+        # Returns False if there is no unfinished run to pick up
+        conn = self._connect()
+        row = conn.execute('SELECT id, threshold FROM crawl_runs WHERE finished IS NULL '
+                           'ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None:
+            conn.close()
+            return False
+        self.run_id, self.threshold = row
+
+        # Users that are done are filtered out by pending_filter(); only the few
+        # that were mid-flight when the run stopped have event rows to remember
+        for event in self.event_db_paths:
+            rows = conn.execute(f'''
+            SELECT username FROM {event}.crawl_journal
+            WHERE run_id = ? AND username NOT IN (
+                SELECT username FROM main.crawl_journal WHERE run_id = ? AND endpoint = ?
+            )
+            ''', (self.run_id, self.run_id, USER_DONE_ENDPOINT)).fetchall()
+            for (username,) in rows:
+                self.partial.setdefault(username, set()).add(event)
+        conn.close()
+        return True
+
+    def pending_filter(self, alias):
+        # SQL condition (and params) excluding users this run has already finished
+        return (f'''NOT EXISTS (SELECT 1 FROM crawl_journal j WHERE j.run_id = ?
+                AND j.username = {alias}.username AND j.endpoint = ?)''',
+                (self.run_id, USER_DONE_ENDPOINT))
+
+    def completed(self, username):
+        return self.partial.get(username, ())
+
+    def record(self, writer, schema, username, endpoint):
+        writer.put(JOURNAL_SQL.format(schema=schema), (self.run_id, username, endpoint))
+
+    def finish(self):
+        conn = self._connect()
+        self._clear(conn, self.run_id)
+        conn.execute('UPDATE crawl_runs SET finished = ? WHERE id = ?',
+                     (datetime.now().isoformat(), self.run_id))
+        conn.close()
+
+    def _clear(self, conn, run_id):
+        for schema in ['main', *self.event_db_paths]:
+            conn.execute(f'DELETE FROM {schema}.crawl_journal WHERE run_id = ?', (run_id,))
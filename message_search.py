@@ -0,0 +1,144 @@
+import re
+
+from message_store import is_encoded
+from storage import EVENT_KINDS
+
+# Usernames are letters, digits and underscores; keeping '_' inside tokens
+# makes every name a single token, so "Foo_Bar" doesn't also match "foo"
+MESSAGE_TOKENIZER = "unicode61 tokenchars '_'"
+DEFAULT_SEARCH_LIMIT = 20
+
+# A full-text index over an event table's messages. It is an external-content
+# FTS5 table, so it holds only the index and reads messages from the event
+# table itself, and triggers keep it current from inside whatever transaction
+# writes the table: every writer maintains it without knowing it is there.
+# INSERT OR REPLACE removes the old row without firing delete triggers, so the
+# old row's entry is dropped before the insert instead. The triggers assume
+# recursive_triggers is off, SQLite's default. Entries point at the table's
+# rowid, which a plain event table (keyed by username) doesn't declare, so
+# VACUUM or a dump and restore may renumber it under the index; whatever does
+# either has to rebuild the index afterwards. The compact layout's id is an
+# INTEGER PRIMARY KEY and keeps its values.
+MESSAGE_INDEX_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.{table}_fts USING fts5(
+        message, content='{table}', content_rowid='rowid', tokenize="{tokenizer}"
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_before_insert BEFORE INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message)
+        SELECT 'delete', rowid, message FROM {table} WHERE username = new.username;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts (rowid, message) VALUES (new.rowid, new.message);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message) VALUES ('delete', old.rowid, old.message);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_update AFTER UPDATE OF message ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message) VALUES ('delete', old.rowid, old.message);
+        INSERT INTO {table}_fts (rowid, message) VALUES (new.rowid, new.message);
+    END
+    ''',
+]
+
+# The same triggers for a table in message_store.py's compact layout. They sit
+# on {table}_data and read messages through the view, which decodes them.
+# Writes through the view store the message as written with a NULL template;
+# compacting a row sets its template without changing its message, so the
+# update triggers skip it.
+ENCODED_INDEX_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_before_insert BEFORE INSERT ON {table}_data BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message)
+        SELECT 'delete', rowid, message FROM {table} WHERE username = new.username;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_insert AFTER INSERT ON {table}_data BEGIN
+        INSERT INTO {table}_fts (rowid, message) SELECT rowid, message FROM {table} WHERE rowid = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_delete BEFORE DELETE ON {table}_data BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message)
+        SELECT 'delete', rowid, message FROM {table} WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_before_update BEFORE UPDATE ON {table}_data
+    WHEN new.template IS NULL BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, message)
+        SELECT 'delete', rowid, message FROM {table} WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_fts_update AFTER UPDATE ON {table}_data
+    WHEN new.template IS NULL BEGIN
+        INSERT INTO {table}_fts (rowid, message) SELECT rowid, message FROM {table} WHERE rowid = new.id;
+    END
+    ''',
+]
+
+# One ranked query per event table, merged; bm25 ranks are negative, best first
+SEARCH_SQL = '''
+SELECT * FROM (
+    SELECT ? AS event, e.username, e.date, e.time, e.message, {table}_fts.rank AS rank
+    FROM {schema}.{table}_fts JOIN {schema}.{table} e ON e.rowid = {table}_fts.rowid
+    WHERE {table}_fts MATCH ?
+    ORDER BY rank
+    LIMIT ?
+)
+'''
+
+def ensure_message_index(conn, schema, table):
+    # Creates the index and its triggers if they are missing and fills the
+    # index from the rows already there; returns whether it had to be built
+    exists = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = ?", (f'{table}_fts',)).fetchone()
+    schema_sql = MESSAGE_INDEX_SCHEMA
+    if is_encoded(conn, schema, table):
+        schema_sql = MESSAGE_INDEX_SCHEMA[:1] + ENCODED_INDEX_TRIGGERS
+    for statement in schema_sql:
+        conn.execute(statement.format(schema=schema, table=table, tokenizer=MESSAGE_TOKENIZER))
+    if not exists:
+        conn.execute(f"INSERT INTO {schema}.{table}_fts ({table}_fts) VALUES ('rebuild')")
+    conn.commit()
+    return not exists
+
+def rebuild_message_index(conn, schema, table):
+    # Re-reads every message into an existing index, e.g. after the table's
+    # rowids were renumbered; returns whether there was an index to rebuild
+    if not conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = ?", (f'{table}_fts',)).fetchone():
+        return False
+    conn.execute(f"INSERT INTO {schema}.{table}_fts ({table}_fts) VALUES ('rebuild')")
+    conn.commit()
+    return True
+
+def match_expression(text):
+    # Plain words to an FTS5 query matching messages that contain all of them;
+    # quoting each word keeps characters like '-' or ':' from being read as syntax
+    words = re.findall(r"[\w']+", text)
+    if not words:
+        raise ValueError("search text has no words in it")
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+def search_messages(conn, text, events=tuple(EVENT_KINDS), limit=DEFAULT_SEARCH_LIMIT, raw=False):
+    # Ranked hits across the event tables, each attached to `conn` under its
+    # own name (as storage.connect_legacy() and query_service do). `text` is
+    # plain words unless raw=True, in which case it is FTS5 query syntax
+    # ('"end crystal" NOT sword', 'popb*').
+    query = text if raw else match_expression(text)
+    sql = ' UNION ALL '.join(SEARCH_SQL.format(schema=event, table=event) for event in events)
+    params = []
+    for event in events:
+        params += [event, query, limit]
+    rows = conn.execute(f'{sql} ORDER BY rank LIMIT ?', (*params, limit)).fetchall()
+    return [{'event': event, 'username': username, 'date': date, 'time': time, 'message': message}
+            for event, username, date, time, message, _ in rows]
@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import time
+
+from death_messages import TEMPLATES, parse_message
+
+UNMATCHED_TEMPLATE = -1  # Compacted, but no template reproduces the message; it is kept as written
+
+# The compact layout of an event table. The rows live in {table}_data with
+# the message replaced by a template id from death_messages.py, the names in
+# it, and the weapon as an id into {table}_words. The row's own username
+# isn't repeated: a NULL victim or killer means it is the row's player. A
+# view with the table's old name puts the message back together, so readers
+# don't change, and its INSTEAD OF triggers take writes as they come, with
+# the message stored as written until compact_messages() encodes it. The
+# insert has no conflict clause of its own, so the writer's OR REPLACE (or
+# its absence) decides what happens to a username already stored. The view's
+# rowid column is the data row's id, which the message search index refers to.
+ENCODED_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.{table}_data (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE,
+        date TEXT,
+        time TEXT,
+        template INTEGER,
+        victim TEXT,
+        killer TEXT,
+        weapon INTEGER,
+        message TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.{table}_templates (
+        id INTEGER PRIMARY KEY,
+        template TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.{table}_words (
+        id INTEGER PRIMARY KEY,
+        word TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS {schema}.{table}_data_raw ON {table}_data (id)
+    WHERE template IS NULL AND message IS NOT NULL
+    ''',
+    '''
+    CREATE VIEW IF NOT EXISTS {schema}.{table} AS
+    SELECT d.id AS rowid, d.username, d.date, d.time, COALESCE(d.message, replace(replace(replace(
+        t.template, '{{victim}}', COALESCE(d.victim, d.username)), '{{killer}}', COALESCE(d.killer, d.username)),
+        '{{weapon}}', COALESCE(w.word, ''))) AS message
+    FROM {table}_data d
+    LEFT JOIN {table}_templates t ON t.id = d.template
+    LEFT JOIN {table}_words w ON w.id = d.weapon
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_view_insert INSTEAD OF INSERT ON {table} BEGIN
+        INSERT INTO {table}_data (username, date, time, message)
+        VALUES (new.username, new.date, new.time, new.message);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_view_update INSTEAD OF UPDATE ON {table} BEGIN
+        UPDATE {table}_data SET username = new.username, date = new.date, time = new.time,
+            template = NULL, victim = NULL, killer = NULL, weapon = NULL, message = new.message
+        WHERE id = old.rowid;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {schema}.{table}_view_delete INSTEAD OF DELETE ON {table} BEGIN
+        DELETE FROM {table}_data WHERE id = old.rowid;
+    END
+    ''',
+]
+
+RAW_ROWS_SQL = '''
+SELECT id, username, message FROM {schema}.{table}_data
+WHERE template IS NULL AND message IS NOT NULL
+'''
+
+ENCODE_SQL = '''
+UPDATE {schema}.{table}_data SET template = ?, victim = ?, killer = ?, weapon = ?, message = ?
+WHERE id = ?
+'''
+
+def is_encoded(conn, schema, table):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'view' AND name = ?",
+                        (table,)).fetchone() is not None
+
+def decode_message(template, victim, killer, weapon, username):
+    # What the view gives back for an encoded row, the same way it does it
+    return (TEMPLATES[template][1].replace('{victim}', victim or username)
+            .replace('{killer}', killer or username).replace('{weapon}', weapon or ''))
+
+def encode_message(message, username, words, templates):
+    # (template, victim, killer, weapon id) for a message, or None unless the
+    # view would give back exactly the same string; `words` maps weapon names
+    # to ids and takes new ones, `templates` is the table's own id -> template
+    parsed = parse_message(message)
+    if parsed is None:
+        return None
+    template, _, victim, killer, weapon = parsed
+    if templates.get(template) != TEMPLATES[template][1]:
+        return None
+    victim = None if victim == username else victim
+    killer = None if killer == username else killer
+    if decode_message(template, victim, killer, weapon, username) != message:
+        return None
+    if weapon is not None and weapon not in words:
+        words[weapon] = len(words) + 1
+    return template, victim, killer, words.get(weapon)
+
+def compact_messages(conn, schema, table):
+    # Encodes the rows still stored as written; returns (encoded, kept as
+    # written). Templates added to death_messages.py since the last pass are
+    # stored first, so the view can decode every id it is given; a message
+    # whose template the table holds under some other text stays as written.
+    conn.executemany(f'INSERT OR IGNORE INTO {schema}.{table}_templates (id, template) VALUES (?, ?)',
+                     [(template_id, template) for template_id, (_, template) in enumerate(TEMPLATES)])
+    templates = dict(conn.execute(f'SELECT id, template FROM {schema}.{table}_templates'))
+    words = dict(conn.execute(f'SELECT word, id FROM {schema}.{table}_words'))
+    known = len(words)
+    updates = []
+    unmatched = 0
+    for row_id, username, message in conn.execute(RAW_ROWS_SQL.format(schema=schema, table=table)).fetchall():
+        encoded = encode_message(message, username, words, templates)
+        if encoded is None:
+            updates.append((UNMATCHED_TEMPLATE, None, None, None, message, row_id))
+            unmatched += 1
+        else:
+            updates.append((*encoded, None, row_id))
+    new_words = [(word_id, word) for word, word_id in words.items() if word_id > known]
+    conn.executemany(f'INSERT INTO {schema}.{table}_words (id, word) VALUES (?, ?)', new_words)
+    conn.executemany(ENCODE_SQL.format(schema=schema, table=table), updates)
+    conn.commit()
+    return len(updates) - unmatched, unmatched
+
+def encode_event_table(conn, schema, table):
+    # Moves a plain event table into the compact layout and encodes it, in one
+    # transaction. Rows keep their rowids, so a message search index over the
+    # table stays valid; its triggers go with the old table and
+    # message_search.ensure_message_index() puts them back.
+    conn.commit()
+    conn.execute('BEGIN')
+    for statement in ENCODED_SCHEMA[:4]:
+        conn.execute(statement.format(schema=schema, table=table))
+    conn.execute(f'INSERT INTO {schema}.{table}_data (id, username, date, time, message) '
+                 f'SELECT rowid, username, date, time, message FROM {schema}.{table}')
+    conn.execute(f'DROP TABLE {schema}.{table}')
+    for statement in ENCODED_SCHEMA[4:]:
+        conn.execute(statement.format(schema=schema, table=table))
+    return compact_messages(conn, schema, table)
+
+def expand_event_table(conn, schema, table):
+    # The way back: a plain table with every message written out again
+    conn.commit()
+    conn.execute('BEGIN')
+    conn.execute(f'CREATE TABLE {schema}.{table}_plain (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+    conn.execute(f'INSERT INTO {schema}.{table}_plain (rowid, username, date, time, message) '
+                 f'SELECT rowid, username, date, time, message FROM {schema}.{table}')
+    conn.execute(f'DROP VIEW {schema}.{table}')
+    for suffix in ('data', 'templates', 'words'):
+        conn.execute(f'DROP TABLE {schema}.{table}_{suffix}')
+    conn.execute(f'ALTER TABLE {schema}.{table}_plain RENAME TO {table}')
+    conn.commit()
+
+def compact_event_tables(event_db_paths):
+    # Encodes the rows written since the last pass in every event database
+    # that is in the compact layout; plain ones are left alone. Run after the
+    # writers have flushed. Returns (encoded, kept as written) over them all.
+    encoded = unmatched = 0
+    conn = sqlite3.connect(':memory:')
+    for event, path in event_db_paths.items():
+        conn.execute('ATTACH DATABASE ? AS ' + event, (path,))
+        if is_encoded(conn, event, event):
+            counts = compact_messages(conn, event, event)
+            encoded, unmatched = encoded + counts[0], unmatched + counts[1]
+    conn.close()
+    return encoded, unmatched
+
+def report_compaction(encoded, unmatched):
+    if encoded or unmatched:
+        kept = f", {unmatched} matched no template and were kept as written" if unmatched else ''
+        print(f"Encoded {encoded} new event messages{kept}")
+
+def read_rate(path, table, seconds=1.0):
+    # Messages read per second by a full scan of the table (or view), repeated for `seconds`
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    rows = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        rows += sum(1 for _ in conn.execute(f'SELECT username, message FROM {table}'))
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return rows / elapsed
+
+def file_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+from refresh import migrate_refresh
+
+# Adds the integer lastupdated_epoch/lastseen_epoch columns described in
+# timestamps.py, and the next_due_epoch column and due index from refresh.py,
+# to an existing players.db, backfilling each from the columns it derives from.
+# The lastupdated_epoch index older versions created is dropped. update_all.py
+# does all of this on its first run anyway (update_lastseen.py only the epoch
+# columns); running it ahead of time keeps the one-off backfill out of a
+# crawl. Safe to re-run.
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the epoch and next-due columns the refresh selection reads")
+    parser.add_argument('db_path', nargs='?', default='players.db')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    backfilled = migrate_refresh(args.db_path)
+    elapsed = time.monotonic() - started
+    if backfilled:
+        print(f"Backfilled epoch and next-due columns for {backfilled} players in {elapsed:.2f}s.")
+    else:
+        print(f"{args.db_path} already has the epoch and next-due columns and the due index.")
+
+if __name__ == "__main__":
+    main()
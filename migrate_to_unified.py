@@ -0,0 +1,34 @@
+import argparse
+import time
+
+from storage import (UNIFIED_DB_PATH, LEGACY_MAIN_DB_PATH, LEGACY_EVENT_DB_PATHS,
+                     EVENT_KINDS, migrate)
+
+# Imports players.db, lastkill.db, lastdeath.db, firstkill.db and firstdeath.db
+# into the single-file layout described in storage.py. Safe to re-run after
+# every crawl: rows are upserted, so it refreshes an existing unified file.
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the legacy databases into one WAL-mode database")
+    parser.add_argument('--output', default=UNIFIED_DB_PATH,
+                        help=f'Unified database to create or refresh (default: {UNIFIED_DB_PATH})')
+    parser.add_argument('--players-db', default=LEGACY_MAIN_DB_PATH)
+    for event in EVENT_KINDS:
+        parser.add_argument(f'--{event}-db', default=LEGACY_EVENT_DB_PATHS[event])
+    args = parser.parse_args()
+
+    event_db_paths = {event: getattr(args, f'{event}_db') for event in EVENT_KINDS}
+    started = time.monotonic()
+    counts = migrate(args.output, args.players_db, event_db_paths)
+    elapsed = time.monotonic() - started
+
+    print(f"Imported {counts['players']} players into {args.output}")
+    if counts['players_without_id']:
+        print(f"  Skipped {counts['players_without_id']} players with no API id; they import once a crawl "
+              f"or the stats feed has stored one")
+    for event in EVENT_KINDS:
+        print(f"  {event:<11} {counts[event]:>9} rows")
+    print(f"Migration completed in {elapsed:.2f}s.")
+
+if __name__ == "__main__":
+    main()
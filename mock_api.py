@@ -0,0 +1,183 @@
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+# A local stand-in for api.2b2t.dev. Start it and point the update scripts at it:
+#   python mock_api.py --players 1000 --port 8080
+#   API_BASE_URL=http://127.0.0.1:8080 python update_all.py --async
+# --latency-script replays a latency timeline (e.g. "0:0.02,30:0.5,60:0.02" is
+# 20ms, then 500ms from the 30s mark, then 20ms again from 60s) and --capacity
+# answers 429 with Retry-After once more than that many requests are in flight.
+# --error-rate answers that share of requests with a 500.
+
+EVENTS = ('lastkill', 'lastdeath', 'firstkill', 'firstdeath')
+
+def generate_players(count, seed=0):
+    rng = random.Random(seed)
+    players = {}
+    for i in range(count):
+        username = f"player{i}"
+        kills = rng.randint(0, 50) if rng.random() < 0.4 else 0
+        deaths = rng.randint(0, 200) if rng.random() < 0.7 else 0
+        players[username] = {
+            'username': username,
+            'id': i + 1,
+            'uuid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'kills': kills,
+            'deaths': deaths,
+            'joins': rng.randint(1, 500),
+            'leaves': rng.randint(1, 500),
+            'adminlevel': 0,
+            'seen': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00" if rng.random() < 0.8 else None,
+        }
+    return players
+
+def event_record(player, event):
+    if event.endswith('kill'):
+        if not player['kills']:
+            return None
+        message = f"{player['username']} killed someone using an end crystal"
+    else:
+        if not player['deaths']:
+            return None
+        message = f"{player['username']} died"
+    day = 1 if event.startswith('first') else 28
+    return {'date': f"2024-01-{day:02d}", 'time': "12:00:00", 'message': message}
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.requests += 1
+            overloaded = server.capacity and server.in_flight > server.capacity
+            failed = server.error_rate and server.rng.random() < server.error_rate
+        try:
+            if overloaded:
+                self.send_response(429)
+                self.send_header('Retry-After', str(server.retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            latency = server.current_latency()
+            if latency:
+                time.sleep(latency)
+            if failed:
+                self.send_error(500)
+                return
+            self.respond()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def respond(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        players = server.players
+
+        if url.path == '/stats' and query.get('username') == 'all':
+            body = [{k: v for k, v in p.items() if k != 'seen'} for p in players.values()]
+        elif url.path == '/stats' and query.keys() & set(EVENTS):
+            event = next(e for e in EVENTS if e in query)
+            player = players.get(query[event])
+            record = event_record(player, event) if player else None
+            body = [record] if record else []
+        elif url.path == '/seen' and 'username' in query:
+            player = players.get(query['username'])
+            body = [{'seen': player['seen']}] if player and player['seen'] else []
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(payload).hexdigest()[:16]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            payload = gzip.compress(payload)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class MockAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # The default backlog of 5 drops connects from a wide crawl
+
+    def current_latency(self):
+        elapsed = time.monotonic() - self.started
+        latency = self.latency
+        for start, scripted in self.latency_script:
+            if elapsed >= start:
+                latency = scripted
+        return latency
+
+def parse_latency_script(text):
+    steps = []
+    for step in filter(None, (text or '').split(',')):
+        start, latency = step.split(':')
+        steps.append((float(start), float(latency)))
+    return sorted(steps)
+
+def start_server(players=1000, port=0, latency=0.0, seed=0, latency_script=None, capacity=0, retry_after=1,
+                 error_rate=0.0):
+    server = MockAPIServer(('127.0.0.1', port), MockAPIHandler)
+    server.players = generate_players(players, seed)
+    server.latency = latency
+    server.latency_script = parse_latency_script(latency_script)
+    server.capacity = capacity
+    server.retry_after = retry_after
+    server.error_rate = error_rate
+    server.rng = random.Random(seed)
+    server.in_flight = 0
+    server.requests = 0
+    server.lock = Lock()
+    server.started = time.monotonic()
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of api.2b2t.dev")
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay per request')
+    parser.add_argument('--latency-script', help='Latency timeline as SECONDS:LATENCY,...')
+    parser.add_argument('--capacity', type=int, default=0, help='Concurrent requests served before answering 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_server(args.players, args.port, args.latency, args.seed,
+                          args.latency_script, args.capacity, args.retry_after, args.error_rate)
+    print(f"Serving {args.players} players on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import argparse
+import os
+
+from parsed_events import (DEFAULT_CHUNK_SIZE, PARSED_DB_PATH, backfill_parsed_events, report_parsed_events,
+                           update_parsed_events)
+from storage import LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH
+
+# Fills parsed_events.db from the event databases (see parsed_events.py).
+# update_all.py brings it up to date after every crawl; this is for a first
+# fill of existing databases, or redoing everything after new templates:
+#   python parse_events.py --backfill --workers 8
+#   python parse_events.py            # only what changed, like update_all.py
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse kill and death messages into parsed_events.db")
+    parser.add_argument('--dir', default='.', help='Directory holding players.db and the event databases')
+    parser.add_argument('--backfill', action='store_true', help="Parse every stored event again")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processes parsing a backfill, 0 to parse in this one (default: one per CPU)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Event rows per backfill task (default: {DEFAULT_CHUNK_SIZE})")
+    args = parser.parse_args()
+
+    paths = (os.path.join(args.dir, LEGACY_MAIN_DB_PATH),
+             {event: os.path.join(args.dir, path) for event, path in LEGACY_EVENT_DB_PATHS.items()},
+             os.path.join(args.dir, PARSED_DB_PATH))
+    if args.backfill:
+        stats = backfill_parsed_events(*paths, workers=args.workers, chunk_size=args.chunk_size)
+    else:
+        stats = update_parsed_events(*paths)
+    report_parsed_events(stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from death_messages import parse_message
+from history import PLAYER_ID_INDEX
+from storage import EVENT_KINDS, LEGACY_EMPTY_VALUE, LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH
+
+PARSED_DB_PATH = 'parsed_events.db'
+DEFAULT_CHUNK_SIZE = 20000  # Event rows per backfill task
+
+# The four event tables' messages taken apart by death_messages.py: one row per
+# (player id, event kind) with the victim, killer and weapon in columns of their
+# own, so who killed whom with what is a query instead of a string parse. Names
+# are kept as written, mobs included, with the player id next to each name that
+# is a known player. A message no template matches gets a row with a NULL
+# template, so it isn't parsed again until the event changes or a backfill.
+PARSED_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS parsed.parsed_events (
+        player_id INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        date TEXT,
+        time TEXT,
+        template INTEGER,
+        cause TEXT,
+        victim TEXT,
+        victim_id INTEGER,
+        killer TEXT,
+        killer_id INTEGER,
+        weapon TEXT,
+        PRIMARY KEY (player_id, kind)
+    ) WITHOUT ROWID
+    ''',
+]
+
+PARSED_INDEXES = {
+    'parsed_events_killer': 'CREATE INDEX IF NOT EXISTS parsed.parsed_events_killer ON parsed_events (killer_id, kind)',
+    'parsed_events_victim': 'CREATE INDEX IF NOT EXISTS parsed.parsed_events_victim ON parsed_events (victim_id, kind)',
+}
+
+# Events with a message whose (date, time) isn't the one parsed last time
+CHANGED_SQL = '''
+SELECT e.username, e.date, e.time, e.message
+FROM {event}.{event} e JOIN players p ON p.username = e.username
+LEFT JOIN parsed.parsed_events x ON x.player_id = p.id AND x.kind = ?1
+WHERE p.id IS NOT NULL AND e.message IS NOT NULL AND e.message != ?2
+  AND (x.player_id IS NULL OR x.date IS NOT e.date OR x.time IS NOT e.time)
+'''
+
+# Parsed rows whose event is gone or was replaced by "nothing found"
+STALE_SQL = '''
+DELETE FROM parsed.parsed_events WHERE kind = ?1 AND NOT EXISTS (
+    SELECT 1 FROM players p JOIN {event}.{event} e ON e.username = p.username
+    WHERE p.id = parsed_events.player_id AND e.message IS NOT NULL AND e.message != ?2
+)
+'''
+
+# Rows come keyed by username and are filed under the player's id; the victim
+# and killer ids are looked up by name
+INSERT_SQL = '''
+INSERT OR REPLACE INTO parsed.parsed_events
+(player_id, kind, date, time, template, cause, victim, victim_id, killer, killer_id, weapon)
+SELECT p.id, ?2, ?3, ?4, ?5, ?6, ?7, (SELECT id FROM players WHERE username = ?7),
+       ?8, (SELECT id FROM players WHERE username = ?8), ?9
+FROM players p WHERE p.username = ?1 AND p.id IS NOT NULL
+'''
+
+CHUNK_SQL = '''
+SELECT username, date, time, message FROM {event}
+WHERE rowid >= ? AND rowid < ? AND message IS NOT NULL AND message != ?
+'''
+
+def parse_rows(rows, kind):
+    # (username, date, time, message) rows to INSERT_SQL parameters
+    parsed = []
+    for username, date, time, message in rows:
+        fields = parse_message(message) or (None, None, None, None, None)
+        parsed.append((username, kind, date, time, *fields))
+    return parsed
+
+def parse_chunk(event_db_path, event, start, end):
+    # A backfill task, run in a worker process: parses the rows of one rowid
+    # range, read straight from the event database
+    conn = sqlite3.connect(f'file:{event_db_path}?mode=ro', uri=True)
+    rows = conn.execute(CHUNK_SQL.format(event=event), (start, end, LEGACY_EMPTY_VALUE)).fetchall()
+    conn.close()
+    return parse_rows(rows, EVENT_KINDS[event])
+
+def connect(main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS, parsed_path=PARSED_DB_PATH):
+    # players.db with the event databases and parsed_events.db attached
+    conn = sqlite3.connect(main_db_path)
+    for name, path in event_db_paths.items():
+        conn.execute('ATTACH DATABASE ? AS ' + name, (path,))
+    conn.execute('ATTACH DATABASE ? AS parsed', (parsed_path,))
+    for statement in PARSED_SCHEMA + list(PARSED_INDEXES.values()) + [PLAYER_ID_INDEX]:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+def update_parsed_events(main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS,
+                         parsed_path=PARSED_DB_PATH):
+    # Parses the events that changed since the last pass and drops the ones
+    # that went away, in one transaction. Run after the event writers have
+    # flushed. Returns counts for report_parsed_events().
+    started = time.perf_counter()
+    stats = {'parsed': 0, 'unmatched': 0, 'removed': 0}
+    conn = connect(main_db_path, event_db_paths, parsed_path)
+    for event in event_db_paths:
+        kind = EVENT_KINDS[event]
+        rows = parse_rows(conn.execute(CHANGED_SQL.format(event=event), (kind, LEGACY_EMPTY_VALUE)), kind)
+        conn.executemany(INSERT_SQL, rows)
+        stats['parsed'] += len(rows)
+        stats['unmatched'] += sum(row[4] is None for row in rows)
+        stats['removed'] += conn.execute(STALE_SQL.format(event=event), (kind, LEGACY_EMPTY_VALUE)).rowcount
+    conn.commit()
+    conn.close()
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+def backfill_parsed_events(main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS,
+                           parsed_path=PARSED_DB_PATH, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Parses every stored event again, for a first fill or after templates were
+    # added. Each event table is split into rowid ranges of chunk_size that
+    # worker processes read and parse, while this process writes their results;
+    # at most two ranges per worker are in flight. workers=0 parses in this process.
+    # The killer and victim indexes are dropped while the table fills and built
+    # once at the end, which is cheaper than keeping them up to date row by row.
+    started = time.perf_counter()
+    stats = {'parsed': 0, 'unmatched': 0, 'removed': 0}
+    workers = os.cpu_count() if workers is None else workers
+    conn = connect(main_db_path, event_db_paths, parsed_path)
+    tasks = []
+    for event, path in event_db_paths.items():
+        first, last = conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM {event}.{event}').fetchone()
+        if first is not None:
+            tasks += [(os.path.abspath(path), event, start, start + chunk_size)
+                      for start in range(first, last + 1, chunk_size)]
+    conn.execute('DELETE FROM parsed.parsed_events')
+    for index in PARSED_INDEXES:
+        conn.execute(f'DROP INDEX parsed.{index}')
+
+    def write(rows):
+        conn.executemany(INSERT_SQL, rows)
+        conn.commit()
+        stats['parsed'] += len(rows)
+        stats['unmatched'] += sum(row[4] is None for row in rows)
+
+    if workers == 0:
+        for task in tasks:
+            write(parse_chunk(*task))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            tasks.reverse()
+            running = set()
+            while tasks or running:
+                while tasks and len(running) < 2 * workers:
+                    running.add(pool.submit(parse_chunk, *tasks.pop()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+    for statement in PARSED_INDEXES.values():
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+def report_parsed_events(stats):
+    rate = stats['parsed'] / stats['seconds'] if stats['seconds'] else 0
+    unmatched = f", {stats['unmatched']} matched no template" if stats['unmatched'] else ''
+    removed = f", dropped {stats['removed']} events that went away" if stats['removed'] else ''
+    print(f"Parsed {stats['parsed']} event messages in {stats['seconds']:.2f}s ({rate:.0f}/s){unmatched}{removed}")
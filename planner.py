@@ -0,0 +1,111 @@
+import sqlite3
+from collections import namedtuple
+
+from scheduler import stream_rows
+
+ENDPOINTS = ('seen', 'lastkill', 'lastdeath', 'firstkill', 'firstdeath')
+COUNTERS = ('kills', 'deaths', 'joins', 'leaves')
+
+# The player counters that must have moved for an endpoint to have anything new
+ENDPOINT_COUNTERS = {
+    'seen': ('joins', 'leaves'),
+    'lastkill': ('kills',),
+    'firstkill': ('kills',),
+    'lastdeath': ('deaths',),
+    'firstdeath': ('deaths',),
+}
+
+# `unchanged` counts this and the crawls before it in a row that found none of
+# the player's counters moved (0 when something did, or on a first crawl).
+# `changed` holds the endpoints whose counters moved since the last crawl: a
+# cached copy of those is out of date however recent it is.
+PlannedUser = namedtuple('PlannedUser', ['username', 'endpoints', 'lastseen', 'stats', 'unchanged', 'changed'])
+
+# The counters as they were the last time each player's endpoints were fetched.
+# A player with no row here has never been crawled and gets every endpoint.
+CRAWL_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS crawl_state (
+    username TEXT PRIMARY KEY,
+    kills INTEGER,
+    deaths INTEGER,
+    joins INTEGER,
+    leaves INTEGER,
+    unchanged INTEGER NOT NULL DEFAULT 0
+)
+'''
+
+CRAWL_STATE_SQL = '''
+INSERT OR REPLACE INTO crawl_state (username, kills, deaths, joins, leaves, unchanged)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+PLAN_TABLE = 'players p LEFT JOIN crawl_state c ON c.username = p.username'
+PLAN_COLUMNS = ('p.username, p.lastseen, p.kills, p.deaths, p.joins, p.leaves, '
+                'c.username IS NOT NULL, c.kills, c.deaths, c.joins, c.leaves, c.unchanged')
+
+def ensure_crawl_state(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(CRAWL_STATE_SCHEMA)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(crawl_state)')}
+    if 'unchanged' not in columns:
+        conn.execute('ALTER TABLE crawl_state ADD COLUMN unchanged INTEGER NOT NULL DEFAULT 0')
+    conn.close()
+
+def plan_endpoints(stats, crawled):
+    if crawled is None:
+        return frozenset(ENDPOINTS)
+    return frozenset(endpoint for endpoint, counters in ENDPOINT_COUNTERS.items()
+                     if any(crawled[c] is None or stats[c] != crawled[c] for c in counters))
+
+def stream_planned_users(db_path, where='1', params=(), enabled=True, key='p.username'):
+    for row in stream_rows(db_path, PLAN_TABLE, PLAN_COLUMNS, where, params, key=key):
+        username, lastseen = row[0], row[1]
+        stats = dict(zip(COUNTERS, row[2:6]))
+        crawled = dict(zip(COUNTERS, row[7:11])) if row[6] else None
+        unchanged = row[11] + 1 if crawled == stats else 0
+        changed = plan_endpoints(stats, crawled) if crawled is not None else frozenset()
+        endpoints = plan_endpoints(stats, crawled) if enabled else frozenset(ENDPOINTS)
+        yield PlannedUser(username, endpoints, lastseen, stats, unchanged, changed)
+
+def crawl_state_params(user):
+    # Only recorded once the user's planned endpoints were all fetched; a user
+    # whose /seen came back empty keeps their old snapshot and is planned again
+    return (user.username, *(user.stats[c] for c in COUNTERS), user.unchanged)
+
+def estimate_savings(db_path, where='1', params=()):
+    # Requests a full refresh of the same players would make, against what the
+    # plan skips. Event endpoints are only fetched for players with a /seen, so
+    # a stored lastseen stands in for that; a player never crawled is planned
+    # every endpoint, so theirs are counted either way (an upper bound).
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(f'''
+    SELECT
+        COUNT(*),
+        SUM(p.lastseen IS NOT NULL OR c.username IS NULL),
+        SUM(p.joins = c.joins AND p.leaves = c.leaves),
+        SUM(p.lastseen IS NOT NULL AND p.kills = c.kills),
+        SUM(p.lastseen IS NOT NULL AND p.deaths = c.deaths)
+    FROM {PLAN_TABLE}
+    WHERE {where}
+    ''', params).fetchone()
+    conn.close()
+
+    users, seen_users, seen_saved, kills_saved, deaths_saved = (value or 0 for value in row)
+    return {
+        'users': users,
+        'full': {'seen': users, 'lastkill': seen_users, 'firstkill': seen_users,
+                 'lastdeath': seen_users, 'firstdeath': seen_users},
+        'saved': {'seen': seen_saved, 'lastkill': kills_saved, 'firstkill': kills_saved,
+                  'lastdeath': deaths_saved, 'firstdeath': deaths_saved},
+    }
+
+def report_savings(estimate):
+    full_total = sum(estimate['full'].values())
+    saved_total = sum(estimate['saved'].values())
+    print(f"Crawl plan for {estimate['users']} users (estimated requests saved vs. a full refresh):")
+    for endpoint in ENDPOINTS:
+        full = estimate['full'][endpoint]
+        saved = estimate['saved'][endpoint]
+        print(f"  {endpoint:<11} {saved:>9} of {full:>9} skipped")
+    share = saved_total / full_total * 100 if full_total else 0
+    print(f"  {'total':<11} {saved_total:>9} of {full_total:>9} skipped ({share:.1f}%)")
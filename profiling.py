@@ -0,0 +1,214 @@
+import cProfile
+import os
+import profile
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from threading import Lock
+
+DEFAULT_PROFILE_DIR = 'profile'
+TOP_FUNCTIONS = 8
+
+# From 3.12 cProfile hooks into sys.monitoring, where an interpreter has room
+# for one profiler: a second active cProfile is refused, whatever thread it is in
+STACKED_CPROFILE = sys.version_info < (3, 12)
+
+# Stage a function's own CPU time is charged to, by the first pattern found in
+# "file:function". "write" is all SQLite work. Unmatched functions (builtins,
+# os.environ, re) are charged to their callers' stages, and what is left at
+# the top of the stack (SQL building, planning, glue) is "other".
+STAGES = (
+    ('write', ('sqlite3', 'db_writer.py')),
+    ('decode', ('json/', '_json.', 'raw_decode', 'iter_json_array', 'codecs', 'gzip', 'zlib', 'decompress')),
+    ('queue', ('queue.py', 'threading.py', 'concurrent/futures')),
+    ('progress', ('tqdm',)),
+    ('fetch', ('requests', 'urllib', 'http/client', 'socket', 'ssl', 'aiohttp', 'asyncio', 'selectors',
+               'api.py', 'async_crawl.py', 'http_cache.py', 'rate_control.py')),
+)
+STAGE_ORDER = [stage for stage, _ in STAGES] + ['other']
+
+def stage_of(filename, function):
+    text = f"{filename}:{function}"
+    for stage, patterns in STAGES:
+        if any(pattern in text for pattern in patterns):
+            return stage
+    return 'other'
+
+def stage_shares(stats):
+    # Function -> {stage: share of its self time}, following callers through unmatched functions
+    shares = {}
+
+    def resolve(function, visiting):
+        if function in shares:
+            return shares[function]
+        stage = stage_of(function[0], function[2])
+        callers = stats.stats[function][4]
+        if stage != 'other' or not callers or function in visiting:
+            return {stage: 1.0}
+        visiting.add(function)
+        # cProfile keeps (calls, ..., self time, ...) per caller; the
+        # pure-Python profiler keeps only how often each caller called
+        weights = {caller: timing[2] if isinstance(timing, tuple) else 0 for caller, timing in callers.items()}
+        if not any(weights.values()):
+            weights = {caller: timing[1] if isinstance(timing, tuple) else timing
+                       for caller, timing in callers.items()}
+        total = sum(weights.values()) or 1
+        mixed = defaultdict(float)
+        for caller, weight in weights.items():
+            if caller not in stats.stats:
+                mixed['other'] += weight / total
+                continue
+            for caller_stage, share in resolve(caller, visiting).items():
+                mixed[caller_stage] += share * weight / total
+        visiting.discard(function)
+        shares[function] = mixed
+        return mixed
+
+    for function in stats.stats:
+        shares[function] = resolve(function, set())
+    return shares
+
+def thread_group(name):
+    # ThreadPoolExecutor-0_3 -> ThreadPoolExecutor-0, Thread-2 (progress_reporter) -> progress_reporter
+    match = re.search(r'\((\w+)\)$', name)
+    if match and name.startswith('Thread-'):
+        return match.group(1)
+    return re.sub(r'_\d+$', '', name)
+
+def format_function(filename, line, function):
+    if filename in ('~', ''):
+        return function
+    return f"{os.path.basename(filename)}:{line}({function})"
+
+# The pure-Python profiler, switched on and off like a cProfile.Profile. It
+# hooks in with sys.setprofile, which is per thread, so every thread can have
+# one on any Python, at several times cProfile's overhead. It expects to have
+# seen every frame it later returns from, so the frames already running when
+# it is switched on are entered first, and the ones still running when it is
+# switched off are closed there and then, on the same thread's clock.
+class ThreadProfile(profile.Profile):
+    def enable(self):
+        frames = []
+        frame = sys._getframe()
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        for frame in reversed(frames):
+            self.trace_dispatch_call(frame, 0)
+        sys.setprofile(self.dispatcher)
+
+    def disable(self):
+        sys.setprofile(None)
+        self.simulate_cmd_complete()
+
+def new_profile():
+    # A profile on the calling thread's CPU clock: cProfile where every thread
+    # may have its own, ThreadProfile where it may not
+    if STACKED_CPROFILE:
+        return cProfile.Profile(time.thread_time)
+    return ThreadProfile(time.thread_time)
+
+# Profiles the main thread and every thread started while it is active, each
+# with a new_profile() of its own on a per-thread CPU clock (time.thread_time),
+# so time a thread spends blocked on the network, a lock or the GIL is not
+# charged to anything and the report shows where CPU actually goes. Threads of the same kind
+# (the fetch pool, each writer) are merged; each group's profile is saved as
+# a .pstats file and the summary splits self time into crawl stages.
+class CrawlProfiler:
+    def __init__(self, directory=DEFAULT_PROFILE_DIR):
+        self.directory = directory
+        self.threads = []  # (thread name, profile, cpu seconds, wall seconds)
+        self._lock = Lock()
+        self._main = new_profile()
+        self._original_run = threading.Thread.run
+        self.started = None
+        self.wall_seconds = None
+
+    def start(self):
+        profiler = self
+        original_run = self._original_run
+
+        def profiled_run(thread):
+            profile = new_profile()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                original_run(thread)
+            finally:
+                profile.disable()
+                profiler._record(thread.name, profile, time.thread_time(), time.perf_counter() - started)
+
+        threading.Thread.run = profiled_run
+        self.started = time.perf_counter()
+        self._main_cpu = time.thread_time()
+        self._main.enable()
+        return self
+
+    def _record(self, name, profile, cpu, wall):
+        with self._lock:
+            self.threads.append((name, profile, cpu, wall))
+
+    def stop(self):
+        self._main.disable()
+        threading.Thread.run = self._original_run
+        self.wall_seconds = time.perf_counter() - self.started
+        self._record('MainThread', self._main, time.thread_time() - self._main_cpu, self.wall_seconds)
+
+    def report(self):
+        # Writes one .pstats per thread group plus summary.txt, and returns the summary
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            threads = list(self.threads)
+
+        groups = defaultdict(list)
+        for name, profile, cpu, wall in threads:
+            groups[thread_group(name)].append((profile, cpu, wall))
+
+        stage_seconds = defaultdict(float)
+        stage_functions = defaultdict(lambda: defaultdict(float))
+        lines = [f"Profile of {self.wall_seconds:.1f}s wall time (CPU time per thread, blocking excluded)", "",
+                 f"{'thread group':<32} {'threads':>7} {'CPU s':>8} {'busy':>6}"]
+        total_cpu = 0.0
+        for group, members in sorted(groups.items(), key=lambda item: -sum(m[1] for m in item[1])):
+            stats = pstats.Stats(members[0][0])
+            for profile, _, _ in members[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.directory, re.sub(r'[^\w.-]+', '_', group) + '.pstats'))
+
+            cpu = sum(m[1] for m in members)
+            wall = sum(m[2] for m in members)
+            total_cpu += cpu
+            lines.append(f"{group:<32} {len(members):>7} {cpu:>8.2f} {cpu / wall * 100 if wall else 0:>5.0f}%")
+            for key, shares in stage_shares(stats).items():
+                tottime = stats.stats[key][2]
+                for stage, share in shares.items():
+                    stage_seconds[stage] += tottime * share
+                    stage_functions[stage][format_function(*key)] += tottime * share
+
+        # Python threads share one GIL: near 1.0 here means they are taking turns, not running in parallel
+        lines += ["", f"Python CPU across all threads: {total_cpu:.2f}s = "
+                      f"{total_cpu / self.wall_seconds if self.wall_seconds else 0:.2f} cores of GIL time", ""]
+
+        staged_total = sum(stage_seconds.values()) or 1
+        for stage in STAGE_ORDER:
+            seconds = stage_seconds.get(stage, 0)
+            if not seconds:
+                continue
+            lines.append(f"[{stage}] {seconds:.2f}s self CPU ({seconds / staged_total * 100:.0f}%)")
+            top = sorted(stage_functions[stage].items(), key=lambda item: -item[1])[:TOP_FUNCTIONS]
+            for function, tottime in top:
+                lines.append(f"  {tottime:>8.3f}s  {function}")
+            lines.append("")
+
+        lines.append(f"Per-thread-group profiles: {self.directory}/*.pstats (python -m pstats FILE)")
+        summary = '\n'.join(lines)
+        with open(os.path.join(self.directory, 'summary.txt'), 'w') as f:
+            f.write(summary + '\n')
+        return summary
+
+    def finish(self):
+        self.stop()
+        print(self.report())
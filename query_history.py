@@ -0,0 +1,63 @@
+import argparse
+import csv
+import sys
+import time
+from datetime import datetime
+
+from history import HISTORY_DB_PATH, connect, list_runs, player_stats_as_of, stats_as_of, top_gainers
+from planner import COUNTERS
+
+# Reads the stats history that update_players.py and update_all.py append to
+# (see history.py):
+#   python query_history.py as-of 2026-01-01 > stats-2026-01-01.csv
+#   python query_history.py as-of 2026-01-01 --player popbob
+#   python query_history.py gainers --since 2026-03-01 --counter deaths --limit 20
+#   python query_history.py runs
+
+def parse_when(text):
+    # An ISO date or datetime, in local time, as epoch seconds
+    return int(datetime.fromisoformat(text).timestamp())
+
+def format_when(epoch):
+    return datetime.fromtimestamp(epoch).isoformat(sep=' ', timespec='seconds')
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the per-player stats history")
+    parser.add_argument('--db', default='players.db')
+    parser.add_argument('--history', default=HISTORY_DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    as_of = commands.add_parser('as-of', help="Counters as of a date, as CSV (or one player's)")
+    as_of.add_argument('when', type=parse_when, help="ISO date or datetime")
+    as_of.add_argument('--player', help="Just this player")
+
+    gainers = commands.add_parser('gainers', help="Players whose counter grew most over a window")
+    gainers.add_argument('--since', type=parse_when, help="Start of the window (default: 7 days ago)")
+    gainers.add_argument('--until', type=parse_when, help="End of the window (default: now)")
+    gainers.add_argument('--counter', choices=COUNTERS, default='kills')
+    gainers.add_argument('--limit', type=int, default=10)
+
+    commands.add_parser('runs', help="List the recorded feed updates")
+    args = parser.parse_args()
+
+    conn = connect(args.db, args.history)
+    if args.command == 'as-of':
+        if args.player:
+            stats = player_stats_as_of(conn, args.player, args.when)
+            print(', '.join(f"{counter} {value}" for counter, value in stats.items()))
+        else:
+            out = csv.writer(sys.stdout)
+            out.writerow(('username',) + COUNTERS)
+            out.writerows(stats_as_of(conn, args.when))
+    elif args.command == 'gainers':
+        until = args.until if args.until is not None else int(time.time())
+        since = args.since if args.since is not None else until - 7 * 86400
+        for rank, (username, gain) in enumerate(top_gainers(conn, since, until, args.counter, args.limit), 1):
+            print(f"{rank:>3}. {username or '?'}  +{gain} {args.counter}")
+    else:
+        for run, taken, players in list_runs(conn):
+            print(f"run {run:>5}  {format_when(taken)}  {players} players changed")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import os
+import sqlite3
+
+from message_search import DEFAULT_SEARCH_LIMIT, ensure_message_index, rebuild_message_index, search_messages
+from storage import EVENT_KINDS, LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH, connect_legacy
+
+# Searches the kill and death messages of all four event databases (see
+# message_search.py), building any index an older database is missing:
+#   python query_messages.py end crystal
+#   python query_messages.py popbob --event lastdeath --event firstdeath --limit 50
+#   python query_messages.py '"end crystal" NOT popbob' --raw
+# --rebuild re-reads the messages into the indexes first, which a database
+# restored from a dump (or vacuumed by other tools) needs:
+#   python query_messages.py popbob --rebuild
+
+def main():
+    parser = argparse.ArgumentParser(description="Search kill and death messages")
+    parser.add_argument('text', nargs='+', help="Words every message must contain")
+    parser.add_argument('--dir', default='.', help='Directory holding players.db and the event databases')
+    parser.add_argument('--event', action='append', choices=list(EVENT_KINDS),
+                        help="Only this event type; repeat for several (default: all four)")
+    parser.add_argument('--limit', type=int, default=DEFAULT_SEARCH_LIMIT)
+    parser.add_argument('--raw', action='store_true', help="Pass the text through as an FTS5 query")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Rebuild the indexes first, e.g. after restoring the databases from a dump")
+    args = parser.parse_args()
+
+    conn = connect_legacy(os.path.join(args.dir, LEGACY_MAIN_DB_PATH),
+                          {event: os.path.join(args.dir, path) for event, path in LEGACY_EVENT_DB_PATHS.items()})
+    events = args.event or list(EVENT_KINDS)
+    for event in events:
+        if not conn.execute(f"SELECT 1 FROM {event}.sqlite_master WHERE name = ?", (event,)).fetchone():
+            parser.error(f"{event}.db has no {event} table in {args.dir}")
+        if ensure_message_index(conn, event, event):
+            print(f"Built the message search index in {event}.db")
+        elif args.rebuild and rebuild_message_index(conn, event, event):
+            print(f"Rebuilt the message search index in {event}.db")
+    try:
+        hits = search_messages(conn, ' '.join(args.text), events, args.limit, args.raw)
+    except (ValueError, sqlite3.OperationalError) as e:
+        parser.error(f"bad search: {e}")
+    for hit in hits:
+        print(f"{hit['event']:<10} {hit['date']} {hit['time']}  {hit['username']:<16} {hit['message']}")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+from query_service import DEFAULT_CACHE_ENTRIES, DEFAULT_POOL_SIZE, PlayerQueries
+from storage import LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH
+
+# A local, read-only JSON API over players.db and the event databases, backed
+# by query_service.PlayerQueries. Safe to leave running next to the crawl:
+#   python query_server.py --dir . --port 8090
+#   curl 'http://127.0.0.1:8090/player?username=popbob'
+#   curl 'http://127.0.0.1:8090/leaderboard?counter=kills&limit=10'
+#   curl 'http://127.0.0.1:8090/recent?limit=20'
+#   curl 'http://127.0.0.1:8090/search?q=end+crystal&limit=20'
+#   curl 'http://127.0.0.1:8090/stats'
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        queries = self.server.queries
+        try:
+            if url.path == '/player' and 'username' in query:
+                body = queries.profile(query['username'])
+                if body is None:
+                    self.send_json(404, {'error': f"no player {query['username']}"})
+                    return
+            elif url.path == '/leaderboard':
+                body = queries.leaderboard(query.get('counter', 'kills'), int(query.get('limit', 10)))
+            elif url.path == '/search' and 'q' in query:
+                body = queries.search(query['q'], int(query.get('limit', 20)))
+            elif url.path == '/recent':
+                body = queries.recent_activity(int(query.get('limit', 20)))
+            elif url.path == '/stats':
+                body = queries.stats()
+            else:
+                self.send_json(404, {'error': 'try /player?username=, /leaderboard, /recent, /search?q= or /stats'})
+                return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except sqlite3.Error as e:
+            self.send_json(503, {'error': str(e)})
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+def start_server(queries, host='127.0.0.1', port=0):
+    server = QueryServer((host, port), QueryHandler)
+    server.queries = queries
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only HTTP API over the player databases")
+    parser.add_argument('--dir', default='.', help='Directory holding players.db and the event databases')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help=f'Read-only connections (default: {DEFAULT_POOL_SIZE})')
+    parser.add_argument('--cache-entries', type=int, default=DEFAULT_CACHE_ENTRIES,
+                        help=f'Query results kept in the LRU cache, 0 for none (default: {DEFAULT_CACHE_ENTRIES})')
+    args = parser.parse_args()
+
+    queries = PlayerQueries(os.path.join(args.dir, LEGACY_MAIN_DB_PATH),
+                            {event: os.path.join(args.dir, path) for event, path in LEGACY_EVENT_DB_PATHS.items()},
+                            args.pool_size, args.cache_entries)
+    server = start_server(queries, args.host, args.port)
+    print(f"Serving {args.dir} on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        queries.close()
+
+if __name__ == "__main__":
+    main()
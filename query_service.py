@@ -0,0 +1,249 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import LifoQueue
+from threading import Event, Lock
+
+from message_search import DEFAULT_SEARCH_LIMIT, search_messages
+from planner import COUNTERS
+from storage import (EVENT_KINDS, LEGACY_EMPTY_VALUE, LEGACY_EVENT_DB_PATHS, LEGACY_MAIN_DB_PATH,
+                     legacy_profile)
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_CACHE_ENTRIES = 10000
+MMAP_SIZE = 256 * 1024 * 1024  # Per database file; reads are served from the page cache without a copy
+STATEMENT_CACHE = 32  # Prepared statements sqlite3 keeps per connection, keyed by SQL text
+CHANGE_CHECK_INTERVAL = 0.1  # Seconds between checks for commits by the update scripts
+MAX_LIMIT = 1000
+
+# Fixed SQL text per query, so each pooled connection prepares it once and
+# then reuses the statement from its cache
+LEADERBOARD_SQL = {counter: f'''
+SELECT username, {counter} FROM players
+WHERE {counter} IS NOT NULL
+ORDER BY {counter} DESC, username
+LIMIT ?
+''' for counter in COUNTERS}
+
+RECENT_SQL = '''
+SELECT p.username, p.lastseen, p.kills, p.deaths,
+       lk.date, lk.time, lk.message, ld.date, ld.time, ld.message
+FROM (
+    SELECT username, lastseen, lastseen_epoch, kills, deaths FROM players
+    WHERE lastseen_epoch IS NOT NULL
+    ORDER BY lastseen_epoch DESC
+    LIMIT ?
+) p
+LEFT JOIN lastkill.lastkill lk ON lk.username = p.username
+LEFT JOIN lastdeath.lastdeath ld ON ld.username = p.username
+ORDER BY p.lastseen_epoch DESC, p.username
+'''
+
+# A fixed set of read-only connections to players.db with the four event
+# databases attached, handed out one caller at a time. Every connection is
+# opened with mode=ro and query_only, so the service can never take a write
+# lock from the crawl, and memory-maps its files.
+class ConnectionPool:
+    def __init__(self, main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS,
+                 size=DEFAULT_POOL_SIZE):
+        self.main_db_path = main_db_path
+        self.event_db_paths = event_db_paths
+        self.size = size
+        self._idle = LifoQueue()
+        for _ in range(size):
+            self._idle.put(self.connect())
+
+    def connect(self):
+        conn = sqlite3.connect(f'file:{self.main_db_path}?mode=ro', uri=True, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE)
+        for name, path in self.event_db_paths.items():
+            conn.execute('ATTACH DATABASE ? AS ' + name, (f'file:{path}?mode=ro',))
+        for schema in ['main', *self.event_db_paths]:
+            conn.execute(f'PRAGMA {schema}.mmap_size={MMAP_SIZE}')
+        conn.execute('PRAGMA query_only=1')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+
+# Least recently used query results, up to max_entries (0 turns it off).
+# Results are shared between callers and must not be modified.
+class ResultCache:
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        # (True, result) on a hit, (False, None) on a miss
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+# A lookup being computed; callers missing the cache on the same key wait for
+# it instead of each running the query
+class PendingResult:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+# Player profile, leaderboard, recent-activity and message search lookups over the databases
+# the update scripts write, for tools and query_server.py. Results are cached
+# until one of the five files changes: every CHANGE_CHECK_INTERVAL at most, a
+# lookup compares each file's PRAGMA data_version, which moves whenever
+# another connection commits to it, and a change empties the cache. A result
+# computed across a change is not cached, so nothing older than the check
+# interval is ever served. Concurrent misses on one key share a single query,
+# so an invalidation doesn't set every caller off on the same leaderboard scan.
+class PlayerQueries:
+    def __init__(self, main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS,
+                 pool_size=DEFAULT_POOL_SIZE, cache_entries=DEFAULT_CACHE_ENTRIES):
+        self.pool = ConnectionPool(main_db_path, event_db_paths, pool_size)
+        self.cache = ResultCache(cache_entries)
+        self.invalidations = 0
+        self._watcher = self.pool.connect()
+        self._schemas = ['main', *event_db_paths]
+        self._versions = self._data_versions()
+        self._generation = 0
+        self._next_check = time.monotonic() + CHANGE_CHECK_INTERVAL
+        self._watch_lock = Lock()
+        self._pending = {}
+        self._pending_lock = Lock()
+
+    def _data_versions(self):
+        return tuple(self._watcher.execute(f'PRAGMA {schema}.data_version').fetchone()[0]
+                     for schema in self._schemas)
+
+    def _check_for_changes(self):
+        if time.monotonic() < self._next_check:
+            return
+        with self._watch_lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return
+            versions = self._data_versions()
+            if versions != self._versions:
+                self._versions = versions
+                self._generation += 1
+                self.invalidations += 1
+                self.cache.clear()
+            self._next_check = now + CHANGE_CHECK_INTERVAL
+
+    def _cached(self, key, compute, *args):
+        self._check_for_changes()
+        found, result = self.cache.get(key)
+        if found:
+            return result
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            running = pending is not None
+            if not running:
+                pending = self._pending[key] = PendingResult()
+        if running:
+            return pending.wait()
+
+        generation = self._generation
+        try:
+            with self.pool.connection() as conn:
+                pending.result = compute(conn, *args)
+            if generation == self._generation:
+                self.cache.put(key, pending.result)
+            return pending.result
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def profile(self, username):
+        # The player's row and their four events, or None for an unknown player
+        return self._cached(('profile', username), _profile, username)
+
+    def leaderboard(self, counter='kills', limit=10):
+        if counter not in COUNTERS:
+            raise ValueError(f"counter must be one of {', '.join(COUNTERS)}")
+        return self._cached(('leaderboard', counter, _check_limit(limit)), _leaderboard, counter, limit)
+
+    def recent_activity(self, limit=20):
+        # The most recently seen players, with their last kill and last death
+        return self._cached(('recent', _check_limit(limit)), _recent_activity, limit)
+
+    def search(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        # Ranked kill and death messages matching every word of `text`, across the four event types
+        return self._cached(('search', text, _check_limit(limit)), _search, text, limit)
+
+    def stats(self):
+        return {'pool_size': self.pool.size, 'cached': len(self.cache.entries), 'hits': self.cache.hits,
+                'misses': self.cache.misses, 'invalidations': self.invalidations}
+
+    def close(self):
+        self.pool.close()
+        self._watcher.close()
+
+def _check_limit(limit):
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+def _event(date, time, message):
+    # The death scripts store '0' for "checked, nothing found"; both mean no event
+    if date is None or date == LEGACY_EMPTY_VALUE:
+        return None
+    return {'date': date, 'time': time, 'message': message}
+
+def _profile(conn, username):
+    profile = legacy_profile(conn, username)
+    if profile is not None:
+        for event in EVENT_KINDS:
+            profile[event] = _event(**profile[event])
+    return profile
+
+def _leaderboard(conn, counter, limit):
+    return [{'username': username, counter: value}
+            for username, value in conn.execute(LEADERBOARD_SQL[counter], (limit,))]
+
+def _search(conn, text, limit):
+    return search_messages(conn, text, limit=limit)
+
+def _recent_activity(conn, limit):
+    return [{'username': row[0], 'lastseen': row[1], 'kills': row[2], 'deaths': row[3],
+             'lastkill': _event(*row[4:7]), 'lastdeath': _event(*row[7:10])}
+            for row in conn.execute(RECENT_SQL, (limit,))]
@@ -0,0 +1,264 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+LATENCY_TOLERANCE = 2.0  # Back off once smoothed latency exceeds this multiple of the best seen
+LATENCY_SMOOTHING = 0.1
+BASELINE_DRIFT = 0.001  # Lets the best-seen latency creep up if the API gets slower for good
+DECREASE_FACTOR = 0.7
+DECREASE_COOLDOWN = 1.0  # Seconds; one slow-down per congestion event, not one per failed request
+MAX_RETRY_AFTER = 300
+BREAKER_THRESHOLD = 20  # Failed requests in a row that open the circuit breaker
+BREAKER_COOLDOWN = 30.0  # Seconds the breaker stays open before it lets a probe through
+BREAKER_MAX_COOLDOWN = 300.0
+BREAKER_PROBE_WAIT = 1.0  # How often requests held back by a probe in flight check again
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return min(float(value), MAX_RETRY_AFTER)
+    except ValueError:
+        pass
+    try:
+        return min(max(parsedate_to_datetime(value).timestamp() - time.time(), 0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        # Takes a token and returns how long the caller must wait before using it
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+# AIMD control of how many requests may be in flight. Fast successful responses
+# grow the limit by roughly one per round trip; 429/5xx, timeouts or latency
+# well above the best observed shrink it multiplicatively, and Retry-After pauses
+# every request until it expires. With adaptive=False the limit stays at
+# max_limit and only the token bucket and Retry-After pauses apply.
+class AdaptiveController:
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, rate=None, adaptive=True):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.adaptive = adaptive
+        self.limit = float(initial_limit or (max(min_limit, max_limit // 4) if adaptive else max_limit))
+        self.bucket = TokenBucket(rate) if rate else None
+        self.best_latency = None
+        self.smoothed_latency = None
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.responses = 0
+        self.throttled = 0
+        self.errors = 0
+        self.lowest_limit = self.highest_limit = self.limit
+        self._lock = Lock()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def delay(self):
+        # Seconds the next request has to wait for a Retry-After pause and the token bucket
+        pause = max(self.paused_until - time.monotonic(), 0)
+        return pause + (self.bucket.reserve() if self.bucket else 0)
+
+    def record(self, latency, status=None, retry_after=None):
+        now = time.monotonic()
+        with self._lock:
+            self.responses += 1
+            if status is None:
+                self.errors += 1
+            elif status in THROTTLE_STATUSES:
+                self.throttled += 1
+
+            pause = parse_retry_after(retry_after)
+            if pause:
+                self.paused_until = max(self.paused_until, now + pause)
+
+            if status is None or status in THROTTLE_STATUSES:
+                self._decrease(now)
+                return
+
+            self.smoothed_latency = latency if self.smoothed_latency is None else (
+                (1 - LATENCY_SMOOTHING) * self.smoothed_latency + LATENCY_SMOOTHING * latency)
+            baseline = latency if self.best_latency is None else self.best_latency * (1 + BASELINE_DRIFT)
+            self.best_latency = min(baseline, latency)
+
+            if self.smoothed_latency > self.best_latency * LATENCY_TOLERANCE:
+                # Back off once, then assume part of the slowdown is the API's own and
+                # move the reference halfway, so a slower API does not starve the crawl
+                if self._decrease(now):
+                    self.best_latency = (self.best_latency + self.smoothed_latency) / 2
+            elif self.adaptive:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.highest_limit = max(self.highest_limit, self.limit)
+
+    def _decrease(self, now):
+        if not self.adaptive or now - self.last_decrease < DECREASE_COOLDOWN:
+            return False
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        return True
+
+    def summary(self):
+        mode = "adaptive" if self.adaptive else "fixed"
+        rate = f", {self.bucket.rate:g} req/s ceiling" if self.bucket else ""
+        return (f"Rate control ({mode}{rate}): limit {self.current_limit} "
+                f"(ranged {int(self.lowest_limit)}-{int(self.highest_limit)} of {self.max_limit}), "
+                f"{self.responses} responses, {self.throttled} throttled, {self.errors} failed")
+
+class ThreadGate:
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self.priority_waiting = 0
+        self._condition = Condition()
+
+    def acquire(self, priority=False):
+        # A priority request (the rest of a user already under way) takes the
+        # next free slot ahead of any ordinary one still waiting
+        with self._condition:
+            self.priority_waiting += priority
+            while self.in_flight >= self.controller.current_limit or (self.priority_waiting and not priority):
+                self._condition.wait()
+            self.priority_waiting -= priority
+            self.in_flight += 1
+        delay = self.controller.delay()
+        if delay:
+            time.sleep(delay)
+
+    def release(self, latency, status=None, retry_after=None):
+        self.controller.record(latency, status, retry_after)
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+class AsyncGate:
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self.priority_waiting = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, priority=False):
+        async with self._condition:
+            self.priority_waiting += priority
+            try:
+                await self._condition.wait_for(lambda: self.in_flight < self.controller.current_limit
+                                               and (priority or not self.priority_waiting))
+            finally:
+                self.priority_waiting -= priority
+            self.in_flight += 1
+        delay = self.controller.delay()
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def release(self, latency, status=None, retry_after=None):
+        self.controller.record(latency, status, retry_after)
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+# Pauses every request while the API looks down. `threshold` failed requests in
+# a row (connection errors, timeouts or 5xx once retries are used up) open it:
+# nothing is sent for `cooldown` seconds, then a single probe request goes out
+# while the rest keep waiting. A successful probe closes the breaker; a failed
+# one opens it again for twice as long, up to max_cooldown. 429s are left to
+# Retry-After and the rate controller, since they mean the API is up.
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.current_cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.paused = 0.0
+        self._lock = Lock()
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def admit(self):
+        # (seconds to wait before asking again, whether this request is the
+        # probe); a delay of 0 lets the request through
+        with self._lock:
+            if self.open_until is None:
+                return 0, False
+            now = time.monotonic()
+            if now < self.open_until:
+                return self.open_until - now, False
+            if self.probing:
+                return BREAKER_PROBE_WAIT, False
+            self.probing = True
+            return 0, True
+
+    # Both return whether the request they let through is the probe. A probe
+    # is settled by record(), or by end_probe() if it never got an answer.
+    def wait(self):
+        delay, probe = self.admit()
+        while delay:
+            time.sleep(delay)
+            delay, probe = self.admit()
+        return probe
+
+    async def wait_async(self):
+        delay, probe = self.admit()
+        while delay:
+            await asyncio.sleep(delay)
+            delay, probe = self.admit()
+        return probe
+
+    def end_probe(self):
+        # The probe was cancelled before it was answered, so says nothing about
+        # the API; the next request to ask goes out as the probe instead
+        with self._lock:
+            self.probing = False
+
+    def record(self, status):
+        failed = status is None or status >= 500
+        with self._lock:
+            if not failed:
+                if self.open_until is not None:
+                    self.paused += time.monotonic() - self.opened_at
+                    print(f"API answering again after {time.monotonic() - self.opened_at:.0f}s, resuming the crawl")
+                self.failures = 0
+                self.open_until = None
+                self.probing = False
+                self.current_cooldown = self.cooldown
+                return
+            self.failures += 1
+            if self.probing:
+                self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+            elif self.open_until is not None or self.failures < self.threshold:
+                return
+            now = time.monotonic()
+            if self.open_until is None:
+                self.opened_at = now
+                self.trips += 1
+            self.probing = False
+            self.open_until = now + self.current_cooldown
+            print(f"API failing ({self.failures} requests in a row), pausing the crawl for "
+                  f"{self.current_cooldown:.0f}s")
+
+    def summary(self):
+        return (f"Circuit breaker: opened {self.trips} times, crawl paused {self.paused:.0f}s"
+                + (" (still open)" if self.is_open else ""))
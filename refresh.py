@@ -0,0 +1,118 @@
+import sqlite3
+
+from planner import COUNTERS
+from timestamps import ensure_epoch_columns
+
+DAY = 24 * 60 * 60
+
+# How often a player is refreshed, by how recently they were last seen:
+# (seen within this many days, refresh every this many days), checked in
+# order. The last row, with None, covers players seen longer ago or never.
+REFRESH_TIERS = (
+    (1, 1),
+    (7, 3),
+    (30, 7),
+    (365, 30),
+    (None, 90),
+)
+
+# Each crawl in a row that found none of the player's counters moved doubles
+# their tier's interval, up to 2 ** BACKOFF_STEPS times
+BACKOFF_STEPS = 2
+
+# A player's next refresh is due at next_due_epoch. The crawl sets it from the
+# tier table when it writes the player, and the bulk stats feed resets it to 0
+# (due now) whenever the player's kills, deaths, joins or leaves have moved,
+# since that is the one sign of new activity that costs nothing to learn. New
+# players from the feed start at 0 too. The run then reads one index range,
+# most overdue first.
+DUE_INDEX = 'CREATE INDEX IF NOT EXISTS players_due ON players (next_due_epoch, username)'
+DUE_KEY = ('p.next_due_epoch', 'p.username')
+
+def due_on_change_sql(new):
+    # next_due_epoch for a player row being overwritten with the counters in
+    # `new` (a table alias): 0 if any of them moved, otherwise unchanged
+    changed = ' OR '.join(f'players.{column} IS NOT {new}.{column}' for column in COUNTERS)
+    return f'next_due_epoch = CASE WHEN {changed} THEN 0 ELSE players.next_due_epoch END'
+
+def refresh_interval_sql(lastseen_epoch, now):
+    cases = ' '.join(f'WHEN {lastseen_epoch} >= {now} - {within * DAY} THEN {every * DAY}'
+                     for within, every in REFRESH_TIERS[:-1])
+    return f'(CASE {cases} ELSE {REFRESH_TIERS[-1][1] * DAY} END)'
+
+def next_due_sql(lastseen_epoch, now, unchanged):
+    return f'{now} + {refresh_interval_sql(lastseen_epoch, now)} * (1 << MIN({unchanged}, {BACKOFF_STEPS}))'
+
+# For a player whose /seen came back empty: only the schedule moves, from the
+# lastseen already stored
+NOT_SEEN_SQL = f'''
+UPDATE players SET next_due_epoch = {next_due_sql('lastseen_epoch', '?1', '?2')} WHERE username = ?3
+'''
+
+def ensure_refresh_columns(conn):
+    # Adds next_due_epoch (after the epoch columns it is computed from) and
+    # backfills it from each player's last crawl. Returns the rows backfilled.
+    backfilled = ensure_epoch_columns(conn)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(players)')}
+    if 'next_due_epoch' not in columns:
+        conn.execute('BEGIN')
+        conn.execute('ALTER TABLE players ADD COLUMN next_due_epoch INTEGER NOT NULL DEFAULT 0')
+        cursor = conn.execute(f"UPDATE players SET next_due_epoch = "
+                              f"{next_due_sql('lastseen_epoch', 'lastupdated_epoch', 0)} "
+                              f"WHERE lastupdated_epoch > 0")
+        conn.execute('COMMIT')
+        backfilled = max(backfilled, cursor.rowcount)
+    # The lastupdated_epoch index selection used before tiers is dead weight now
+    conn.execute('DROP INDEX IF EXISTS players_refresh')
+    conn.execute(DUE_INDEX)
+    conn.commit()
+    return backfilled
+
+def migrate_refresh(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return ensure_refresh_columns(conn)
+    finally:
+        conn.close()
+
+def weekly_refreshes(conn):
+    # (players, refreshes a week the tier table schedules for them before any
+    # counter changes); a flat 7-day cycle is one refresh per player
+    interval = refresh_interval_sql('lastseen_epoch', "CAST(strftime('%s', 'now') AS INTEGER)")
+    return conn.execute(f'SELECT COUNT(*), TOTAL({7 * DAY} * 1.0 / {interval}) FROM players').fetchone()
+
+def planned_requests(user):
+    # Event endpoints are only fetched for a player with a lastseen, so without
+    # /seen in the plan the stored one decides; with it, this is an upper bound
+    if 'seen' not in user.endpoints and not user.lastseen:
+        return 0
+    return len(user.endpoints)
+
+# Hands out users until their planned requests would pass `limit`. Users come
+# most overdue first, so a budget spends itself on the refreshes that matter
+# most.
+class RequestBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.spent = 0
+        self.users = 0
+        self.exhausted = False
+
+    def take(self, users):
+        for user in users:
+            cost = planned_requests(user)
+            if self.spent + cost > self.limit:
+                self.exhausted = True
+                return
+            self.spent += cost
+            self.users += 1
+            yield user
+
+    def fits(self, users):
+        # How many of `users` take() would hand out, without spending anything
+        return sum(1 for _ in RequestBudget(self.limit).take(users))
+
+    def summary(self):
+        state = 'spent' if self.exhausted else 'not exhausted'
+        return (f"Request budget {state}: {self.users} users planned for up to {self.spent} "
+                f"of {self.limit} requests")
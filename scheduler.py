@@ -0,0 +1,85 @@
+import signal
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from telemetry import get_telemetry
+
+USERNAME_PAGE_SIZE = 5000
+WINDOW_PER_WORKER = 4  # Submitted-but-unfinished tasks allowed per worker thread
+
+def count_usernames(db_path, table, where='1', params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}', params).fetchone()[0]
+    finally:
+        conn.close()
+
+def stream_rows(db_path, table, columns='username', where='1', params=(), key='username',
+                page_size=USERNAME_PAGE_SIZE):
+    # Yields `columns` for each matching row, paging through `key` instead of
+    # holding one cursor open for the whole crawl. Each page is its own short read
+    # transaction, so the writers' WAL can still be checkpointed, and rows the
+    # crawl has already rewritten (and that may no longer match `where`) are
+    # never revisited. `key` may be a tuple of columns, compared as a row value,
+    # so an index whose leading column is filtered on can serve every page.
+    keys = (key,) if isinstance(key, str) else tuple(key)
+    key_list = ', '.join(keys)
+    conn = sqlite3.connect(db_path)
+    try:
+        last_key = None
+        while True:
+            after = '' if last_key is None else f"AND ({key_list}) > ({', '.join('?' * len(keys))})"
+            rows = conn.execute(f'''
+            SELECT {key_list}, {columns} FROM {table}
+            WHERE ({where}) {after}
+            ORDER BY {key_list}
+            LIMIT ?
+            ''', (*params, *(last_key or ()), page_size)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield row[len(keys):]
+            last_key = rows[-1][:len(keys)]
+    finally:
+        conn.close()
+
+def stream_usernames(db_path, table, where='1', params=(), page_size=USERNAME_PAGE_SIZE):
+    for (username,) in stream_rows(db_path, table, 'username', where, params, page_size=page_size):
+        yield username
+
+def run_bounded(fn, items, max_workers, window=None, stop=None):
+    # Like submitting every item to a ThreadPoolExecutor up front, but only
+    # `window` futures exist at once and `items` is consumed lazily, so memory
+    # stays flat no matter how many items there are. Yields results as they finish.
+    # Once `stop` (a threading.Event) is set no new items are taken, and the
+    # ones already submitted still run to completion.
+    window = window or max_workers * WINDOW_PER_WORKER
+    telemetry = get_telemetry()
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            if stop is not None and stop.is_set():
+                break
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if telemetry:
+                        telemetry.count('users_completed_total')
+                    yield future.result()
+            pending.add(executor.submit(fn, item))
+
+        for future in as_completed(pending):
+            if telemetry:
+                telemetry.count('users_completed_total')
+            yield future.result()
+
+def drain_on_interrupt(stop):
+    # The first Ctrl-C only sets `stop`, so the crawl can finish the users it
+    # holds and the writers can flush; a second one raises KeyboardInterrupt.
+    # Returns the previous handler for signal.signal() to restore.
+    def handler(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print("\nInterrupted: finishing in-flight users and flushing writers (Ctrl-C again to abort)")
+        stop.set()
+    return signal.signal(signal.SIGINT, handler)
@@ -0,0 +1,82 @@
+import multiprocessing
+
+import update_all
+from cli import build_parser, configure_from_args
+from message_store import compact_event_tables, report_compaction
+from parsed_events import report_parsed_events, update_parsed_events
+from sharding import (DEFAULT_SHARD_DIR, DEFAULT_SHARDS, DEFAULT_LEASE_SECONDS, PARTITIONS,
+                      load_manifest, merge_shards, plan_shards, run_worker, shard_state)
+
+# Splits update_all.py's crawl into shards that several machines (or several
+# processes on one) work through together; see sharding.py. With the shard
+# directory on storage every machine mounts:
+#   coordinator:  python shard_crawl.py plan --shards 16
+#   each worker:  python shard_crawl.py work --async
+#   coordinator:  python shard_crawl.py merge
+# `local --workers N` does all three on one machine with N worker processes.
+
+COMMANDS = ('plan', 'work', 'merge', 'status', 'local')
+
+def work(args):
+    configure_from_args(args)
+    finished = run_worker(args.dir, owner=args.owner, lease_seconds=args.lease_seconds, work_dir=args.work_dir,
+                          use_async=args.use_async, max_in_flight=args.max_in_flight,
+                          batch_size=args.batch_size, synchronous=args.synchronous, plan=args.plan)
+    print(f"Finished shards: {', '.join(map(str, finished)) or 'none'}")
+
+def status(args):
+    manifest = load_manifest(args.dir)
+    print(f"Run planned at threshold {manifest['threshold']}, {manifest['shards']} shards "
+          f"by {manifest['partition']}:")
+    for shard, players in enumerate(manifest['players']):
+        print(f"  {shard:>3}  {players:>9} players  {shard_state(args.dir, shard)}")
+
+def merge(args):
+    merged, outstanding = merge_shards(args.dir)
+    print(f"Merged {len(merged)} shards.")
+    if merged:
+        report_compaction(*compact_event_tables(update_all.EVENT_DB_PATHS))
+        report_parsed_events(update_parsed_events())
+    if outstanding:
+        print(f"Not finished yet: {', '.join(map(str, outstanding))}. Run merge again once they are.")
+
+def main():
+    parser = build_parser("Crawl players.db in shards across several workers")
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--dir', default=DEFAULT_SHARD_DIR,
+                        help=f'Shard directory shared by the coordinator and workers (default: {DEFAULT_SHARD_DIR})')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS,
+                        help=f'Shards to split the due players into, for plan (default: {DEFAULT_SHARDS})')
+    parser.add_argument('--partition', choices=PARTITIONS, default='hash',
+                        help='Split by username hash or by contiguous players.id ranges (default: hash)')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help=f'How long a worker holds a shard without renewing (default: {DEFAULT_LEASE_SECONDS})')
+    parser.add_argument('--owner', default=None, help='Worker name in leases (default: hostname:pid)')
+    parser.add_argument('--work-dir', default=None, help='Local directory for shards being crawled')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for local (default: 2)')
+    parser.add_argument('--no-plan', dest='plan', action='store_false',
+                        help="Fetch every endpoint instead of only those whose stats changed since the last crawl")
+    args = parser.parse_args()
+
+    if args.command in ('plan', 'local'):
+        manifest = plan_shards(args.dir, args.shards, args.partition)
+        if manifest is None:
+            return
+        print(f"Planned {sum(manifest['players'])} players in {manifest['shards']} shards: "
+              f"{', '.join(map(str, manifest['players']))}")
+    if args.command == 'work':
+        work(args)
+    elif args.command == 'status':
+        status(args)
+    elif args.command == 'merge':
+        merge(args)
+    elif args.command == 'local':
+        workers = [multiprocessing.Process(target=work, args=(args,)) for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        merge(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+import zlib
+from bisect import bisect_right
+from threading import Event, Thread
+
+import update_all
+from dead_letters import DEAD_LETTER_SCHEMA
+from planner import ensure_crawl_state
+from refresh import ensure_refresh_columns
+from timestamps import LASTUPDATED_EPOCH_SQL
+
+DEFAULT_SHARD_DIR = 'shards'
+DEFAULT_SHARDS = 8
+DEFAULT_LEASE_SECONDS = 600
+PARTITIONS = ('hash', 'id')
+MANIFEST = 'manifest.json'
+WORK_DB = 'work.db'  # The shard's due players, as a players.db the crawl runs against
+RESULT_DIR = 'result'  # Published by the worker that finished the shard
+LEASE_FILE = 'lease.json'
+MERGED_FILE = 'merged'
+
+# Splitting one crawl across machines. The coordinator, which owns players.db,
+# pulls the bulk stats feed and writes each shard's due players (and their
+# crawl_state) into its own small players.db under a shared directory:
+#
+#   shards/manifest.json      the run: threshold, shard count, partitioning
+#   shards/003/work.db        shard 3's players, the only input a worker needs
+#   shards/003/lease.json     which worker holds shard 3, and until when
+#   shards/003/result/        players.db and the four event databases, once done
+#
+# Workers claim shards through leases, crawl a local copy with update_all.py's
+# usual machinery, and publish the result directory with a single rename. A
+# worker that dies stops renewing its lease and the shard is taken over when it
+# expires. Nothing but the coordinator ever writes the main databases: the
+# merge step folds each finished shard into them, and is safe to repeat.
+
+def shard_path(root, shard):
+    return os.path.join(root, f'{shard:03d}')
+
+def load_manifest(root):
+    with open(os.path.join(root, MANIFEST)) as f:
+        return json.load(f)
+
+def hash_partition(shards):
+    return lambda username, player_id: zlib.crc32(username.encode()) % shards
+
+def id_partition(conn, where, params, shards):
+    # Contiguous players.id ranges holding the same number of due players each
+    ids = [row[0] for row in conn.execute(f'SELECT p.id FROM players p WHERE {where} ORDER BY p.id', params)]
+    bounds = [ids[len(ids) * shard // shards] for shard in range(1, shards)] if ids else []
+    return lambda username, player_id: bisect_right(bounds, player_id if player_id is not None else -1)
+
+def read_lease(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def table_sql(conn, table):
+    return conn.execute('SELECT sql FROM sqlite_master WHERE type = ? AND name = ?', ('table', table)).fetchone()[0]
+
+def plan_shards(root=DEFAULT_SHARD_DIR, shards=DEFAULT_SHARDS, partition='hash', db_path=update_all.MAIN_DB_PATH):
+    # Refreshes players.db from the stats feed and writes one work.db per shard.
+    # Returns the manifest, or None if an earlier run has not been merged yet.
+    if os.path.exists(os.path.join(root, MANIFEST)):
+        unmerged = [shard for shard in range(load_manifest(root)['shards'])
+                    if not os.path.exists(os.path.join(shard_path(root, shard), MERGED_FILE))]
+        if unmerged:
+            print(f"{root} holds a run with {len(unmerged)} unmerged shards; merge it or remove the directory.")
+            return None
+        shutil.rmtree(root)
+
+    update_all.update_main_database()
+    ensure_crawl_state(db_path)
+    threshold = update_all.get_update_threshold()
+    where = f"p.next_due_epoch < {LASTUPDATED_EPOCH_SQL.format('?')}"
+
+    conn = sqlite3.connect(db_path)
+    if partition == 'id':
+        shard_of = id_partition(conn, where, (threshold,), shards)
+    else:
+        shard_of = hash_partition(shards)
+    conn.create_function('shard_of', 2, shard_of, deterministic=True)
+    players_sql, crawl_state_sql = table_sql(conn, 'players'), table_sql(conn, 'crawl_state')
+
+    counts = []
+    for shard in range(shards):
+        directory = shard_path(root, shard)
+        os.makedirs(directory)
+        work_path = os.path.join(directory, WORK_DB)
+        work = sqlite3.connect(work_path)
+        work.execute(players_sql)
+        work.execute(crawl_state_sql)
+        work.close()
+
+        conn.execute('ATTACH DATABASE ? AS work', (work_path,))
+        with conn:
+            count = conn.execute(f'INSERT INTO work.players SELECT * FROM players p '
+                                 f'WHERE {where} AND shard_of(p.username, p.id) = ?', (threshold, shard)).rowcount
+            conn.execute('INSERT INTO work.crawl_state SELECT c.* FROM crawl_state c '
+                         'JOIN work.players w ON w.username = c.username')
+        conn.execute('DETACH DATABASE work')
+        counts.append(count)
+    conn.close()
+
+    # The crawl expects the indexes update_all.py would have made
+    for shard in range(shards):
+        work = sqlite3.connect(os.path.join(shard_path(root, shard), WORK_DB))
+        ensure_refresh_columns(work)
+        work.close()
+
+    manifest = {'created': time.time(), 'threshold': threshold, 'shards': shards,
+                'partition': partition, 'players': counts}
+    with open(os.path.join(root, MANIFEST + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(root, MANIFEST + '.tmp'), os.path.join(root, MANIFEST))
+    return manifest
+
+# A time-limited claim on one shard, kept in a file next to it so any machine
+# that mounts the shard directory can see it. Taking a free shard is an
+# exclusive create; taking over an expired lease first renames it away, which
+# only one contender can do. The holder renews well before expiry, and gives
+# the shard up (setting `lost`) if it finds someone else's lease in its place.
+# Expiry is wall-clock time, so the machines' clocks need to roughly agree.
+class ShardLease:
+    def __init__(self, directory, owner, seconds=DEFAULT_LEASE_SECONDS):
+        self.path = os.path.join(directory, LEASE_FILE)
+        self.owner = owner
+        self.seconds = seconds
+        self.lost = Event()
+        self.tag = f'{socket.gethostname()}-{os.getpid()}'  # Unique per process across machines
+        self._released = Event()
+        self._thread = None
+
+    def _content(self):
+        return json.dumps({'owner': self.owner, 'expires': time.time() + self.seconds})
+
+    def acquire(self):
+        current = read_lease(self.path)
+        if current is not None and current['expires'] > time.time():
+            return False
+        if current is not None:
+            expired = f'{self.path}.expired-{self.tag}'
+            try:
+                os.rename(self.path, expired)
+            except FileNotFoundError:
+                return False
+            if read_lease(expired) != current:
+                # Someone took the shard over between our read and the rename: put their lease back
+                try:
+                    os.link(expired, self.path)
+                except FileExistsError:
+                    pass
+                os.remove(expired)
+                return False
+            os.remove(expired)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self._content())
+        return True
+
+    def renew(self):
+        current = read_lease(self.path)
+        if current is None or current['owner'] != self.owner:
+            self.lost.set()
+            return False
+        with open(f'{self.path}.{self.tag}', 'w') as f:
+            f.write(self._content())
+        os.replace(f'{self.path}.{self.tag}', self.path)
+        return True
+
+    def keep_alive(self, stop):
+        # Renews every third of the lease until released; sets `stop` if the lease is lost
+        def run():
+            while not self._released.wait(self.seconds / 3):
+                if not self.renew():
+                    print(f"\nLost the lease on {os.path.dirname(self.path)}; stopping.")
+                    stop.set()
+                    return
+
+        self._thread = Thread(target=run, name='lease_keeper', daemon=True)
+        self._thread.start()
+
+    def release(self):
+        self._released.set()
+        if self._thread:
+            self._thread.join()
+        current = read_lease(self.path)
+        if current is not None and current['owner'] == self.owner:
+            os.remove(self.path)
+
+def shard_state(root, shard):
+    directory = shard_path(root, shard)
+    if os.path.exists(os.path.join(directory, MERGED_FILE)):
+        return 'merged'
+    if os.path.isdir(os.path.join(directory, RESULT_DIR)):
+        return 'done'
+    lease = read_lease(os.path.join(directory, LEASE_FILE))
+    if lease is None:
+        return 'pending'
+    if lease['expires'] > time.time():
+        return f"leased by {lease['owner']}"
+    return 'expired'
+
+def run_worker(root=DEFAULT_SHARD_DIR, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS, work_dir=None,
+               **crawl_options):
+    # Claims and crawls shards until none is left to claim. Returns the shards finished.
+    # The crawl runs from inside the local copy, so shard paths must not be relative
+    root = os.path.abspath(root)
+    owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+    manifest = load_manifest(root)
+    finished = []
+    home = os.getcwd()
+    for shard in range(manifest['shards']):
+        directory = shard_path(root, shard)
+        if shard_state(root, shard) not in ('pending', 'expired'):
+            continue
+        lease = ShardLease(directory, owner, lease_seconds)
+        if not lease.acquire():
+            continue
+
+        print(f"{owner} crawling shard {shard} ({manifest['players'][shard]} players)")
+        local = tempfile.mkdtemp(prefix=f'shard-{shard:03d}-', dir=work_dir)
+        shutil.copy(os.path.join(directory, WORK_DB), os.path.join(local, update_all.MAIN_DB_PATH))
+        stop = Event()
+        lease.keep_alive(stop)
+        try:
+            os.chdir(local)
+            completed = update_all.update_all_data(ingest=False, parse=False, stop=stop, **crawl_options)
+        finally:
+            os.chdir(home)
+
+        if completed and lease.renew():
+            # Copy next to the shard first, so the publishing rename stays on one filesystem.
+            # If a worker that took over an expired lease published first, theirs stands.
+            staging = os.path.join(directory, f'{RESULT_DIR}.{lease.tag}')
+            shutil.copytree(local, staging)
+            try:
+                os.rename(staging, os.path.join(directory, RESULT_DIR))
+                finished.append(shard)
+            except OSError:
+                shutil.rmtree(staging, ignore_errors=True)
+        lease.release()
+        shutil.rmtree(local, ignore_errors=True)
+        if not completed and not lease.lost.is_set():
+            # Interrupted: leave the remaining shards to other workers
+            break
+    return finished
+
+def merge_shard(root, shard, threshold):
+    # Folds one finished shard into players.db and the event databases. Only
+    # players the worker actually crawled (their next refresh moved past the
+    # run's threshold) are copied, and a player whose stats moved in players.db
+    # since the plan keeps the due time the feed gave them.
+    result = os.path.join(shard_path(root, shard), RESULT_DIR)
+    conn = sqlite3.connect(update_all.MAIN_DB_PATH, isolation_level=None)
+    conn.execute('ATTACH DATABASE ? AS shard', (os.path.join(result, update_all.MAIN_DB_PATH),))
+    for event, path in update_all.EVENT_DB_PATHS.items():
+        conn.execute(f'ATTACH DATABASE ? AS {event}', (path,))
+        conn.execute(update_all.EVENT_TABLE_SCHEMA.format(db=event))
+
+    crawled = f"shard.players s WHERE s.next_due_epoch >= {LASTUPDATED_EPOCH_SQL.format('?')}"
+    counts = {}
+    conn.execute(DEAD_LETTER_SCHEMA)
+    shard_failures = conn.execute("SELECT 1 FROM shard.sqlite_master WHERE name = 'dead_letters'").fetchone()
+    conn.execute('BEGIN')
+    counts['players'] = conn.execute(f'''
+    UPDATE players SET
+        lastseen = s.lastseen, lastseen_epoch = s.lastseen_epoch,
+        lastupdated = s.lastupdated, lastupdated_epoch = s.lastupdated_epoch,
+        next_due_epoch = CASE
+            WHEN players.kills IS s.kills AND players.deaths IS s.deaths
+                 AND players.joins IS s.joins AND players.leaves IS s.leaves THEN s.next_due_epoch
+            ELSE players.next_due_epoch
+        END
+    FROM {crawled} AND s.username = players.username
+    ''', (threshold,)).rowcount
+    conn.execute(f'''
+    INSERT OR REPLACE INTO crawl_state SELECT c.* FROM shard.crawl_state c
+    WHERE c.username IN (SELECT s.username FROM {crawled})
+    ''', (threshold,))
+    # Players the shard crawled have nothing left to retry; its own failures
+    # join the ones already recorded
+    conn.execute(f'DELETE FROM dead_letters WHERE username IN (SELECT s.username FROM {crawled})', (threshold,))
+    if shard_failures:
+        counts['failed'] = conn.execute('''
+        INSERT INTO dead_letters SELECT * FROM shard.dead_letters WHERE true
+        ON CONFLICT(username, endpoint) DO UPDATE SET
+        error = excluded.error,
+        failures = dead_letters.failures + excluded.failures,
+        last_failed = excluded.last_failed
+        ''').rowcount
+    conn.execute('COMMIT')
+
+    # Each event database commits on its own (WAL makes multi-file commits
+    # non-atomic anyway); re-running the merge rewrites the same rows
+    for event in update_all.EVENT_DB_PATHS:
+        path = os.path.join(result, update_all.EVENT_DB_PATHS[event])
+        if not os.path.exists(path):
+            continue
+        conn.execute('ATTACH DATABASE ? AS shard_event', (path,))
+        # Counted at the source: an insert into a compact table's view reports no rows
+        counts[event] = conn.execute(f'SELECT COUNT(*) FROM shard_event.{event}').fetchone()[0]
+        conn.execute(f'INSERT OR REPLACE INTO {event}.{event} (username, date, time, message) '
+                     f'SELECT username, date, time, message FROM shard_event.{event}')
+        conn.execute('DETACH DATABASE shard_event')
+    conn.close()
+
+    with open(os.path.join(shard_path(root, shard), MERGED_FILE), 'w') as f:
+        f.write(json.dumps({'merged': time.time(), **counts}))
+    return counts
+
+def merge_shards(root=DEFAULT_SHARD_DIR):
+    # Merges every finished shard not merged yet. Returns (merged, still outstanding).
+    manifest = load_manifest(root)
+    merged, outstanding = [], []
+    for shard in range(manifest['shards']):
+        state = shard_state(root, shard)
+        if state == 'done':
+            counts = merge_shard(root, shard, manifest['threshold'])
+            print(f"Merged shard {shard}: {counts['players']} players, "
+                  + ', '.join(f"{counts.get(event, 0)} {event}" for event in update_all.EVENT_DB_PATHS)
+                  + (f", {counts['failed']} failed requests" if counts.get('failed') else ''))
+            merged.append(shard)
+        elif state != 'merged':
+            outstanding.append(shard)
+    return merged, outstanding
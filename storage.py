@@ -0,0 +1,227 @@
+import os
+import sqlite3
+
+UNIFIED_DB_PATH = '2b2t.db'
+
+# Event tables of the legacy layout, and the files update_all.py keeps them in
+EVENT_KINDS = {
+    'lastkill': 1,
+    'lastdeath': 2,
+    'firstkill': 3,
+    'firstdeath': 4,
+}
+LEGACY_MAIN_DB_PATH = 'players.db'
+LEGACY_EVENT_DB_PATHS = {event: f'{event}.db' for event in EVENT_KINDS}
+
+# lastdeath/firstdeath scripts store '0' for "checked, nothing found"
+LEGACY_EMPTY_VALUE = '0'
+
+PLAYER_FIELDS = ('id', 'username', 'uuid', 'kills', 'deaths', 'joins', 'leaves',
+                 'adminlevel', 'lastseen', 'lastupdated')
+
+# One file, one schema: players keyed by their API id, and every event type in
+# a single table keyed by (player_id, kind) instead of four files joined on
+# TEXT usernames. An events row with a NULL date means the endpoint was
+# checked and had nothing.
+UNIFIED_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        uuid TEXT,
+        kills INTEGER,
+        deaths INTEGER,
+        joins INTEGER,
+        leaves INTEGER,
+        adminlevel INTEGER,
+        lastseen TEXT,
+        lastupdated TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS event_kinds (
+        kind INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS events (
+        player_id INTEGER NOT NULL REFERENCES players(id),
+        kind INTEGER NOT NULL REFERENCES event_kinds(kind),
+        date TEXT,
+        time TEXT,
+        message TEXT,
+        PRIMARY KEY (player_id, kind)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Players are keyed by their API id, but a legacy players.db by username, so
+# an account renamed since it was first crawled has a row under each name with
+# the same id. Only the newest of those is imported, and an id already in the
+# unified file takes the new name. A username the API hands back a different
+# id for keeps its old key. Rows with no id at all are left out rather than
+# given one SQLite picks, which a real API id could later collide with.
+IMPORT_PLAYERS_SQL = '''
+INSERT INTO players ({fields})
+SELECT {fields} FROM (
+    SELECT {columns}, ROW_NUMBER() OVER (PARTITION BY id ORDER BY {newest}) AS newest
+    FROM {schema}.players WHERE username IS NOT NULL AND id IS NOT NULL
+)
+WHERE newest = 1
+ON CONFLICT(id) DO UPDATE SET
+username = excluded.username,
+uuid = excluded.uuid,
+kills = excluded.kills,
+deaths = excluded.deaths,
+joins = excluded.joins,
+leaves = excluded.leaves,
+adminlevel = excluded.adminlevel,
+lastseen = excluded.lastseen,
+lastupdated = excluded.lastupdated
+ON CONFLICT(username) DO UPDATE SET
+uuid = excluded.uuid,
+kills = excluded.kills,
+deaths = excluded.deaths,
+joins = excluded.joins,
+leaves = excluded.leaves,
+adminlevel = excluded.adminlevel,
+lastseen = excluded.lastseen,
+lastupdated = excluded.lastupdated
+'''
+
+IMPORT_EVENTS_SQL = '''
+INSERT INTO events (player_id, kind, date, time, message)
+SELECT p.id, ?, NULLIF(e.date, ?), NULLIF(e.time, ?), NULLIF(e.message, ?)
+FROM {schema}.{table} e JOIN players p ON p.username = e.username
+WHERE 1
+ON CONFLICT(player_id, kind) DO UPDATE SET
+date = excluded.date,
+time = excluded.time,
+message = excluded.message
+'''
+
+LEGACY_PROFILE_SQL = '''
+SELECT p.id, p.username, p.uuid, p.kills, p.deaths, p.joins, p.leaves,
+       p.adminlevel, p.lastseen, p.lastupdated,
+       lk.date, lk.time, lk.message, ld.date, ld.time, ld.message,
+       fk.date, fk.time, fk.message, fd.date, fd.time, fd.message
+FROM players p
+LEFT JOIN lastkill.lastkill lk ON lk.username = p.username
+LEFT JOIN lastdeath.lastdeath ld ON ld.username = p.username
+LEFT JOIN firstkill.firstkill fk ON fk.username = p.username
+LEFT JOIN firstdeath.firstdeath fd ON fd.username = p.username
+WHERE p.username = ?
+'''
+
+UNIFIED_PROFILE_SQL = '''
+SELECT p.id, p.username, p.uuid, p.kills, p.deaths, p.joins, p.leaves,
+       p.adminlevel, p.lastseen, p.lastupdated,
+       e.kind, e.date, e.time, e.message
+FROM players p
+LEFT JOIN events e ON e.player_id = p.id
+WHERE p.username = ?
+'''
+
+def connect_unified(db_path=UNIFIED_DB_PATH):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    for statement in UNIFIED_SCHEMA:
+        conn.execute(statement)
+    conn.executemany('INSERT OR IGNORE INTO event_kinds (kind, name) VALUES (?, ?)',
+                     [(kind, name) for name, kind in EVENT_KINDS.items()])
+    return conn
+
+def connect_legacy(main_db_path=LEGACY_MAIN_DB_PATH, event_db_paths=LEGACY_EVENT_DB_PATHS):
+    conn = sqlite3.connect(main_db_path)
+    for name, path in event_db_paths.items():
+        conn.execute('ATTACH DATABASE ? AS ' + name, (path,))
+    return conn
+
+def _table_columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def _import_players(conn, schema):
+    # update_players.py's players table has no lastupdated; missing columns import as NULL
+    # and the row written last wins among rows sharing an id. Returns (rows
+    # written, rows left out for having no id).
+    present = set(_table_columns(conn, schema, 'players'))
+    if not present:
+        return 0, 0
+    columns = ', '.join(field if field in present else f'NULL AS {field}' for field in PLAYER_FIELDS)
+    newest = 'lastupdated DESC NULLS LAST, rowid DESC' if 'lastupdated' in present else 'rowid DESC'
+    before = conn.total_changes
+    conn.execute(IMPORT_PLAYERS_SQL.format(fields=', '.join(PLAYER_FIELDS), columns=columns, newest=newest,
+                                           schema=schema))
+    imported = conn.total_changes - before
+    id_column = 'id' if 'id' in present else 'NULL'
+    without_id = conn.execute(f'SELECT COUNT(*) FROM {schema}.players '
+                              f'WHERE username IS NOT NULL AND {id_column} IS NULL').fetchone()[0]
+    return imported, without_id
+
+def _import_events(conn, schema, event):
+    if not _table_columns(conn, schema, event):
+        return 0
+    before = conn.total_changes
+    empty = LEGACY_EMPTY_VALUE
+    conn.execute(IMPORT_EVENTS_SQL.format(table=event, schema=schema),
+                 (EVENT_KINDS[event], empty, empty, empty))
+    return conn.total_changes - before
+
+def migrate(unified_path=UNIFIED_DB_PATH, main_db_path=LEGACY_MAIN_DB_PATH,
+            event_db_paths=LEGACY_EVENT_DB_PATHS):
+    # Imports (or re-imports) the five legacy files in one transaction. The
+    # standalone update_lastkill.py keeps its table in players.db, so event
+    # tables found there are imported first and the dedicated files win.
+    if not os.path.exists(main_db_path):
+        raise FileNotFoundError(f"No legacy database at {main_db_path}")
+    conn = connect_unified(unified_path)
+    counts = {'players': 0, 'players_without_id': 0, **{event: 0 for event in EVENT_KINDS}}
+
+    # ATTACH is not allowed inside a transaction, so every source goes on first
+    sources = [('legacy_main', main_db_path, list(EVENT_KINDS))]
+    sources += [(f'legacy_{event}', event_db_paths[event], [event])
+                for event in EVENT_KINDS if os.path.exists(event_db_paths[event])]
+    for schema, path, _ in sources:
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+
+    try:
+        conn.execute('BEGIN')
+        counts['players'], counts['players_without_id'] = _import_players(conn, 'legacy_main')
+        for schema, _, events in sources:
+            for event in events:
+                counts[event] += _import_events(conn, schema, event)
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return counts
+
+def legacy_profile(conn, username):
+    row = conn.execute(LEGACY_PROFILE_SQL, (username,)).fetchone()
+    if row is None:
+        return None
+    profile = dict(zip(PLAYER_FIELDS, row[:len(PLAYER_FIELDS)]))
+    for i, event in enumerate(EVENT_KINDS):
+        date, time, message = row[len(PLAYER_FIELDS) + 3 * i:len(PLAYER_FIELDS) + 3 * i + 3]
+        profile[event] = {'date': date, 'time': time, 'message': message}
+    return profile
+
+def unified_profile(conn, username):
+    rows = conn.execute(UNIFIED_PROFILE_SQL, (username,)).fetchall()
+    if not rows:
+        return None
+    profile = dict(zip(PLAYER_FIELDS, rows[0][:len(PLAYER_FIELDS)]))
+    names = {kind: name for name, kind in EVENT_KINDS.items()}
+    for event in EVENT_KINDS:
+        profile[event] = {'date': None, 'time': None, 'message': None}
+    for row in rows:
+        kind, date, time, message = row[len(PLAYER_FIELDS):]
+        if kind is not None:
+            profile[names[kind]] = {'date': date, 'time': time, 'message': message}
+    return profile
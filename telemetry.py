@@ -0,0 +1,221 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from threading import Event, Lock, Thread
+
+from http_cache import CACHE_TTLS
+
+DEFAULT_METRICS_INTERVAL = 10.0  # Seconds between snapshots written to --metrics-dir
+GAUGE_HISTORY = 360  # Samples of each gauge kept for the JSON snapshot (an hour at the default interval)
+METRICS_JSON = 'metrics.json'
+METRICS_PROM = 'metrics.prom'
+METRIC_PREFIX = 'crawler_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Name -> (Prometheus type, help text) for everything the crawl records
+METRICS = {
+    'request_duration_seconds': ('histogram', 'Time per HTTP attempt, by endpoint'),
+    'responses_total': ('counter', 'HTTP responses by endpoint and status (error: no response, cached: served from --cache)'),
+    'response_bytes_total': ('counter', 'Response body bytes received, by endpoint'),
+    'writer_batch_rows': ('histogram', 'Rows per SQLite commit, by writer'),
+    'writer_commit_seconds': ('histogram', 'Time per SQLite batch commit, by writer'),
+    'writer_queue_depth': ('gauge', 'Rows queued for a writer and not yet committed'),
+    'requests_in_flight': ('gauge', 'Requests holding a slot in the rate gate'),
+    'concurrency_limit': ('gauge', 'Current in-flight limit of the rate controller'),
+    'users_completed_total': ('counter', 'Users whose crawl finished'),
+}
+
+def endpoint_name(url):
+    # Plain string splitting; this runs for every request
+    path, _, query = url.partition('?')
+    if path.endswith('/seen'):
+        return 'seen'
+    name = query.partition('=')[0]
+    if name in CACHE_TTLS:
+        return name
+    return 'stats_all' if query == 'username=all' else 'other'
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+# Process-wide metrics for the crawl pipeline: counters and histograms that
+# the HTTP clients and writers update inline (a dict lookup and a bisect under
+# one lock), plus gauges that are only read when a snapshot is taken. An
+# exporter thread samples the gauges and rewrites metrics.json and metrics.prom
+# in --metrics-dir every interval, so nothing is done per request beyond the
+# counting itself.
+class Telemetry:
+    def __init__(self, history=GAUGE_HISTORY):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.history = defaultdict(lambda: deque(maxlen=history))
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += amount
+
+    def add_gauge(self, name, read, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def remove_gauge(self, name, **labels):
+        with self._lock:
+            self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def record_request(self, url, latency, status, size=0):
+        endpoint = endpoint_name(url)
+        self.observe('request_duration_seconds', latency, endpoint=endpoint)
+        self.count('responses_total', endpoint=endpoint, status=str(status or 'error'))
+        if size:
+            self.count('response_bytes_total', size, endpoint=endpoint)
+
+    def record_cached(self, url):
+        self.count('responses_total', endpoint=endpoint_name(url), status='cached')
+
+    def record_commit(self, writer, rows, seconds):
+        self.observe('writer_batch_rows', rows, BATCH_BUCKETS, writer=writer)
+        self.observe('writer_commit_seconds', seconds, writer=writer)
+
+    def sample(self):
+        now = time.time()
+        with self._lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, read in gauges:
+            try:
+                values[key] = read()
+            except Exception:
+                continue
+            self.history[key].append((round(now - self.started, 3), values[key]))
+        return values
+
+    def snapshot(self, gauges=None):
+        gauges = self.sample() if gauges is None else gauges
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count, h.quantile(0.5), h.quantile(0.99))
+                          for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+            history = {key: list(samples) for key, samples in self.history.items()}
+
+        def entry(key, **fields):
+            return {'name': key[0], 'labels': dict(key[1]), **fields}
+
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': time.time() - self.started,
+            'counters': [entry(key, value=value) for key, value in sorted(counters.items())],
+            'histograms': [entry(key, count=count, sum=total, p50=p50, p99=p99,
+                                 buckets=dict(zip([*map(str, buckets), '+Inf'], counts)))
+                           for key, (buckets, counts, total, count, p50, p99) in sorted(histograms.items())],
+            # Gauges removed since (a closed writer's queue) keep their history
+            'gauges': [entry(key, value=gauges.get(key), history=history.get(key, []))
+                       for key in sorted(gauges.keys() | history.keys())],
+        }
+
+    def prometheus(self, gauges=None):
+        gauges = self.sample() if gauges is None else gauges
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        def labels_text(labels, **extra):
+            pairs = [*labels, *extra.items()]
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = [(key, value) for key, value in {**counters, **gauges}.items() if key[0] == name]
+            series += [(key, value) for key, value in histograms.items() if key[0] == name]
+            if not series:
+                continue
+            metric = METRIC_PREFIX + name
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for (_, labels), value in sorted(series):
+                if kind != 'histogram':
+                    lines.append(f'{metric}{labels_text(labels)} {value}')
+                    continue
+                buckets, counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip([*map(str, buckets), '+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{labels_text(labels, le=bound)} {cumulative}')
+                lines.append(f'{metric}_sum{labels_text(labels)} {total}')
+                lines.append(f'{metric}_count{labels_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory):
+        # Each file is replaced atomically so a scraper never reads half of one
+        gauges = self.sample()
+        os.makedirs(directory, exist_ok=True)
+        for filename, content in ((METRICS_JSON, json.dumps(self.snapshot(gauges), indent=1)),
+                                  (METRICS_PROM, self.prometheus(gauges))):
+            path = os.path.join(directory, filename)
+            with open(path + '.tmp', 'w') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+    def start_exporter(self, directory, interval=DEFAULT_METRICS_INTERVAL):
+        def run():
+            while not self._stop.wait(interval):
+                self.write(directory)
+
+        self._thread = Thread(target=run, name='TelemetryExporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_exporter(self, directory):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.write(directory)
+
+_telemetry = None
+
+def configure_telemetry(telemetry):
+    global _telemetry
+    _telemetry = telemetry
+
+def get_telemetry():
+    return _telemetry
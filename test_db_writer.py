@@ -0,0 +1,24 @@
+import pytest
+
+from db_writer import BatchWriter, WriterFailed, WriterPool
+
+def failing_writer(tmp_path, name):
+    # The setup statement fails, so the thread dies before it reads a single row
+    return BatchWriter(str(tmp_path / f'{name}.db'), batch_size=2, max_pending=2,
+                       setup=['INSERT INTO missing VALUES (1)'], name=name)
+
+def test_put_raises_once_the_writer_died_instead_of_blocking(tmp_path):
+    writer = failing_writer(tmp_path, 'dead').start()
+    with pytest.raises(WriterFailed):
+        for i in range(10):
+            writer.put('INSERT INTO missing VALUES (?)', (i,))
+    with pytest.raises(WriterFailed):
+        writer.close()
+
+def test_pool_joins_every_writer_before_raising(tmp_path):
+    healthy = BatchWriter(str(tmp_path / 'healthy.db'), setup=['CREATE TABLE t (x)'], name='healthy')
+    pool = WriterPool({'dead': failing_writer(tmp_path, 'dead'), 'healthy': healthy}).start()
+    pool['healthy'].put('INSERT INTO t VALUES (?)', (1,))
+    with pytest.raises(WriterFailed):
+        pool.close()
+    assert healthy.rows_written == 1
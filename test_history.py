@@ -0,0 +1,34 @@
+import sqlite3
+
+import history
+from ingest import apply_players
+from refresh import ensure_refresh_columns
+from test_storage import LEGACY_PLAYERS_SCHEMA
+
+def feed_player(username, player_id, kills, deaths=0, joins=0, leaves=0):
+    return {'username': username, 'id': player_id, 'uuid': f'uuid{player_id}', 'kills': kills,
+            'deaths': deaths, 'joins': joins, 'leaves': leaves, 'adminlevel': 0}
+
+# Applies each feed in turn to a fresh players.db and returns the read-only
+# connection the history queries use
+def apply_feeds(tmp_path, feeds):
+    db_path, history_path = str(tmp_path / 'players.db'), str(tmp_path / 'stats_history.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute(LEGACY_PLAYERS_SCHEMA)
+    ensure_refresh_columns(conn)
+    for feed in feeds:
+        apply_players(conn, iter(feed), history_path=history_path)
+    conn.close()
+    return history.connect(db_path, history_path)
+
+def test_rename_between_feeds_records_only_what_moved(tmp_path):
+    conn = apply_feeds(tmp_path, [
+        [feed_player('old', 7, 10, 2), feed_player('other', 8, 5)],
+        [feed_player('new', 7, 11, 2), feed_player('other', 8, 5)],
+    ])
+    deltas = conn.execute('SELECT kills FROM history.stats_deltas WHERE player_id = 7 ORDER BY run').fetchall()
+    assert deltas == [(10,), (1,)]
+    assert history.player_stats_as_of(conn, 'new', 10 ** 10)['kills'] == 11
+    assert sorted(history.stats_as_of(conn, 10 ** 10)) == [('new', 11, 2, 0, 0), ('other', 5, 0, 0, 0)]
+    assert history.top_gainers(conn, 0, 10 ** 10) == [('new', 11), ('other', 5)]
+    conn.close()
@@ -0,0 +1,67 @@
+import sqlite3
+
+from storage import EVENT_KINDS, connect_unified, migrate
+
+LEGACY_PLAYERS_SCHEMA = '''
+CREATE TABLE players (
+    username TEXT PRIMARY KEY, id INTEGER, uuid TEXT, kills INTEGER, deaths INTEGER,
+    joins INTEGER, leaves INTEGER, adminlevel INTEGER, lastseen TEXT, lastupdated TEXT
+)
+'''
+
+# A legacy players.db, keyed by username, with a lastkill table of its own
+def write_legacy(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_PLAYERS_SCHEMA)
+    conn.execute('CREATE TABLE lastkill (username TEXT PRIMARY KEY, date TEXT, time TEXT, message TEXT)')
+    conn.executemany('INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.executemany('INSERT INTO lastkill VALUES (?, ?, ?, ?)',
+                     [(row[0], '2024-01-01', '12:00', f'{row[0]} killed someone') for row in rows])
+    conn.commit()
+    conn.close()
+
+def no_event_files(directory):
+    # The event tables are read from players.db alone
+    return {event: str(directory / f'missing_{event}.db') for event in EVENT_KINDS}
+
+def player_rows(path):
+    conn = connect_unified(path)
+    rows = conn.execute('SELECT id, username, kills FROM players ORDER BY id').fetchall()
+    events = conn.execute('SELECT player_id, message FROM events ORDER BY player_id').fetchall()
+    conn.close()
+    return rows, events
+
+def test_renamed_player_imports_once_under_newest_name(tmp_path):
+    legacy, unified = str(tmp_path / 'players.db'), str(tmp_path / '2b2t.db')
+    write_legacy(legacy, [
+        ('oldname', 7, 'uuid7', 1, 1, 1, 1, 0, 'seen', '2024-01-01T00:00:00'),
+        ('newname', 7, 'uuid7', 2, 2, 2, 2, 0, 'seen', '2024-02-01T00:00:00'),
+        ('other', 8, 'uuid8', 5, 5, 5, 5, 0, 'seen', '2024-01-15T00:00:00'),
+    ])
+    migrate(unified, legacy, no_event_files(tmp_path))
+    rows, events = player_rows(unified)
+    assert rows == [(7, 'newname', 2), (8, 'other', 5)]
+    assert events == [(7, 'newname killed someone'), (8, 'other killed someone')]
+
+def test_rename_after_earlier_migration_keeps_the_id(tmp_path):
+    legacy, unified = str(tmp_path / 'players.db'), str(tmp_path / '2b2t.db')
+    write_legacy(legacy, [('oldname', 7, 'uuid7', 1, 1, 1, 1, 0, 'seen', '2024-01-01T00:00:00')])
+    migrate(unified, legacy, no_event_files(tmp_path))
+    write_legacy(str(tmp_path / 'renamed.db'),
+                 [('newname', 7, 'uuid7', 2, 2, 2, 2, 0, 'seen', '2024-02-01T00:00:00')])
+    migrate(unified, str(tmp_path / 'renamed.db'), no_event_files(tmp_path))
+    rows, events = player_rows(unified)
+    assert rows == [(7, 'newname', 2)]
+    assert events == [(7, 'newname killed someone')]
+
+def test_player_without_id_is_skipped_and_counted(tmp_path):
+    legacy, unified = str(tmp_path / 'players.db'), str(tmp_path / '2b2t.db')
+    write_legacy(legacy, [
+        ('noid', None, None, 3, 3, 3, 3, 0, 'seen', '2024-01-01T00:00:00'),
+        ('other', 8, 'uuid8', 5, 5, 5, 5, 0, 'seen', '2024-01-15T00:00:00'),
+    ])
+    counts = migrate(unified, legacy, no_event_files(tmp_path))
+    assert (counts['players'], counts['players_without_id'], counts['lastkill']) == (1, 1, 1)
+    rows, events = player_rows(unified)
+    assert rows == [(8, 'other', 5)]
+    assert events == [(8, 'other killed someone')]
@@ -0,0 +1,49 @@
+import sqlite3
+
+# lastupdated and lastseen stay ISO text for anything that reads them, and each
+# has an integer epoch copy next to it that the crawl filters and sorts on.
+# lastupdated is the crawler's own naive local time; lastseen comes from the
+# API in UTC. Both are converted by SQLite, so the backfill and every later
+# write agree on the value. A player that was never crawled has
+# lastupdated_epoch 0 rather than NULL.
+LASTUPDATED_EPOCH_SQL = "COALESCE(CAST(strftime('%s', {}, 'utc') AS INTEGER), 0)"
+LASTSEEN_EPOCH_SQL = "CAST(strftime('%s', {}) AS INTEGER)"
+
+# Text column -> (epoch column, its definition, conversion)
+EPOCH_COLUMNS = {
+    'lastupdated': ('lastupdated_epoch', 'INTEGER NOT NULL DEFAULT 0', LASTUPDATED_EPOCH_SQL),
+    'lastseen': ('lastseen_epoch', 'INTEGER', LASTSEEN_EPOCH_SQL),
+}
+
+LASTSEEN_SQL = f'''
+UPDATE players SET lastseen = ?1, lastseen_epoch = {LASTSEEN_EPOCH_SQL.format('?1')} WHERE username = ?2
+'''
+
+def ensure_epoch_columns(conn):
+    # Adds whichever of lastupdated and the epoch columns the players table is
+    # missing and backfills the new epoch columns from the text ones. Returns the
+    # number of rows backfilled; a no-op once done.
+    conn.commit()
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(players)')}
+    if 'lastupdated' not in columns:
+        conn.execute('ALTER TABLE players ADD COLUMN lastupdated TEXT')
+
+    backfilled = 0
+    for text_column, (epoch_column, definition, conversion) in EPOCH_COLUMNS.items():
+        if epoch_column in columns:
+            continue
+        # One transaction, so an interrupted migration never leaves a column without its backfill
+        conn.execute('BEGIN')
+        conn.execute(f'ALTER TABLE players ADD COLUMN {epoch_column} {definition}')
+        cursor = conn.execute(f'UPDATE players SET {epoch_column} = {conversion.format(text_column)} '
+                              f'WHERE {text_column} IS NOT NULL')
+        conn.execute('COMMIT')
+        backfilled = max(backfilled, cursor.rowcount)
+    return backfilled
+
+def migrate_epochs(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return ensure_epoch_columns(conn)
+    finally:
+        conn.close()
@@ -5,32 +5,77 @@ import time
 import os
 import threading
 import queue
+import signal
+import asyncio
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from queue import Queue
 from threading import Lock, Thread, Event
 
 from tqdm import tqdm
 from datetime import datetime, timedelta
 
-# Configuration
-DAYS_BETWEEN_UPDATES = 7  # Adjust this value as needed
+from api import (all_stats_url, event_url, seen_url, configure_session, get_json, FetchFailed,
+                 connection_stats, report_connection_stats, get_rate_controller, configure_rate_control)
+from async_crawl import fetch_json, run_crawl, DEFAULT_MAX_IN_FLIGHT
+from cli import build_parser, configure_from_args
+from ingest import ingest_players, report_ingest_stats
+from db_writer import BatchWriter, WriterPool, WriterFailed, DEFAULT_BATCH_SIZE, DEFAULT_SYNCHRONOUS
+from dead_letters import DeadLetters
+from journal import CrawlJournal, USER_DONE_ENDPOINT
+from message_search import ensure_message_index
+from message_store import compact_event_tables, report_compaction
+from parsed_events import report_parsed_events, update_parsed_events
+from planner import (CRAWL_STATE_SQL, ensure_crawl_state, stream_planned_users,
+                     crawl_state_params, estimate_savings, report_savings)
+from scheduler import count_usernames, run_bounded, drain_on_interrupt
+from rate_control import AdaptiveController
+from refresh import (DUE_KEY, NOT_SEEN_SQL, RequestBudget,
+                     ensure_refresh_columns, next_due_sql)
+from timestamps import LASTUPDATED_EPOCH_SQL, LASTSEEN_EPOCH_SQL
+
+# Configuration (how often each player is refreshed is set by REFRESH_TIERS in refresh.py)
 MAIN_DB_PATH = 'players.db'
 LASTKILL_DB_PATH = 'lastkill.db'
 LASTDEATH_DB_PATH = 'lastdeath.db'
 FIRSTKILL_DB_PATH = 'firstkill.db'
 FIRSTDEATH_DB_PATH = 'firstdeath.db'
-
-def fetch_data(url):
-    try:
-        response = requests.get(url, timeout=60)
-        if response.status_code == 200:
-            return response.json()
-    except requests.RequestException as e:
-        print(f"Error fetching data from {url}: {e}")
-    return None
+EVENT_DB_PATHS = {
+    'lastkill': LASTKILL_DB_PATH,
+    'lastdeath': LASTDEATH_DB_PATH,
+    'firstkill': FIRSTKILL_DB_PATH,
+    'firstdeath': FIRSTDEATH_DB_PATH,
+}
+
+EVENT_TABLE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {db}.{db} (
+    username TEXT PRIMARY KEY,
+    date TEXT,
+    time TEXT,
+    message TEXT
+)
+'''
+
+EVENT_INSERT_SQL = {db: f'''
+INSERT OR REPLACE INTO {db}.{db} (username, date, time, message)
+VALUES (?, ?, ?, ?)
+''' for db in EVENT_DB_PATHS}
+
+PLAYER_UPDATE_SQL = f'''
+UPDATE players
+SET lastseen = ?1, lastseen_epoch = {LASTSEEN_EPOCH_SQL.format('?1')},
+    lastupdated = ?2, lastupdated_epoch = {LASTUPDATED_EPOCH_SQL.format('?2')},
+    next_due_epoch = {next_due_sql(LASTSEEN_EPOCH_SQL.format('?1'), '?3', '?4')}
+WHERE username = ?5
+'''
+
+def fetch_data(url, priority=False, revalidate=False):
+    # None (or an empty list) when the API has nothing; raises FetchFailed when the request failed
+    return get_json(url, priority, revalidate)
 
 def get_optimal_worker_count():
-    return (os.cpu_count() * 3) // 4
+    # At least one, or a single-CPU machine would get an empty pool
+    return max(1, ((os.cpu_count() or 1) * 3) // 4)
 
 def update_main_database():
     conn = sqlite3.connect(MAIN_DB_PATH)
@@ -51,160 +96,188 @@ def update_main_database():
     )
     ''')
 
-    # Add lastupdated column if it doesn't exist
-    cursor.execute("PRAGMA table_info(players)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'lastupdated' not in columns:
-        cursor.execute("ALTER TABLE players ADD COLUMN lastupdated TEXT")
+    # Add lastupdated and the epoch and next-due columns the refresh selection uses if they don't exist
+    backfilled = ensure_refresh_columns(conn)
+    if backfilled:
+        print(f"Converted lastupdated/lastseen of {backfilled} players to epoch columns and scheduled "
+              f"their next refresh.")
 
-    url = "https://api.2b2t.dev/stats?username=all"
-    data = fetch_data(url)
-
-    if data:
-        for player in data:
-            cursor.execute('''
-            INSERT OR REPLACE INTO players 
-            (username, id, uuid, kills, deaths, joins, leaves, adminlevel)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(username) DO UPDATE SET
-            id = excluded.id,
-            uuid = excluded.uuid,
-            kills = excluded.kills,
-            deaths = excluded.deaths,
-            joins = excluded.joins,
-            leaves = excluded.leaves,
-            adminlevel = excluded.adminlevel
-            ''', (
-                player['username'],
-                player['id'],
-                player['uuid'],
-                player['kills'],
-                player['deaths'],
-                player['joins'],
-                player['leaves'],
-                player['adminlevel']
-            ))
+    try:
+        stats = ingest_players(conn)
+        report_ingest_stats(stats)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error fetching data from {all_stats_url()}: {e}")
 
     conn.commit()
     conn.close()
     print("Main database updated successfully.")
 
-def fetch_last_kill(username):
-    url = f"https://api.2b2t.dev/stats?lastkill={username}"
-    return fetch_data(url)
+def fetch_last_kill(username, revalidate=False):
+    return fetch_data(event_url('lastkill', username), priority=True, revalidate=revalidate)
 
-def fetch_last_death(username):
-    url = f"https://api.2b2t.dev/stats?lastdeath={username}"
-    return fetch_data(url)
+def fetch_last_death(username, revalidate=False):
+    return fetch_data(event_url('lastdeath', username), priority=True, revalidate=revalidate)
 
-def fetch_first_kill(username):
-    url = f"https://api.2b2t.dev/stats?firstkill={username}"
-    return fetch_data(url)
+def fetch_first_kill(username, revalidate=False):
+    return fetch_data(event_url('firstkill', username), priority=True, revalidate=revalidate)
 
-def fetch_first_death(username):
-    url = f"https://api.2b2t.dev/stats?firstdeath={username}"
-    return fetch_data(url)
+def fetch_first_death(username, revalidate=False):
+    return fetch_data(event_url('firstdeath', username), priority=True, revalidate=revalidate)
 
-def fetch_last_seen(username):
-    url = f"https://api.2b2t.dev/seen?username={username}"
-    data = fetch_data(url)
+def fetch_last_seen(username, revalidate=False):
+    data = fetch_data(seen_url(username), revalidate=revalidate)
     if data and isinstance(data, list) and len(data) > 0:
         return data[0].get('seen')
     return None
 
-def update_user_data(username, db_queue, update_queue):
+# Only fetched once /seen has found the player, so they go ahead of other
+# users' /seen on the rate gate and a started user finishes in about two round trips
+EVENT_FETCHERS = {
+    'lastkill': fetch_last_kill,
+    'lastdeath': fetch_last_death,
+    'firstkill': fetch_first_kill,
+    'firstdeath': fetch_first_death,
+}
+
+def update_user_data(user, writers, journal, dead_letters, event_pool):
+    # `user` is a planner.PlannedUser; endpoints left out of its plan cannot have
+    # changed since the last crawl, so the stored lastseen stands in for /seen.
+    # Endpoints the journal already has for this run were committed before a restart.
+    # Ones whose counters moved skip the response cache's freshness shortcut.
+    # A failed request goes to the dead letters instead of being written, and its
+    # user keeps their stored row and stays due.
+    username = user.username
     try:
-        new_last_seen = fetch_last_seen(username)
+        if 'seen' in user.endpoints:
+            try:
+                new_last_seen = fetch_last_seen(username, 'seen' in user.changed)
+            except FetchFailed as e:
+                dead_letters.record(writers['main'], username, 'seen', e)
+                return False
+        else:
+            new_last_seen = user.lastseen
         if new_last_seen:
-            last_kill = fetch_last_kill(username)
-            last_death = fetch_last_death(username)
-            first_kill = fetch_first_kill(username)
-            first_death = fetch_first_death(username)
-
-            db_queue.put(('lastkill', username, last_kill[0] if last_kill else None))
-            db_queue.put(('lastdeath', username, last_death[0] if last_death else None))
-            db_queue.put(('firstkill', username, first_kill[0] if first_kill else None))
-            db_queue.put(('firstdeath', username, first_death[0] if first_death else None))
-
-            update_queue.put((username, new_last_seen))
-            return True
-        return False
+            # /seen found the player, so their event fetches go out together on
+            # the shared pool and each is written as soon as it comes back
+            done = journal.completed(username)
+            futures = {event_pool.submit(fetch, username, event in user.changed): event
+                       for event, fetch in EVENT_FETCHERS.items()
+                       if event in user.endpoints and event not in done}
+            failed = False
+            for future in as_completed(futures):
+                event = futures[future]
+                try:
+                    data = future.result()
+                except FetchFailed as e:
+                    dead_letters.record(writers['main'], username, event, e)
+                    failed = True
+                    continue
+                queue_event(writers[event], event, username, data[0] if data else None)
+                journal.record(writers[event], event, username, event)
+                dead_letters.resolve(writers['main'], username, event)
+            if failed:
+                return False
+
+            queue_player_update(writers['main'], user, new_last_seen)
+        else:
+            queue_not_seen(writers['main'], user)
+        dead_letters.resolve(writers['main'], username, 'seen')
+        journal.record(writers['main'], 'main', username, USER_DONE_ENDPOINT)
+        return bool(new_last_seen)
+    except WriterFailed:
+        raise  # Nothing more can be saved, so the crawl stops instead of failing every user
     except Exception as e:
         print(f"Error updating user data for {username}: {e}")
         return False
 
-def db_worker(db_queue, completion_event):
-    connections = {
-        'lastkill': sqlite3.connect(LASTKILL_DB_PATH),
-        'lastdeath': sqlite3.connect(LASTDEATH_DB_PATH),
-        'firstkill': sqlite3.connect(FIRSTKILL_DB_PATH),
-        'firstdeath': sqlite3.connect(FIRSTDEATH_DB_PATH)
-    }
-    cursors = {db: conn.cursor() for db, conn in connections.items()}
-
-    for db, cursor in cursors.items():
-        cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {db} (
-            username TEXT PRIMARY KEY,
-            date TEXT,
-            time TEXT,
-            message TEXT
-        )
-        ''')
-
-    while True:
-        try:
-            item = db_queue.get(timeout=1)
-            if item is None:
-                break
-
-            db_name, username, data = item
-            if data:
-                cursors[db_name].execute(f'''
-                INSERT OR REPLACE INTO {db_name} (username, date, time, message)
-                VALUES (?, ?, ?, ?)
-                ''', (username, data.get('date'), data.get('time'), data.get('message')))
-            else:
-                cursors[db_name].execute(f'''
-                INSERT OR REPLACE INTO {db_name} (username, date, time, message)
-                VALUES (?, NULL, NULL, NULL)
-                ''', (username,))
-
-            connections[db_name].commit()
-        except queue.Empty:
-            continue
-        except Exception as e:
-            print(f"Error in db_worker: {e}")
-
-    for conn in connections.values():
-        conn.close()
-    completion_event.set()
-
-def final_update_worker(update_queue, completion_event):
-    conn = sqlite3.connect(MAIN_DB_PATH)
-    cursor = conn.cursor()
+async def fetch_last_seen_async(session, limiter, username, revalidate=False):
+    data = await fetch_json(session, limiter, seen_url(username), revalidate=revalidate)
+    if data and isinstance(data, list) and len(data) > 0:
+        return data[0].get('seen')
+    return None
 
-    while True:
+async def update_user_data_async(session, limiter, user, writers, journal, dead_letters):
+    username = user.username
+    if 'seen' in user.endpoints:
         try:
-            item = update_queue.get(timeout=1)
-            if item is None:
-                break
-
-            username, new_last_seen = item
-            current_time = datetime.now().isoformat()
-            cursor.execute('''
-            UPDATE players 
-            SET lastseen = ?, lastupdated = ?
-            WHERE username = ?
-            ''', (new_last_seen, current_time, username))
-            conn.commit()
-        except queue.Empty:
-            continue
-        except Exception as e:
-            print(f"Error in final_update_worker: {e}")
+            new_last_seen = await fetch_last_seen_async(session, limiter, username, 'seen' in user.changed)
+        except FetchFailed as e:
+            dead_letters.record(writers['main'], username, 'seen', e)
+            return False
+    else:
+        new_last_seen = user.lastseen
+    if new_last_seen:
+        done = journal.completed(username)
+
+        async def fetch_event(event):
+            try:
+                data = await fetch_json(session, limiter, event_url(event, username), priority=True,
+                                        revalidate=event in user.changed)
+            except FetchFailed as e:
+                dead_letters.record(writers['main'], username, event, e)
+                return False
+            queue_event(writers[event], event, username, data[0] if data else None)
+            journal.record(writers[event], event, username, event)
+            dead_letters.resolve(writers['main'], username, event)
+            return True
 
+        # The limiter caps requests in flight across all users, however many each
+        # one fans out, and lets a started user's events ahead of new users' /seen
+        fetched = await asyncio.gather(*(fetch_event(event) for event in EVENT_DB_PATHS
+                                         if event in user.endpoints and event not in done))
+        if not all(fetched):
+            return False
+
+        queue_player_update(writers['main'], user, new_last_seen)
+    else:
+        queue_not_seen(writers['main'], user)
+    dead_letters.resolve(writers['main'], username, 'seen')
+    journal.record(writers['main'], 'main', username, USER_DONE_ENDPOINT)
+    return bool(new_last_seen)
+
+def ensure_event_tables():
+    # The event tables and their message search indexes; an index over rows
+    # that are already stored is built here once, before any writer starts
+    conn = sqlite3.connect(':memory:')
+    for event, path in EVENT_DB_PATHS.items():
+        conn.execute('ATTACH DATABASE ? AS ' + event, (path,))
+        conn.execute(EVENT_TABLE_SCHEMA.format(db=event))
+        if ensure_message_index(conn, event, event):
+            print(f"Built the message search index in {path}")
     conn.close()
-    completion_event.set()
+
+def start_writers(batch_size=DEFAULT_BATCH_SIZE, synchronous=DEFAULT_SYNCHRONOUS):
+    # A writer per database, keyed like the journal's schemas: 'main' for
+    # players.db and each event's name for its own file. An event database is
+    # attached to its writer's connection under that name, so the same
+    # schema-qualified SQL works whichever connection runs it.
+    ensure_crawl_state(MAIN_DB_PATH)
+    ensure_event_tables()
+    writers = {'main': BatchWriter(MAIN_DB_PATH, batch_size, synchronous=synchronous)}
+    for event, path in EVENT_DB_PATHS.items():
+        writers[event] = BatchWriter(':memory:', batch_size, synchronous=synchronous, attach={event: path},
+                                     setup=[EVENT_TABLE_SCHEMA.format(db=event)], name=event)
+    return WriterPool(writers).start()
+
+def queue_event(event_writer, db_name, username, data):
+    # A row of NULLs records that the API confirmed there is no such event yet
+    if data:
+        params = (username, data.get('date'), data.get('time'), data.get('message'))
+    else:
+        params = (username, None, None, None)
+    event_writer.put(EVENT_INSERT_SQL[db_name], params)
+
+def queue_player_update(player_writer, user, new_last_seen):
+    # The crawl_state snapshot goes in the same batch, so the next run's plan
+    # never sees counters for data that was not committed
+    player_writer.put(PLAYER_UPDATE_SQL, (new_last_seen, datetime.now().isoformat(), int(time.time()),
+                                          user.unchanged, user.username))
+    player_writer.put(CRAWL_STATE_SQL, crawl_state_params(user))
+
+def queue_not_seen(player_writer, user):
+    # Nothing to write for a player /seen knows nothing of, but they still move
+    # down the schedule instead of being due again on the next run
+    player_writer.put(NOT_SEEN_SQL, (int(time.time()), user.unchanged, user.username))
 
 def progress_reporter(progress_queue, total_users):
     start_time = time.time()
@@ -224,76 +297,152 @@ def progress_reporter(progress_queue, total_users):
             except queue.Empty:
                 continue
 
-def get_users_to_update():
-    conn = sqlite3.connect(MAIN_DB_PATH)
-    cursor = conn.cursor()
-
-    update_threshold = datetime.now() - timedelta(days=DAYS_BETWEEN_UPDATES)
-    cursor.execute('''
-    SELECT username FROM players
-    WHERE lastupdated IS NULL OR datetime(lastupdated) < ?
-    ''', (update_threshold.isoformat(),))
-
-    users_to_update = [row[0] for row in cursor.fetchall()]
-    conn.close()
-
-    return users_to_update
-
-def update_all_data():
-    update_main_database()
-
-    users_to_update = get_users_to_update()
-    total_users = len(users_to_update)
+def get_update_threshold():
+    # Players whose next refresh fell due before the run started
+    return datetime.now().isoformat()
+
+def get_users_to_update(journal, plan=True, dead_letters=None):
+    # The threshold is the run's, so a resumed run picks from the same users.
+    # An index range on next_due_epoch (new and changed players are 0), paged by
+    # (next_due_epoch, username) so each page continues the same range scan and
+    # the most overdue players come first. Given `dead_letters`, only the users
+    # with a failed request on an earlier run are picked, due or not. Returns
+    # their count and a function streaming them, so they can be read twice.
+    pending, pending_params = journal.pending_filter('p')
+    if dead_letters:
+        failed, failed_params = dead_letters.retry_filter('p', ['seen', *EVENT_DB_PATHS])
+        where = f"{failed} AND {pending}"
+        params = (*failed_params, *pending_params)
+    else:
+        where = f"p.next_due_epoch < {LASTUPDATED_EPOCH_SQL.format('?')} AND {pending}"
+        params = (journal.threshold, *pending_params)
+
+    ensure_crawl_state(MAIN_DB_PATH)
+    total_users = count_usernames(MAIN_DB_PATH, 'players p', where, params)
+    if dead_letters:
+        print(f"Users with failed requests to retry: {total_users}")
+    else:
+        changed = count_usernames(MAIN_DB_PATH, 'players p', f'p.next_due_epoch = 0 AND {pending}', pending_params)
+        print(f"Users due: {total_users} ({changed} new or with changed stats, the rest on schedule)")
+    if plan and total_users:
+        report_savings(estimate_savings(MAIN_DB_PATH, where, params))
+    return total_users, partial(stream_planned_users, MAIN_DB_PATH, where, params, enabled=plan, key=DUE_KEY)
+
+def update_all_data(use_async=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                    batch_size=DEFAULT_BATCH_SIZE, synchronous=DEFAULT_SYNCHRONOUS, plan=True, resume=False,
+                    budget=None, ingest=True, stop=None, retry_failed=False, parse=True):
+    # Returns True once every due user is done, False if the run was stopped.
+    # ingest=False skips the bulk stats pull (a shard worker's players.db is a
+    # snapshot made by the coordinator), and setting `stop` drains the run early.
+    # parse=False leaves the new events out of parsed_events.db (a shard's are
+    # parsed once it is merged).
+    # retry_failed crawls the users in the dead_letters table instead of the due ones.
+    journal = CrawlJournal(MAIN_DB_PATH, EVENT_DB_PATHS)
+    dead_letters = DeadLetters(MAIN_DB_PATH)
+    if resume and journal.resume():
+        print(f"Resuming run {journal.run_id} ({len(journal.partial)} users were part-way through)")
+    else:
+        if resume:
+            print("No interrupted run to resume, starting a new one.")
+        if ingest:
+            update_main_database()
+        journal.start(get_update_threshold())
+
+    total_users, stream_users = get_users_to_update(journal, plan, dead_letters if retry_failed else None)
+    users_to_update = dead_letters.with_failed_endpoints(stream_users())
+    if budget is not None:
+        # A dry pass over the same users finds where the budget runs out, so
+        # the count and the progress bar stop there too
+        request_budget = RequestBudget(budget)
+        total_users = request_budget.fits(dead_letters.with_failed_endpoints(stream_users()))
+        users_to_update = request_budget.take(users_to_update)
+        print(f"Spending at most {budget} requests on the most overdue users")
     print(f"Users to update: {total_users}")
 
     if total_users == 0:
+        journal.finish()
         print("No users need updating. Exiting.")
-        return
+        return True
 
-    db_queue = Queue()
-    update_queue = Queue()
     progress_queue = Queue()
 
-    db_worker_completion = Event()
-    final_update_completion = Event()
-
-    # Start the database worker threads
-    db_thread = Thread(target=db_worker, args=(db_queue, db_worker_completion))
-    db_thread.start()
-
-    # Start the final update worker thread
-    final_update_thread = Thread(target=final_update_worker, args=(update_queue, final_update_completion))
-    final_update_thread.start()
+    # Start a batching writer for players.db and for each event database
+    writers = start_writers(batch_size, synchronous)
 
     # Start the progress reporter thread
     progress_thread = Thread(target=progress_reporter, args=(progress_queue, total_users))
     progress_thread.start()
 
-    # Determine optimal worker count
-    max_workers = get_optimal_worker_count()
-    print(f"Using {max_workers} worker threads")
-
-    # Process users in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(update_user_data, username, db_queue, update_queue) for username in users_to_update]
-        for future in as_completed(futures):
-            if future.result():
-                progress_queue.put(1)
-
-    # Signal the workers to finish
-    db_queue.put(None)
-    update_queue.put(None)
-    progress_queue.put(None)
-
-    # Wait for all workers to complete
-    db_worker_completion.wait()
-    final_update_completion.wait()
-
-    db_thread.join()
-    final_update_thread.join()
-    progress_thread.join()
+    # Ctrl-C stops taking new users; the ones in flight finish and get flushed
+    stop = stop or Event()
+    previous_handler = drain_on_interrupt(stop)
 
+    try:
+        if use_async:
+            print(f"Using asyncio with {max_in_flight} requests in flight")
+            handle_user = partial(update_user_data_async, writers=writers, journal=journal,
+                                  dead_letters=dead_letters)
+            http_stats = run_crawl(users_to_update, handle_user, max_in_flight,
+                                   on_result=lambda updated: updated and progress_queue.put(1), stop=stop)
+        else:
+            # Determine optimal worker count; under rate control the threads are only a ceiling.
+            # Users' event fetches run on a second pool of the same size, so without
+            # a controller a fixed one keeps requests in flight at max_workers overall.
+            controller = get_rate_controller()
+            max_workers = controller.max_limit if controller else get_optimal_worker_count()
+            if not controller:
+                configure_rate_control(AdaptiveController(max_workers, adaptive=False))
+            print(f"Using {max_workers} worker threads")
+            configure_session(max_workers)
+
+            # Process users in parallel, keeping only a bounded window of them in flight
+            with ThreadPoolExecutor(max_workers, thread_name_prefix='event_fetch') as event_pool:
+                handle_user = partial(update_user_data, writers=writers, journal=journal,
+                                      dead_letters=dead_letters, event_pool=event_pool)
+                for updated in run_bounded(handle_user, users_to_update, max_workers, stop=stop):
+                    if updated:
+                        progress_queue.put(1)
+            http_stats = connection_stats()
+    finally:
+        # Stop the progress reporter, then flush whatever the writers still
+        # hold; also when the crawl raised (a second Ctrl-C or a dead writer
+        # included), so no thread is left waiting and the old handler comes
+        # back before close() raises a writer's error
+        progress_queue.put(None)
+        progress_thread.join()
+        signal.signal(signal.SIGINT, previous_handler)
+        writers.close()
+
+    # Encode the messages the writers just stored where the event databases
+    # are compact, then take them apart
+    report_compaction(*compact_event_tables(EVENT_DB_PATHS))
+    if parse:
+        report_parsed_events(update_parsed_events(MAIN_DB_PATH, EVENT_DB_PATHS))
+
+    report_connection_stats(http_stats)
+    print(dead_letters.summary())
+    if budget is not None:
+        print(request_budget.summary())
+    print(writers.summary())
+    if stop.is_set():
+        print(f"Run {journal.run_id} interrupted; everything fetched so far is saved. "
+              f"Run again with --resume to continue.")
+        return False
+    journal.finish()
     print("Database update completed.")
+    return True
 
 if __name__ == "__main__":
-    update_all_data()
\ No newline at end of file
+    parser = build_parser("Update players.db and the four event databases")
+    parser.add_argument('--no-plan', dest='plan', action='store_false',
+                        help="Fetch every endpoint instead of only those whose stats changed since the last crawl")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the last interrupted run instead of starting over")
+    parser.add_argument('--budget', type=int, default=None, metavar='N',
+                        help="Make at most N per-player requests, on the most overdue players first; "
+                             "the rest stay due for the next run")
+    args = parser.parse_args()
+    configure_from_args(args)
+    update_all_data(use_async=args.use_async, max_in_flight=args.max_in_flight,
+                    batch_size=args.batch_size, synchronous=args.synchronous, plan=args.plan,
+                    resume=args.resume, budget=args.budget, retry_failed=args.retry_failed)
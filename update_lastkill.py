@@ -1,48 +1,65 @@
 import sqlite3
-import requests
 import json
 import time
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from queue import Queue
 from threading import Lock, Thread
 from tqdm import tqdm
 
+from api import (event_url, configure_session, get_json, FetchFailed,
+                 connection_stats, report_connection_stats, get_rate_controller)
+from async_crawl import fetch_json, run_crawl, DEFAULT_MAX_IN_FLIGHT
+from cli import build_parser, configure_from_args
+from db_writer import BatchWriter, DEFAULT_BATCH_SIZE, DEFAULT_SYNCHRONOUS
+from dead_letters import DeadLetters
+from message_search import ensure_message_index
+from scheduler import count_usernames, stream_usernames, run_bounded
+
+LASTKILL_SQL = '''
+INSERT OR REPLACE INTO lastkill (username, date, time, message)
+VALUES (?, ?, ?, ?)
+'''
+
 def fetch_last_kill(username):
-    url = f"https://api.2b2t.dev/stats?lastkill={username}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data and isinstance(data, list) and len(data) > 0:
-            return username, data[0]
+    data = get_json(event_url('lastkill', username))
+    if data and isinstance(data, list) and len(data) > 0:
+        return username, data[0]
     return username, None
 
-def update_user(username, db_queue):
-    lastkill_data = fetch_last_kill(username)
-    db_queue.put(lastkill_data)
+def update_user(username, writer, dead_letters):
+    # A failed request leaves the stored row alone and goes to the dead letters
+    try:
+        lastkill_data = fetch_last_kill(username)
+    except FetchFailed as e:
+        dead_letters.record(writer, username, 'lastkill', e)
+        return None
+    queue_row(writer, lastkill_data)
+    dead_letters.resolve(writer, username, 'lastkill')
     return lastkill_data
 
-def db_worker(db_queue, conn, cursor, progress_queue, total_users):
-    users_updated = 0
-    while True:
-        item = db_queue.get()
-        if item is None:
-            break
-        username, data = item
-        if data:
-            cursor.execute('''
-            INSERT OR REPLACE INTO lastkill (username, date, time, message)
-            VALUES (?, ?, ?, ?)
-            ''', (username, data.get('date'), data.get('time'), data.get('message')))
-        else:
-            cursor.execute('''
-            INSERT OR REPLACE INTO lastkill (username, date, time, message)
-            VALUES (?, NULL, NULL, NULL)
-            ''', (username,))
-        conn.commit()
-        users_updated += 1
-        progress_queue.put(1)
-    conn.close()
+async def fetch_last_kill_async(session, limiter, username):
+    data = await fetch_json(session, limiter, event_url('lastkill', username))
+    if data and isinstance(data, list) and len(data) > 0:
+        return username, data[0]
+    return username, None
+
+async def update_user_async(session, limiter, username, writer, dead_letters):
+    try:
+        lastkill_data = await fetch_last_kill_async(session, limiter, username)
+    except FetchFailed as e:
+        dead_letters.record(writer, username, 'lastkill', e)
+        return None
+    queue_row(writer, lastkill_data)
+    dead_letters.resolve(writer, username, 'lastkill')
+    return lastkill_data
+
+def queue_row(writer, item):
+    username, data = item
+    if data:
+        writer.put(LASTKILL_SQL, (username, data.get('date'), data.get('time'), data.get('message')))
+    else:
+        writer.put(LASTKILL_SQL, (username, None, None, None))
 
 def progress_reporter(progress_queue, total_users):
     start_time = time.time()
@@ -62,11 +79,13 @@ def progress_reporter(progress_queue, total_users):
 def get_optimal_worker_count():
     return min(32, (os.cpu_count() or 1) + 4)  # Heuristic: CPU count + 4, max 32
 
-def load_usernames(cursor):
-    cursor.execute('SELECT username FROM players')
-    return [row[0] for row in cursor.fetchall()]
+def load_usernames(db_path, dead_letters=None):
+    # Every user, or with `dead_letters` only those whose last request failed
+    where, params = dead_letters.retry_filter('players', ['lastkill']) if dead_letters else ('1', ())
+    return count_usernames(db_path, 'players', where, params), stream_usernames(db_path, 'players', where, params)
 
-def update_lastkill_data():
+def update_lastkill_data(use_async=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                         batch_size=DEFAULT_BATCH_SIZE, synchronous=DEFAULT_SYNCHRONOUS, retry_failed=False):
     conn = sqlite3.connect('players.db', check_same_thread=False)
     cursor = conn.cursor()
 
@@ -80,45 +99,61 @@ def update_lastkill_data():
         FOREIGN KEY (username) REFERENCES players(username)
     )
     ''')
+    if ensure_message_index(conn, 'main', 'lastkill'):
+        print("Built the message search index")
+    conn.close()
 
     # Load all usernames
-    usernames = load_usernames(cursor)
-
-    total_users = len(usernames)
+    dead_letters = DeadLetters('players.db')
+    total_users, usernames = load_usernames('players.db', dead_letters if retry_failed else None)
     print(f"Total users to update: {total_users}")
 
     if total_users == 0:
         print("No users in the database. Exiting.")
         return
 
-    db_queue = Queue()
     progress_queue = Queue()
 
-    # Start the database worker thread
-    db_thread = Thread(target=db_worker, args=(db_queue, conn, cursor, progress_queue, total_users))
-    db_thread.start()
+    # Start the batching database writer; it reports progress as each batch commits
+    writer = BatchWriter('players.db', batch_size, synchronous=synchronous, on_flush=progress_queue.put).start()
 
     # Start the progress reporter thread
     progress_thread = Thread(target=progress_reporter, args=(progress_queue, total_users))
     progress_thread.start()
 
-    # Determine optimal worker count
-    max_workers = get_optimal_worker_count()
-    print(f"Using {max_workers} worker threads")
-
-    # Process users in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(update_user, username, db_queue) for username in usernames]
-        for future in as_completed(futures):
-            future.result()
-
-    # Signal the database worker and progress reporter to finish
-    db_queue.put(None)
-    progress_queue.put(None)
-    db_thread.join()
-    progress_thread.join()
-
+    try:
+        if use_async:
+            print(f"Using asyncio with {max_in_flight} requests in flight")
+            http_stats = run_crawl(usernames, partial(update_user_async, writer=writer, dead_letters=dead_letters),
+                                   max_in_flight)
+        else:
+            # Determine optimal worker count; under rate control the threads are only a ceiling
+            controller = get_rate_controller()
+            max_workers = controller.max_limit if controller else get_optimal_worker_count()
+            print(f"Using {max_workers} worker threads")
+            configure_session(max_workers)
+
+            # Process users in parallel, keeping only a bounded window of them in flight
+            handle_user = partial(update_user, writer=writer, dead_letters=dead_letters)
+            for _ in run_bounded(handle_user, usernames, max_workers):
+                pass
+            http_stats = connection_stats()
+    finally:
+        # Flush the writer, then signal the progress reporter to finish; also
+        # when the crawl raised, so the reporter isn't left waiting. close()
+        # raises if the writer died, after the reporter has been stopped.
+        try:
+            writer.close()
+        finally:
+            progress_queue.put(None)
+            progress_thread.join()
+
+    report_connection_stats(http_stats)
+    print(dead_letters.summary())
     print("Database update completed.")
 
 if __name__ == "__main__":
-    update_lastkill_data()
\ No newline at end of file
+    args = build_parser("Update lastkill data").parse_args()
+    configure_from_args(args)
+    update_lastkill_data(use_async=args.use_async, max_in_flight=args.max_in_flight,
+                         batch_size=args.batch_size, synchronous=args.synchronous, retry_failed=args.retry_failed)
\ No newline at end of file
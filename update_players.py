@@ -1,18 +1,11 @@
-import requests
 import sqlite3
 import json
 
-def fetch_data(url):
-    print(f"Fetching data from {url}...")
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        print(f"Successfully fetched data for {len(data)} players.")
-        return data
-    else:
-        raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+from api import all_stats_url, connection_stats, report_connection_stats
+from ingest import ingest_players, report_ingest_stats
+from refresh import ensure_refresh_columns
 
-def update_database(data, db_path):
+def update_database(url, db_path):
     print(f"Connecting to database: {db_path}")
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
@@ -31,62 +24,28 @@ def update_database(data, db_path):
         lastseen TEXT
     )
     ''')
+    # update_all.py schedules refreshes from these; players whose stats move here become due
+    ensure_refresh_columns(conn)
     print("Table check complete.")
 
-    print("Updating player data...")
-    players_updated = 0
-    players_inserted = 0
-
-    for player in data:
-        cursor.execute('SELECT * FROM players WHERE username = ?', (player['username'],))
-        existing_player = cursor.fetchone()
-
-        if existing_player:
-            cursor.execute('''
-            UPDATE players 
-            SET id = ?, uuid = ?, kills = ?, deaths = ?, joins = ?, leaves = ?, adminlevel = ?
-            WHERE username = ?
-            ''', (
-                player['id'],
-                player['uuid'],
-                player['kills'],
-                player['deaths'],
-                player['joins'],
-                player['leaves'],
-                player['adminlevel'],
-                player['username']
-            ))
-            players_updated += 1
-        else:
-            cursor.execute('''
-            INSERT INTO players 
-            (username, id, uuid, kills, deaths, joins, leaves, adminlevel)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                player['username'],
-                player['id'],
-                player['uuid'],
-                player['kills'],
-                player['deaths'],
-                player['joins'],
-                player['leaves'],
-                player['adminlevel']
-            ))
-            players_inserted += 1
+    print(f"Streaming player data from {url}...")
+    stats = ingest_players(conn, url=url)
+    report_ingest_stats(stats)
 
     conn.commit()
     conn.close()
 
-    print(f"Database update complete. {players_updated} players updated, {players_inserted} new players inserted.")
+    print(f"Database update complete. {stats['changed']} players updated, {stats['inserted']} new players inserted, "
+          f"{stats['unchanged']} unchanged.")
 
 def main():
-    url = "https://api.2b2t.dev/stats?username=all"
+    url = all_stats_url()
     db_path = "players.db"
 
     try:
         print("Starting database update process...")
-        data = fetch_data(url)
-        update_database(data, db_path)
+        update_database(url, db_path)
+        report_connection_stats(connection_stats())
         print("Database updated successfully.")
     except Exception as e:
         print(f"An error occurred: {str(e)}")